@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Real-time (streaming) QC of BOLD runs."""
+import sys
+from pathlib import Path
+from argparse import ArgumentParser
+from argparse import RawTextHelpFormatter
+from textwrap import dedent
+
+from .. import __version__
+
+
+def get_parser():
+    """Build parser object"""
+    parser = ArgumentParser(
+        formatter_class=RawTextHelpFormatter,
+        description=dedent(
+            """\
+MRIQC real-time BOLD QC
+-----------------------
+
+Computes framewise displacement, DVARS, tSNR, global signal and spikes as the \
+volumes of a BOLD run arrive, writing one JSON record per volume. \
+The input can be a directory where the scanner exports one NIfTI file per \
+volume, or a 4D NIfTI file (which is replayed volume by volume).\
+"""
+        ),
+    )
+    parser.add_argument(
+        "-v", "--version", action="version", version="mriqc v{}".format(__version__)
+    )
+    parser.add_argument(
+        "source", action="store", type=Path,
+        help="directory receiving per-volume NIfTI files, or a 4D NIfTI file",
+    )
+    parser.add_argument(
+        "--feed", action="store", type=Path,
+        help="JSON-lines file with one record per volume (default: standard output)",
+    )
+    parser.add_argument(
+        "--out-iqms", action="store", type=Path,
+        help="write the final IQMs to this JSON file",
+    )
+    parser.add_argument(
+        "--reference", action="store", type=Path,
+        help="reference volume for motion estimation (default: first volume)",
+    )
+    parser.add_argument("--mask", action="store", type=Path, help="brain mask")
+    parser.add_argument(
+        "--pattern", action="store", default="*.nii*",
+        help="pattern of the per-volume files within the source directory",
+    )
+    parser.add_argument(
+        "--n-volumes", action="store", type=int,
+        help="stop after this number of volumes",
+    )
+    parser.add_argument(
+        "--timeout", action="store", type=float, default=30.0,
+        help="stop when no new volume arrives within this many seconds",
+    )
+    parser.add_argument(
+        "--fd-thres", "--fd_thres", action="store", type=float, default=0.2,
+        help="threshold on framewise displacement estimates to detect outliers",
+    )
+    parser.add_argument(
+        "--fd-radius", "--fd_radius", action="store", type=float, default=50.0,
+        help="radius in mm of the sphere for the FD calculation",
+    )
+    parser.add_argument(
+        "--spike-thresh", action="store", type=float, default=6.0,
+        help="z-score to call one timepoint of one slice a spike",
+    )
+    return parser
+
+
+def main():
+    """Entry point"""
+    from ..qc.realtime import RealTimeQC, iter_volumes, iter_volumes_from_dir
+
+    opts = get_parser().parse_args()
+
+    if opts.source.is_dir():
+        volumes = iter_volumes_from_dir(
+            opts.source, pattern=opts.pattern, timeout=opts.timeout,
+            n_volumes=opts.n_volumes)
+    else:
+        volumes = iter_volumes(opts.source)
+
+    feed = sys.stdout if opts.feed is None else opts.feed.open("w")
+    try:
+        rtqc = RealTimeQC(
+            reference=opts.reference,
+            mask=opts.mask,
+            fd_radius=opts.fd_radius,
+            fd_thres=opts.fd_thres,
+            spike_thresh=opts.spike_thresh,
+            feed=feed,
+        )
+        for i, volume in enumerate(volumes):
+            if opts.n_volumes is not None and i >= opts.n_volumes:
+                break
+            rtqc.update(volume)
+    finally:
+        if feed is not sys.stdout:
+            feed.close()
+
+    if opts.out_iqms is not None:
+        rtqc.write_iqms(opts.out_iqms)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,11 @@
 # @Last Modified time: 2018-03-12 11:50:21
 
 """
-Extracts the sha hash of the contents of a nifti file.
+Extracts the sha hash of the contents of nifti files.
 
 """
-
-import nibabel as nb
-from hashlib import sha1
+import os
+from pathlib import Path
 
 
 def get_parser():
@@ -19,25 +18,79 @@ def get_parser():
     from argparse import ArgumentParser, RawTextHelpFormatter
 
     parser = ArgumentParser(
-        description="compare two pandas dataframes",
+        description="hash the voxel data and geometry of nifti files",
         formatter_class=RawTextHelpFormatter,
     )
-    parser.add_argument("input_file", action="store", help="input nifti file")
+    parser.add_argument(
+        "input_file",
+        action="store",
+        nargs="+",
+        help="input nifti files, or folders to be searched for nifti files",
+    )
+    parser.add_argument(
+        "--digest-cache",
+        action="store",
+        help="database of previously computed digests (created if it does not exist), "
+        "which also indexes files by their hash",
+    )
+    parser.add_argument(
+        "--nprocs",
+        action="store",
+        type=int,
+        default=1,
+        help="number of files hashed in parallel",
+    )
+    parser.add_argument(
+        "--duplicates",
+        action="store_true",
+        default=False,
+        help="only print files with the same data as a preceding file, "
+        "followed by the latter",
+    )
     return parser
 
 
-def get_hash(nii_file):
+def _expand(inputs):
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files += sorted(
+                str(f) for f in Path(item).rglob("*.nii*")
+                if f.name.endswith((".nii", ".nii.gz"))
+            )
+        else:
+            files.append(item)
+    return files
+
+
+def get_hash(nii_file, cache=None):
     """ Compute hash """
-    data = nb.load(nii_file).get_data()
-    data.flags.writeable = False
-    return sha1(data.data.tobytes()).hexdigest()
+    from mriqc.utils.digest import VOXEL_DIGEST, file_digest, voxel_digest
+
+    return file_digest(nii_file, algorithm=VOXEL_DIGEST, cache=cache, digest=voxel_digest)
 
 
 def main():
     """Entry point"""
-    fname = get_parser().parse_args().input_file
-    sha = get_hash(fname)
-    print("%s %s" % (sha, fname))
+    from mriqc.utils.digest import VOXEL_DIGEST, digest_files, voxel_digest
+
+    opts = get_parser().parse_args()
+    files = _expand(opts.input_file)
+    digests = digest_files(
+        files, VOXEL_DIGEST, cache=opts.digest_cache, digest=voxel_digest, nprocs=opts.nprocs
+    )
+
+    if not opts.duplicates:
+        for fname, sha in zip(files, digests):
+            print("%s %s" % (sha, fname))
+        return
+
+    originals = {}
+    for fname, sha in zip(files, digests):
+        if sha in originals:
+            print("%s %s" % (fname, originals[sha]))
+        else:
+            originals[sha] = fname
 
 
 if __name__ == "__main__":
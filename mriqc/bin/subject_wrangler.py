@@ -6,6 +6,8 @@ from builtins import range  # pylint: disable=W0622
 
 import os.path as op
 import glob
+import shlex
+import sys
 from random import shuffle
 
 # from lockfile import LockFile
@@ -69,6 +71,21 @@ requested participants have the corresponding folder in the bids_dir.\
         type=int,
         help="parallelize participants in groups",
     )
+    parser.add_argument(
+        "--target-runtime",
+        action="store",
+        type=float,
+        help="estimate the cost of each participant from the headers of its images, and "
+        "bin-pack participants into groups expected to run for about this many hours "
+        "(overrides --group-size)",
+    )
+    parser.add_argument(
+        "--job-cpus",
+        default=1,
+        action="store",
+        type=int,
+        help="CPUs available to each job, with --target-runtime",
+    )
     parser.add_argument(
         "--no-randomize",
         default=False,
@@ -127,7 +144,12 @@ requested participants have the corresponding folder in the bids_dir.\
     if gsize == 0:
         gsize = len(subject_list)
 
-    groups = [subject_list[i:i + gsize] for i in range(0, len(subject_list), gsize)]
+    if opts.target_runtime:
+        groups = _balanced_groups(
+            bids_dir, subject_list, opts.target_runtime, opts.job_cpus, opts.args
+        )
+    else:
+        groups = [subject_list[i:i + gsize] for i in range(0, len(subject_list), gsize)]
 
     log_arg = "".format
     if opts.log_groups:
@@ -156,5 +178,40 @@ requested participants have the corresponding folder in the bids_dir.\
         )
 
 
+def _balanced_groups(bids_dir, subject_list, target_runtime, job_cpus, args):
+    """Bin-pack participants into groups of similar estimated CPU time and memory."""
+    from ..engine.costs import n_shards, pack, participant_cost
+
+    # Options of the BIDS-App that change the cost of processing
+    app_parser = ArgumentParser(add_help=False)
+    app_parser.add_argument("-m", "--modalities", nargs="*")
+    app_parser.add_argument("--fft-spikes-detector", action="store_true")
+    app_parser.add_argument("--ica", action="store_true")
+    app_opts, _ = app_parser.parse_known_args(shlex.split(args))
+
+    costs = {
+        subject: participant_cost(
+            bids_dir,
+            subject,
+            modalities=app_opts.modalities,
+            fft_spikes_detector=app_opts.fft_spikes_detector,
+            ica=app_opts.ica,
+        )
+        for subject in subject_list
+    }
+    groups = pack(costs, n_shards(costs, target_runtime, job_cpus))
+    for i, group in enumerate(groups):
+        print(
+            "Group {:04d}: {:d} participants, {:.2f} CPU-hours, {:.1f} GB".format(
+                i,
+                len(group),
+                sum(costs[s][0] for s in group),
+                sum(costs[s][1] for s in group),
+            ),
+            file=sys.stderr,
+        )
+    return groups
+
+
 if __name__ == "__main__":
     main()
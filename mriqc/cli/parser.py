@@ -8,7 +8,6 @@ import re
 def _build_parser():
     """Build parser object."""
     import sys
-    from shutil import which
     from functools import partial
     from pathlib import Path
     from argparse import (
@@ -168,6 +167,13 @@ Automated Quality Control and visual reports for Quality Assesment of structural
         type=PositiveInt,
         help="Maximum number of threads per-process.",
     )
+    g_perfm.add_argument(
+        "--min-omp-nthreads",
+        action="store",
+        type=PositiveInt,
+        help="Let multithreaded nodes (ANTs, N4) run with as few as this many threads, "
+        "and up to --omp-nthreads, depending on the CPUs free when they start.",
+    )
     g_perfm.add_argument(
         "--mem",
         "--mem_gb",
@@ -192,6 +198,86 @@ Automated Quality Control and visual reports for Quality Assesment of structural
         help="Cast the input data to float32 if it's represented in higher precision "
         "(saves space and improves perfomance).",
     )
+    g_perfm.add_argument(
+        "--float64",
+        dest="dtype",
+        action="store_const",
+        const="float64",
+        default="float32",
+        help="Compute on double-precision arrays (by default, images are loaded in "
+        "single precision, which halves the memory of most nodes).",
+    )
+    g_perfm.add_argument(
+        "--intermediate-format",
+        action="store",
+        choices=["compressed", "uncompressed"],
+        default="compressed",
+        help="Format of intermediate images in the working directory: gzipped "
+        "(compressed) or uncompressed. Reports and IQMs are not affected.",
+    )
+    g_perfm.add_argument(
+        "--data-cache",
+        action="store_true",
+        default=False,
+        help="Keep one uncompressed copy of large intermediates (e.g., BOLD timeseries) "
+        "in the working directory, read by all nodes through memory mapping and "
+        "deleted when each run is finished (trades disk space for CPU time).",
+    )
+    g_perfm.add_argument(
+        "--clean-workdir",
+        action="store_true",
+        default=False,
+        help="Delete large intermediate files (images, transforms) of each run from the "
+        "working directory as soon as its IQMs and report have been written. Reports "
+        "and nipype's records are kept, but the cleaned nodes will be recomputed if "
+        "the workflow is run again.",
+    )
+    g_perfm.add_argument(
+        "--skip-duplicates",
+        action="store_true",
+        default=False,
+        help="Hash the voxel data of all inputs (through an index kept in the working "
+        "directory) and process only once those with identical data. The IQMs of "
+        "duplicates are copied from the processed image.",
+    )
+    g_perfm.add_argument(
+        "--shard-size",
+        action="store",
+        type=PositiveInt,
+        help="Build and run the workflow over batches of participants holding about this "
+        "many input files, rather than all inputs at once. The next batch is built while "
+        "the current one runs, and all batches share the same worker processes.",
+    )
+    g_perfm.add_argument(
+        "--queue",
+        action="store",
+        type=Path,
+        help="Directory of a work queue shared (e.g., on a network filesystem) by any "
+        "number of MRIQC processes. Each process claims participants one at a time, "
+        "processes them, and exits when none is left to claim.",
+    )
+    g_perfm.add_argument(
+        "--max-worker-tasks",
+        action="store",
+        type=int,
+        help="Keep MultiProc worker processes alive across tasks, and restart them "
+        "after they have run this many tasks.",
+    )
+    g_perfm.add_argument(
+        "--max-worker-rss-gb",
+        action="store",
+        type=float,
+        help="Keep MultiProc worker processes alive across tasks, and restart them "
+        "when their resident memory grows beyond this limit (GB).",
+    )
+    g_perfm.add_argument(
+        "--calibration",
+        action="store",
+        type=Path,
+        help="Database of the resources used by nodes in previous runs (created if it "
+        "does not exist). Nodes with enough records reserve memory and CPUs following "
+        "a model fitted on them. With --profile, this run's usage is added to it.",
+    )
     g_perfm.add_argument(
         "--pdb",
         dest="pdb",
@@ -222,6 +308,7 @@ Automated Quality Control and visual reports for Quality Assesment of structural
     )
     g_outputs.add_argument(
         "--profile",
+        dest="resource_monitor",
         action="store_true",
         default=False,
         help="Hook up the resource profiler callback to nipype.",
@@ -284,14 +371,20 @@ Automated Quality Control and visual reports for Quality Assesment of structural
 
     # Functional workflow settings
     g_func = parser.add_argument_group("Functional MRI workflow configuration")
-    if which("melodic") is not None:
-        g_func.add_argument(
-            "--ica",
-            action="store_true",
-            default=False,
-            help="Run ICA on the raw data and include the components "
-            "in the individual reports (slow but potentially very insightful).",
-        )
+    g_func.add_argument(
+        "--ica",
+        action="store_true",
+        default=False,
+        help="Run ICA on the raw data and include the components "
+        "in the individual reports (slow but potentially very insightful).",
+    )
+    g_func.add_argument(
+        "--ica-components",
+        action="store",
+        type=int,
+        default=20,
+        help="Number of independent components estimated with --ica.",
+    )
     g_func.add_argument(
         "--fft-spikes-detector",
         action="store_true",
@@ -333,6 +426,22 @@ Automated Quality Control and visual reports for Quality Assesment of structural
         help="Final volume in functional timeseries that should be "
         "considered for preprocessing.",
     )
+    g_func.add_argument(
+        "--multi-echo",
+        action="store_true",
+        default=False,
+        help="Process the echoes of multi-echo runs together: head-motion, brain mask "
+        "and spatial normalization are estimated on the first echo only, and "
+        "per-echo and T2* measures are added to the first echo's IQMs.",
+    )
+    g_func.add_argument(
+        "--session-registration",
+        action="store_true",
+        default=False,
+        help="Register to MNI only one reference per session and phase-encoding "
+        "direction, and align each BOLD run to its session reference with a rigid "
+        "transform (faster for protocols with many runs per session).",
+    )
     g_func.add_argument(
         "--correct-slice-timing",
         action="store_true",
@@ -495,18 +604,50 @@ Please, check out your currently set filters:
             f'{", ".join(unknown_mods)}.'
         )
 
-    # Estimate the biggest file size
-    config.workflow.biggest_file_gb = _get_biggest_file_size_gb(
+    if config.workflow.skip_duplicates:
+        _drop_duplicates()
+
+    # Estimate the size of each input, and the biggest
+    config.workflow.file_size_gb = _get_file_sizes_gb(
         [i for sublist in config.workflow.inputs.values() for i in sublist]
     )
+    config.workflow.biggest_file_gb = max(config.workflow.file_size_gb.values(), default=0)
+
+
+def _drop_duplicates():
+    """Remove from the inputs those images with the same data as another input."""
+    from ..utils.digest import find_duplicates
+
+    duplicates = {}
+    for mod, files in config.workflow.inputs.items():
+        if mod == "bold" and config.workflow.multi_echo:
+            # Echoes are processed in groups, keep them together
+            continue
+        found = find_duplicates(
+            files,
+            cache=config.execution.work_dir / "digests.db",
+            nprocs=config.nipype.nprocs,
+        )
+        for dup, orig in found.items():
+            config.loggers.cli.warning(
+                "Input <%s> has the same image data as <%s>, and will not be processed.",
+                dup,
+                orig,
+            )
+        config.workflow.inputs[mod] = [f for f in files if f not in found]
+        duplicates.update(found)
+    config.workflow.duplicates = duplicates or None
 
 
-def _get_biggest_file_size_gb(files):
+def _get_file_sizes_gb(files):
+    """Size the data block (uncompressed, as given by the headers) of each input."""
     import os
+    from ..utils.nifti import image_info
 
-    max_size = 0
+    sizes = {}
     for file in files:
-        size = os.path.getsize(file) / (1024 ** 3)
-        if size > max_size:
-            max_size = size
-    return max_size
+        try:
+            sizes[file] = image_info(file).nbytes / (1024 ** 3)
+        except Exception:
+            sizes[file] = os.path.getsize(file) / (1024 ** 3)
+    return sizes
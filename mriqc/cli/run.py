@@ -8,8 +8,8 @@ def main():
     import os
     import sys
     import gc
-    from multiprocessing import Process, Manager
     from .parser import parse_args
+    from .workflow import iter_workflows
     from ..utils.bids import write_derivative_description, write_bidsignore
 
     # Run parser
@@ -36,46 +36,128 @@ def main():
       * Analysis levels: {config.workflow.analysis_level}.
 """,
         )
+        shards = None
+        queue = None
+        claimed = []
+        failed = []
+        if config.execution.queue and not config.execution.dry_run:
+            from ..engine.workqueue import WorkQueue
+            from ..utils.bids import group_participants
+
+            participants = group_participants(config.workflow.inputs)
+            queue = WorkQueue(config.execution.queue)
+
+            def _claims():
+                # Participants are claimed right before their workflow is built
+                for label in queue.claims(participants):
+                    config.loggers.cli.log(25, f"Claimed participant <{label}> from the queue.")
+                    claimed.append(label)
+                    yield participants[label]
+
+            shards = _claims()
+        elif config.execution.shard_size:
+            from ..utils.bids import shard_inputs
+
+            shards = shard_inputs(config.workflow.inputs, config.execution.shard_size) or None
+            config.loggers.cli.log(
+                25, f"Processing the inputs in {len(shards)} shards of participants."
+            )
+
+        # Shards share the plugin, and with it the pool of worker processes
+        plugin_settings = None
+
         # CRITICAL Call build_workflow(config_file, retval) in a subprocess.
         # Because Python on Linux does not ever free virtual memory (VM), running the
         # workflow construction jailed within a process preempts excessive VM buildup.
-        with Manager() as mgr:
-            from .workflow import build_workflow
-
-            retval = mgr.dict()
-            p = Process(target=build_workflow, args=(str(config_file), retval))
-            p.start()
-            p.join()
-
-            mriqc_wf = retval.get("workflow", None)
-            retcode = p.exitcode or retval.get("return_code", 0)
-
-        # CRITICAL Load the config from the file. This is necessary because the ``build_workflow``
-        # function executed constrained in a process may change the config (and thus the global
-        # state of MRIQC).
-        config.load(config_file)
-
-        retcode = retcode or (mriqc_wf is None) * os.EX_SOFTWARE
-        if retcode != 0:
-            sys.exit(retcode)
-
-        if mriqc_wf and config.execution.write_graph:
-            mriqc_wf.write_graph(graph2use="colored", format="svg", simple_form=True)
-
-        # Clean up master process before running workflow, which may create forks
-        gc.collect()
+        # With a queue, the next participant is only claimed once the current one is done.
+        try:
+            for index, (retcode, mriqc_wf) in enumerate(
+                iter_workflows(config_file, shards, prefetch=queue is None)
+            ):
+                if index == 0:
+                    # CRITICAL Load the config from the file. This is necessary because the
+                    # ``build_workflow`` function executed constrained in a process may change
+                    # the config (and thus the global state of MRIQC).
+                    config.load(config_file)
+
+                retcode = retcode or (mriqc_wf is None) * os.EX_SOFTWARE
+                if retcode != 0:
+                    if queue is not None:
+                        queue.release(claimed[index], status="failed")
+                    sys.exit(retcode)
+
+                if index == 0 and config.execution.write_graph:
+                    mriqc_wf.write_graph(graph2use="colored", format="svg", simple_form=True)
+
+                # Clean up master process before running workflow, which may create forks
+                gc.collect()
+
+                if not config.execution.dry_run:
+                    if plugin_settings is None:
+                        # Warn about submitting measures BEFORE
+                        if not config.execution.no_sub:
+                            config.loggers.cli.warning(config.DSA_MESSAGE)
+                        plugin_settings = config.nipype.get_plugin()
+
+                    # run MRIQC
+                    try:
+                        mriqc_wf.run(**plugin_settings)
+                    except Exception:
+                        if queue is None:
+                            raise
+                        # Move on to the next participant of the queue
+                        config.loggers.cli.exception(
+                            f"Processing participant <{claimed[index]}> failed."
+                        )
+                        queue.release(claimed[index], status="failed")
+                        failed.append(claimed[index])
+                    else:
+                        if queue is not None:
+                            queue.release(claimed[index])
+
+                del mriqc_wf
+        finally:
+            if plugin_settings is not None and hasattr(plugin_settings["plugin"], "close"):
+                plugin_settings["plugin"].close()
+            if queue is not None:
+                # Hand the participants still claimed back to the queue
+                queue.close()
 
         if not config.execution.dry_run:
-            # Warn about submitting measures BEFORE
-            if not config.execution.no_sub:
-                config.loggers.cli.warning(config.DSA_MESSAGE)
-
-            # run MRIQC
-            mriqc_wf.run(**config.nipype.get_plugin())
+            # IQMs of inputs skipped for having the same data as another input
+            if config.workflow.duplicates:
+                from ..utils.bids import alias_iqms
+
+                processed = None
+                if queue is not None:
+                    # Other processes alias the duplicates of their own participants
+                    processed = {
+                        fname
+                        for label in claimed
+                        if label not in failed
+                        for files in participants[label].values()
+                        for fname in files
+                    }
+
+                for dup_file, orig_file in config.workflow.duplicates.items():
+                    if processed is not None and orig_file not in processed:
+                        continue
+                    alias_iqms(
+                        orig_file,
+                        dup_file,
+                        config.execution.bids_dir,
+                        config.execution.output_dir,
+                    )
 
             # Warn about submitting measures AFTER
             if not config.execution.no_sub:
                 config.loggers.cli.warning(config.DSA_MESSAGE)
+
+        if failed:
+            config.loggers.cli.critical(
+                f"Processing failed for participant(s): {', '.join(failed)}."
+            )
+            sys.exit(os.EX_SOFTWARE)
         config.loggers.cli.log(25, "Participant level finished successfully.")
 
     # Set up group level
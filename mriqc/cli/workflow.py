@@ -9,15 +9,61 @@ a hard-limited memory-scope.
 """
 
 
-def build_workflow(config_file, retval):
-    """Create the Nipype Workflow that supports the whole execution graph."""
+def build_workflow(config_file, retval, inputs=None):
+    """
+    Create the Nipype Workflow that supports the whole execution graph.
+
+    If ``inputs`` are given, they replace :attr:`~mriqc.config.workflow.inputs`,
+    e.g., to build the workflow of one shard of the dataset.
+
+    """
     from .. import config
     from ..workflows.core import init_mriqc_wf
 
     config.load(config_file)
+    if inputs is not None:
+        config.workflow.inputs = inputs
     retval["return_code"] = 1
     retval["workflow"] = None
 
     retval["workflow"] = init_mriqc_wf()
     retval["return_code"] = int(retval["workflow"] is None)
     return retval
+
+
+def iter_workflows(config_file, shards=None, prefetch=True):
+    """
+    Build workflows in subprocesses, one per shard of inputs (or a single one if ``None``).
+
+    With ``prefetch``, the workflow of the next shard is built while the caller runs
+    the current one.
+
+    :param shards: an iterable of inputs (see :attr:`~mriqc.config.workflow.inputs`),
+        consumed one item ahead of the workflows returned with ``prefetch``, or only
+        when the next workflow is requested otherwise
+    :return: a generator of ``(return_code, workflow)`` tuples
+
+    """
+    from multiprocessing import Manager, Process
+
+    shards = iter([None] if shards is None else shards)
+    with Manager() as mgr:
+
+        def _start():
+            for inputs in shards:
+                retval = mgr.dict()
+                proc = Process(target=build_workflow, args=(str(config_file), retval, inputs))
+                proc.start()
+                return proc, retval
+            return None
+
+        pending = _start()
+        while pending is not None:
+            proc, retval = pending
+            proc.join()
+            workflow = retval.get("workflow", None)
+            retcode = proc.exitcode or retval.get("return_code", 0)
+            pending = _start() if prefetch and retcode == 0 else None
+            yield retcode, workflow
+            if not prefetch and retcode == 0:
+                pending = _start()
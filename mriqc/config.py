@@ -238,12 +238,24 @@ class environment(_Config):
 class nipype(_Config):
     """Nipype settings."""
 
+    _paths = ("calibration",)
+
+    calibration = None
+    """Store of observed resource usage, recorded with :attr:`resource_monitor` and used to
+    size node reservations (see :mod:`mriqc.utils.calibration`)."""
     crashfile_format = "txt"
     """The file format for crashfiles, either text or pickle."""
     get_linked_libs = False
     """Run NiPype's tool to enlist linked libraries for every interface."""
+    max_worker_rss_gb = None
+    """Recycle MultiProc workers whose resident memory exceeds this limit (GB)."""
+    max_worker_tasks = None
+    """Recycle MultiProc workers after they have run this many tasks."""
     memory_gb = None
     """Estimation in GB of the RAM this workflow can allocate at any given time."""
+    min_omp_nthreads = None
+    """Fewest threads given to multithreaded nodes, which are then allocated up to
+    :attr:`omp_nthreads` depending on the free CPUs when they start."""
     nprocs = os.cpu_count()
     """Number of processes (compute tasks) that can be run in parallel (multiprocessing only)."""
     omp_nthreads = int(os.getenv('OMP_NUM_THREADS', os.cpu_count()))
@@ -271,6 +283,33 @@ class nipype(_Config):
             out["plugin_args"]["nprocs"] = int(cls.nprocs)
             if cls.memory_gb:
                 out["plugin_args"]["memory_gb"] = float(cls.memory_gb)
+        if cls.resource_monitor and cls.calibration:
+            from .utils.calibration import CalibrationRecorder
+
+            # Not stored in the settings (callbacks cannot be serialized)
+            out["plugin_args"] = {
+                **out["plugin_args"],
+                "status_callback": CalibrationRecorder(cls.calibration),
+            }
+        if cls.plugin == "MultiProc":
+            from .engine.plugin import MultiProcPlugin
+
+            models = None
+            if cls.calibration:
+                from .utils.calibration import CalibrationStore
+
+                models = CalibrationStore(cls.calibration).models()
+
+            out["plugin_args"] = {
+                **out["plugin_args"],
+                "n_procs": int(cls.nprocs),
+                "max_tasks": cls.max_worker_tasks,
+                "max_rss_gb": cls.max_worker_rss_gb,
+                "models": models,
+                # Shards are run one after the other with the same workers
+                "keep_pool": bool(execution.shard_size or execution.queue),
+            }
+            out["plugin"] = MultiProcPlugin(plugin_args=out["plugin_args"])
         return out
 
     @classmethod
@@ -313,16 +352,25 @@ class execution(_Config):
     """An existing path to the dataset, which must be BIDS-compliant."""
     bids_description_hash = None
     """Checksum (SHA256) of the ``dataset_description.json`` of the BIDS dataset."""
+    clean_workdir = False
+    """Delete the bulky intermediates of each run once its IQMs and report are written."""
+    data_cache = False
+    """Keep uncompressed, memory-mappable copies of large intermediates in the work directory."""
     debug = False
     """Run in sloppy mode (meaning, suboptimal parameters that minimize run-time)."""
     dry_run = False
     """Just test, do not run."""
+    dtype = "float32"
+    """Floating point precision of the data arrays interfaces compute on (``float64`` is
+    opt-in)."""
     dsname = "<unset>"
     """A dataset name used when generating files from the rating widget."""
     echo_id = None
     """Select a particular echo for multi-echo EPI datasets."""
     float32 = True
     """Cast the input data to float32 if it's represented whith higher precision."""
+    intermediate_format = "compressed"
+    """Format of intermediate images: ``compressed`` (gzipped) or ``uncompressed``."""
     layout = None
     """A :py:class:`~bids.layout.BIDSLayout` object, see :py:func:`init`."""
     log_dir = None
@@ -339,6 +387,9 @@ class execution(_Config):
     """List of participant identifiers that are to be preprocessed."""
     pdb = False
     """Drop into PDB when exceptions are encountered."""
+    queue = None
+    """Directory of a work queue shared with other MRIQC processes, to claim participants
+    from (see :mod:`mriqc.engine.workqueue`)."""
     reports_only = False
     """Only build the reports, based on the reportlets found in a cached working directory."""
     run_id = None
@@ -347,6 +398,9 @@ class execution(_Config):
     """Unique identifier of this particular run."""
     session_id = None
     """Filter input dataset by session identifier."""
+    shard_size = None
+    """Build and run the workflow over shards of (about) this many inputs, rather than
+    over all the inputs at once."""
     task_id = None
     """Select a particular task from all available in the dataset."""
     templateflow_home = _templateflow_home
@@ -374,6 +428,7 @@ class execution(_Config):
         "layout",
         "log_dir",
         "output_dir",
+        "queue",
         "templateflow_home",
         "work_dir",
     )
@@ -426,18 +481,33 @@ class workflow(_Config):
     """Deoblique the functional scans during head motion correction preprocessing."""
     despike = False
     """Despike the functional scans during head motion correction preprocessing."""
+    duplicates = None
+    """Inputs skipped by :attr:`skip_duplicates`, mapped onto the processed input with the
+    same voxel data."""
     fd_thres = 0.2
     """Threshold on Framewise Displacement estimates to detect outliers."""
     fd_radius = 50
     """Radius in mm. of the sphere for the FD calculation."""
+    file_size_gb = None
+    """Size in GB of the (uncompressed) data of each input file."""
     fft_spikes_detector = False
     """Turn on FFT based spike detector (slow)."""
     headmask = "BET"
     """Use FSL BET in :py:func:`~mriqc.workflows.anatomical.headmsk_wf`."""
     ica = False
     """Run ICA on the raw data and include the components in the individual reports."""
+    ica_components = 20
+    """Number of independent components estimated when :attr:`ica` is set."""
     inputs = None
     """List of files to be processed with MRIQC."""
+    multi_echo = False
+    """Process the echoes of multi-echo BOLD runs together, estimating head-motion and
+    brain mask only on the first echo."""
+    session_registration = False
+    """Register one reference per session and phase-encoding direction to MNI, and
+    align each BOLD run rigidly to its session reference."""
+    skip_duplicates = False
+    """Process only once the inputs with identical voxel data, copying the IQMs over."""
     start_idx = None
     """Initial volume in functional timeseries that should be considered for preprocessing."""
     stop_idx = None
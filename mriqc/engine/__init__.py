@@ -0,0 +1,10 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Execution of MRIQC's workflows."""
+from .plugin import MultiProcPlugin
+from .workqueue import WorkQueue
+
+__all__ = [
+    "MultiProcPlugin",
+    "WorkQueue",
+]
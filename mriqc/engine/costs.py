@@ -0,0 +1,219 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+Expected costs of nodes, and execution decisions derived from them.
+
+Costs come from a static table of interfaces known to be trivial, and from
+the durations recorded in the calibration store
+(see :mod:`mriqc.utils.calibration`), when available.
+Whole participants are costed from the headers of their images, to balance
+the jobs set up by ``mriqc_subject_wrangler``.
+
+"""
+from math import ceil
+from pathlib import Path
+
+INLINE_INTERFACES = (
+    "AddProvenance",
+    "IdentityInterface",
+    "IQMFileSink",
+    "Merge",
+    "ReadSidecarJSON",
+    "ReleaseData",
+    "Rename",
+    "Select",
+    "Split",
+)
+"""Interfaces that only shuffle values around or write small files."""
+
+STATIC_SECONDS = {
+    "RobustMNINormalizationRPT": 1200.0,
+    "Registration": 600.0,
+    "FAST": 600.0,
+    "MELODIC": 600.0,
+    "PlotICA": 600.0,
+    "N4BiasFieldCorrection": 300.0,
+    "SkullStrip": 300.0,
+    "Volreg": 180.0,
+    "Allineate": 180.0,
+    "QualityIndex": 60.0,
+    "OutlierCount": 60.0,
+    "ComputeDVARS": 60.0,
+    "FWHMx": 60.0,
+    "ComputeQI2": 60.0,
+    "PlotCarpet": 60.0,
+}
+"""Rough durations (seconds) of the heaviest interfaces, used without calibration records."""
+
+DEFAULT_SECONDS = 10.0
+"""Duration (seconds) assumed for nodes with neither records nor a static estimate."""
+
+INLINE_MAX_SECONDS = 1.0
+"""Nodes expected to run faster than this (seconds) are run by the scheduler itself."""
+
+INLINE_MAX_GB = 0.5
+"""Nodes expected to need more memory than this (GB) are never run by the scheduler."""
+
+
+def expected_duration(node, models=None):
+    """Estimate how long ``node`` will run (seconds)."""
+    from ..utils.calibration import node_key
+
+    if node.run_without_submitting:
+        return 0.0
+    model = (models or {}).get(node_key(node))
+    if model is not None and model.duration is not None:
+        return model.duration
+    return STATIC_SECONDS.get(type(node.interface).__name__, DEFAULT_SECONDS)
+
+
+def critical_path(graph, nodes, models=None):
+    """
+    Calculate the longest expected duration from each node to the end of the graph.
+
+    :param graph: a :py:class:`networkx.DiGraph` of nodes
+    :param list nodes: the nodes of ``graph`` in topological order
+    :return: a list of durations (seconds), matching ``nodes``
+
+    """
+    remaining = {}
+    for node in reversed(nodes):
+        remaining[node] = expected_duration(node, models) + max(
+            (remaining[succ] for succ in graph.successors(node)), default=0.0
+        )
+    return [remaining[node] for node in nodes]
+
+
+def is_inline(node, models=None):
+    """
+    Decide whether ``node`` is cheap enough to be run within the scheduler's process.
+
+    :param dict models: fitted :class:`~mriqc.utils.calibration.Calibration`
+        records, keyed on :func:`~mriqc.utils.calibration.node_key`.
+
+    """
+    from nipype.pipeline.engine import MapNode
+    from ..utils.calibration import node_key, node_size_gb
+
+    if node.n_procs > 1:
+        return False
+    if type(node.interface).__name__ in INLINE_INTERFACES:
+        return True
+    if isinstance(node, MapNode):
+        return False
+
+    model = (models or {}).get(node_key(node))
+    if model is None or model.duration is None:
+        return False
+    mem_gb = model.intercept + model.slope * node_size_gb(node)
+    return model.duration < INLINE_MAX_SECONDS and mem_gb <= INLINE_MAX_GB
+
+
+def set_inline(workflow, models=None):
+    """
+    Mark the cheap nodes of ``workflow`` with ``run_without_submitting``.
+
+    :return: the number of nodes run by the scheduler
+
+    """
+    inline = 0
+    for node in workflow._get_all_nodes():
+        if not node.run_without_submitting and is_inline(node, models):
+            node.run_without_submitting = True
+        inline += int(node.run_without_submitting)
+    return inline
+
+
+IMAGE_COSTS = {
+    # modality: (CPU seconds per image, per million voxels, GB per image, per GB of data)
+    "T1w": (900.0, 60.0, 3.0, 4.0),
+    "T2w": (900.0, 60.0, 3.0, 4.0),
+    "bold": (600.0, 2.0, 1.0, 6.0),
+}
+"""Linear models of the CPU time and peak memory of each modality on the size of images."""
+
+OPTION_COSTS = {
+    "fft_spikes_detector": 2.0,
+    "ica": 6.0,
+}
+"""CPU seconds per million voxels added to BOLD runs by optional analyses."""
+
+
+def image_cost(in_file, modality, fft_spikes_detector=False, ica=False):
+    """
+    Estimate the CPU time (hours) and peak memory (GB) of processing an image.
+
+    Only the header of ``in_file`` is read.
+
+    """
+    import numpy as np
+    import nibabel as nb
+
+    shape = nb.load(str(in_file)).shape
+    mvoxels = float(np.prod(shape)) / 1e6
+    base_secs, secs, base_gb, gb = IMAGE_COSTS[modality]
+    if modality == "bold":
+        secs += OPTION_COSTS["fft_spikes_detector"] * fft_spikes_detector
+        secs += OPTION_COSTS["ica"] * ica
+    # Intermediate data are single precision
+    return (base_secs + secs * mvoxels) / 3600, base_gb + gb * mvoxels * 4e-3
+
+
+def participant_cost(bids_dir, participant, modalities=None, **options):
+    """
+    Estimate the CPU time (hours) and peak memory (GB) of processing a participant.
+
+    Runs of a participant are processed concurrently at best, so the peak
+    memory is that of all its images together.
+
+    """
+    modalities = modalities or list(IMAGE_COSTS)
+    cpu_hours, mem_gb = 0.0, 0.0
+    for in_file in sorted(Path(bids_dir, "sub-%s" % participant).glob("**/*.nii*")):
+        modality = in_file.name.split(".")[0].rsplit("_", 1)[-1]
+        if modality not in modalities or in_file.parent.name not in ("anat", "func"):
+            continue
+        image_hours, image_gb = image_cost(in_file, modality, **options)
+        cpu_hours += image_hours
+        mem_gb += image_gb
+    return cpu_hours, mem_gb
+
+
+def pack(costs, nbins):
+    """
+    Balance items with ``(cpu_hours, mem_gb)`` ``costs`` over ``nbins`` bins.
+
+    Items are taken by decreasing cost (*longest processing time first*), and
+    each goes to the bin where it increases the least the larger of the CPU and
+    memory loads, both relative to their mean over all bins.
+
+    >>> pack({"a": (4.0, 1.0), "b": (3.0, 1.0), "c": (2.0, 1.0), "d": (1.0, 1.0)}, 2)
+    [['a', 'd'], ['b', 'c']]
+
+    :param dict costs: the costs of each item
+    :return: a list of bins (lists of items)
+
+    """
+    nbins = max(1, min(nbins, len(costs)))
+    mean_cpu = max(sum(cpu for cpu, _ in costs.values()) / nbins, 1e-9)
+    mean_mem = max(sum(mem for _, mem in costs.values()) / nbins, 1e-9)
+
+    def _load(cpu, mem):
+        return max(cpu / mean_cpu, mem / mean_mem)
+
+    bins = [[] for _ in range(nbins)]
+    loads = [(0.0, 0.0)] * nbins
+    for item in sorted(costs, key=lambda k: _load(*costs[k]), reverse=True):
+        cpu, mem = costs[item]
+        index = min(
+            range(nbins), key=lambda i: (_load(loads[i][0] + cpu, loads[i][1] + mem), i)
+        )
+        bins[index].append(item)
+        loads[index] = (loads[index][0] + cpu, loads[index][1] + mem)
+    return [items for items in bins if items]
+
+
+def n_shards(costs, target_runtime, job_cpus=1):
+    """Number of jobs of ``job_cpus`` CPUs to process ``costs`` within ``target_runtime`` hours."""
+    total = sum(cpu for cpu, _ in costs.values())
+    return max(1, int(ceil(total / (target_runtime * job_cpus))))
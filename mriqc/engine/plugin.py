@@ -0,0 +1,232 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+A multiprocessing execution plugin with long-lived, recycled workers.
+
+Nipype's *MultiProc* keeps its worker processes for the whole run, and
+*LegacyMultiProc* (with ``maxtasksperchild``) starts them afresh every few
+tasks, paying for interpreter startup and imports (nipype, numpy, scipy,
+nibabel, nilearn...) over and over.
+Neither option is good for MRIQC, where many tasks take under a second but
+a few leak or retain large amounts of memory.
+
+This plugin reuses workers across tasks and measures the resident memory of
+each worker after every task.
+Once a worker has run ``max_tasks`` tasks or grown beyond ``max_rss_gb``, the
+pool is retired: it finishes the tasks it has already been sent and exits,
+while new tasks go to a fresh pool.
+
+Ready jobs are submitted longest-remaining-path first (see
+:func:`~mriqc.engine.costs.critical_path`), so that the long registrations and
+segmentations gating each subject start as early as possible, while short
+jobs back-fill the processors and memory left over.
+
+Multithreaded nodes may declare a ``thread_range`` (see
+:func:`~mriqc.workflows.utils.dynamic_threads`) instead of a fixed number of
+threads.
+Their threads are then decided when they are dispatched, sharing the
+processors left free by running tasks and other ready jobs, and are passed on
+to the tools through their inputs and the ``OMP_NUM_THREADS`` and
+``ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS`` environment variables.
+
+"""
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+from nipype import logging
+from nipype.pipeline.plugins.multiproc import (
+    MultiProcPlugin as _MultiProcPlugin,
+    process_initializer,
+    run_node as _run_node,
+)
+
+logger = logging.getLogger("nipype.workflow")
+
+_tasks_run = 0
+"""Tasks run by the current (worker) process."""
+
+
+def _rss_gb():
+    """Resident memory of the current process (GB), ``None`` if unknown."""
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / 1024 ** 3
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as fobj:
+            pages = int(fobj.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 3
+    except (OSError, ValueError):
+        return None
+
+
+def run_node(node, updatehash, taskid):
+    """Run a node as nipype does, accounting for the memory left in the worker."""
+    global _tasks_run
+
+    rss_before = _rss_gb()
+    result = _run_node(node, updatehash, taskid)
+    _tasks_run += 1
+
+    rss_after = _rss_gb()
+    result["worker"] = {
+        "pid": os.getpid(),
+        "tasks": _tasks_run,
+        "rss_gb": rss_after,
+        "retained_gb": (
+            None if None in (rss_before, rss_after) else rss_after - rss_before
+        ),
+    }
+    return result
+
+
+def set_threads(node, nthreads):
+    """Have ``node`` (and the tool it runs) use ``nthreads`` threads."""
+    if node.n_procs == nthreads:
+        return
+    logger.info("[MultiProc] Allocating %d threads to %s.", nthreads, node.fullname)
+    # Also sets the (non-hashed) ``num_threads`` input of the interface
+    node.n_procs = nthreads
+    if node.interface.inputs.trait("environ") is not None:
+        node.interface.inputs.environ = {
+            **node.interface.inputs.environ,
+            "OMP_NUM_THREADS": str(nthreads),
+            "ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS": str(nthreads),
+        }
+
+
+class MultiProcPlugin(_MultiProcPlugin):
+    """
+    Nipype's *MultiProc*, recycling its pool of workers on task count or memory.
+
+    Additional ``plugin_args``:
+
+    - max_tasks: retire workers after they have run this many tasks
+      (default: no limit).
+    - max_rss_gb: retire workers whose resident memory exceeds this limit
+      after a task (default: no limit).
+    - models: calibration records (see :mod:`mriqc.utils.calibration`) to
+      estimate the duration of nodes.
+    - scheduler: ``'critical_path'`` (default), or any of nipype's.
+    - keep_pool: do not shut the workers down when a workflow finishes, so
+      that the plugin can run several workflows with the same pool (call
+      :meth:`close` after the last one).
+
+    Nodes with a ``thread_range`` are allocated threads when submitted.
+
+    """
+
+    def __init__(self, plugin_args=None):
+        super().__init__(plugin_args=plugin_args)
+        self._max_tasks = self.plugin_args.get("max_tasks") or None
+        self._max_rss_gb = self.plugin_args.get("max_rss_gb") or None
+        self._recycle = False
+        self._retired = []
+        self._priority = []
+
+    def _generate_dependency_list(self, graph):
+        from .costs import critical_path
+
+        super()._generate_dependency_list(graph)
+        self._priority = critical_path(graph, self.procs, self.plugin_args.get("models"))
+
+    def _sort_jobs(self, jobids, scheduler=None):
+        if scheduler not in (None, "critical_path"):
+            jobids = super()._sort_jobs(jobids, scheduler=scheduler)
+        else:
+
+            def _priority(jobid):
+                # Subnodes of map nodes are appended as they are expanded
+                jobid = self.mapnodesubids.get(jobid, jobid)
+                return self._priority[jobid] if jobid < len(self._priority) else 0.0
+
+            jobids = sorted(jobids, key=_priority, reverse=True)
+
+        self._allocate_threads(jobids)
+        return jobids
+
+    def _thread_range(self, jobid):
+        # Subnodes of map nodes are created without the attributes of their parent
+        node = self.procs[self.mapnodesubids.get(jobid, jobid)]
+        return getattr(node, "thread_range", None)
+
+    def _allocate_threads(self, jobids):
+        """Split the processors free after the other ready jobs among multithreaded ones."""
+        ranged = [jobid for jobid in jobids if self._thread_range(jobid)]
+        if not ranged:
+            return
+
+        free_processors = self._check_resources(self.pending_tasks)[1]
+        spare = free_processors - sum(
+            min(self.procs[jobid].n_procs, self.processors)
+            for jobid in jobids
+            if jobid not in ranged
+        )
+        share = spare // len(ranged)
+        for jobid in ranged:
+            low, high = self._thread_range(jobid)
+            set_threads(self.procs[jobid], max(min(share, high, self.processors), low))
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.processors,
+            initializer=process_initializer,
+            initargs=(self._cwd,),
+            mp_context=mp.get_context(self.plugin_args.get("mp_context")),
+        )
+
+    def _async_callback(self, args):
+        result = args.result()
+        worker = result.get("worker", {})
+        logger.debug(
+            "[MultiProc] Task %d done in worker %s (%s tasks run, RSS %s GB, %s GB retained).",
+            result["taskid"],
+            worker.get("pid"),
+            worker.get("tasks"),
+            worker.get("rss_gb"),
+            worker.get("retained_gb"),
+        )
+        if (self._max_tasks and worker.get("tasks", 0) >= self._max_tasks) or (
+            self._max_rss_gb and (worker.get("rss_gb") or 0) > self._max_rss_gb
+        ):
+            self._recycle = True
+        super()._async_callback(args)
+
+    def _submit_job(self, node, updatehash=False):
+        if self._recycle:
+            self._recycle = False
+            logger.info("[MultiProc] Recycling worker processes.")
+            # Running and queued tasks are finished before the old workers exit
+            self.pool.shutdown(wait=False)
+            self._retired.append(self.pool)
+            self.pool = self._new_pool()
+
+        self._taskid += 1
+
+        # Don't allow streaming outputs
+        if getattr(node.interface, "terminal_output", "") == "stream":
+            node.interface.terminal_output = "allatonce"
+
+        result_future = self.pool.submit(run_node, node, updatehash, self._taskid)
+        result_future.add_done_callback(self._async_callback)
+        self._task_obj[self._taskid] = result_future
+
+        logger.debug(
+            "[MultiProc] Submitted task %s (taskid=%d).", node.fullname, self._taskid
+        )
+        return self._taskid
+
+    def _postrun_check(self):
+        for pool in self._retired:
+            pool.shutdown()
+        self._retired = []
+        if not self.plugin_args.get("keep_pool"):
+            super()._postrun_check()
+
+    def close(self):
+        """Shut the workers down."""
+        self._postrun_check()
+        self.pool.shutdown()
@@ -0,0 +1,26 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Node cost tests"""
+import networkx as nx
+from nipype.pipeline import engine as pe
+from nipype.interfaces import utility as niu
+
+from ...utils.calibration import Calibration
+from ...workflows.utils import fwhm_dict
+from ..costs import critical_path
+
+
+def test_critical_path():
+    nodes = [
+        pe.Node(niu.Function(function=fwhm_dict), name=name)
+        for name in ("first", "short", "long", "last")
+    ]
+    graph = nx.DiGraph()
+    graph.add_edges_from([
+        (nodes[0], nodes[1]), (nodes[0], nodes[2]), (nodes[1], nodes[3]), (nodes[2], nodes[3])
+    ])
+    models = {
+        "Function:%s" % node.name: Calibration(0.1, 0.0, 1, duration, 5)
+        for node, duration in zip(nodes, (1.0, 2.0, 30.0, 4.0))
+    }
+    assert critical_path(graph, nodes, models) == [35.0, 6.0, 34.0, 4.0]
@@ -0,0 +1,64 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Work queue tests"""
+import os
+import time
+from pathlib import Path
+
+from ..workqueue import WorkQueue
+
+
+def test_workqueue(tmp_path):
+    first = WorkQueue(tmp_path, heartbeat=0.05, timeout=60)
+    second = WorkQueue(tmp_path, heartbeat=0.05, timeout=60)
+
+    assert list(first.claims(["01", "02"])) == ["01", "02"]
+    assert list(second.claims(["01", "02", "03"])) == ["03"]
+
+    # Claims are kept alive while held
+    lockfile = tmp_path / "claims" / "01.lock"
+    os.utime(str(lockfile), (0, 0))
+    time.sleep(0.5)
+    assert lockfile.stat().st_mtime > 0
+
+    # Finished participants are never claimed again
+    first.release("01")
+    first.release("02", status="failed")
+    assert not second.claim("01") and not second.claim("02")
+    assert not (tmp_path / "claims" / "01.lock").exists()
+
+    # Claims still held are dropped on close
+    second.close()
+    assert not (tmp_path / "claims" / "03.lock").exists()
+    assert first.claim("03")
+
+    # Claims of unresponsive processes are reclaimed
+    stale = tmp_path / "claims" / "04.lock"
+    stale.write_text("crashed")
+    os.utime(str(stale), (0, 0))
+    assert first.claim("04")
+    first.close()
+
+
+def test_reclaim_race(tmp_path, monkeypatch):
+    """Only one of two processes reclaiming the same stale lock holds the claim."""
+    first = WorkQueue(tmp_path, heartbeat=60, timeout=60)
+    second = WorkQueue(tmp_path, heartbeat=60, timeout=60)
+    lockfile = tmp_path / "claims" / "01.lock"
+    lockfile.write_text("crashed")
+    os.utime(str(lockfile), (0, 0))
+
+    rename = Path.rename
+
+    def _racing_rename(self, target):
+        # The first process reclaims and claims between the check and the rename
+        monkeypatch.setattr(Path, "rename", rename)
+        assert first.claim("01")
+        return rename(self, target)
+
+    monkeypatch.setattr(Path, "rename", _racing_rename)
+    assert not second.claim("01")
+    assert lockfile.read_text() == first._owner
+    assert not list(lockfile.parent.glob("*.stale"))
+    first.close()
+    second.close()
@@ -0,0 +1,149 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+A work queue of participants, shared by MRIQC processes through a filesystem.
+
+Any number of ``mriqc ... participant --queue <dir>`` invocations, possibly on
+different hosts, pull participants from the same queue directory::
+
+    <dir>/claims/<label>.lock   participants being processed
+    <dir>/done/<label>          participants finished
+    <dir>/failed/<label>        participants whose workflow crashed
+
+Claims are lock files created atomically (``O_CREAT | O_EXCL``), holding the
+host and process of their owner.
+Owners touch their locks every ``heartbeat`` seconds, and locks left
+untouched for ``timeout`` seconds (e.g., by a crashed or killed process) are
+reclaimed by the next process looking for work.
+Each process exits once no participant of its own inputs is left to claim.
+
+"""
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from uuid import uuid4
+
+HEARTBEAT = 30.0
+"""Interval (seconds) between refreshes of the claims held by a process."""
+
+TIMEOUT = 300.0
+"""Age (seconds) after which the claim of an unresponsive process is reclaimed."""
+
+
+class WorkQueue:
+    """Claim participants from a queue directory, keeping the claims alive while held."""
+
+    def __init__(self, path, heartbeat=HEARTBEAT, timeout=TIMEOUT):
+        self.path = Path(path)
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        for folder in ("claims", "done", "failed"):
+            (self.path / folder).mkdir(parents=True, exist_ok=True)
+
+        self._owner = "%s:%d:%s" % (socket.gethostname(), os.getpid(), uuid4().hex[:8])
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _lockfile(self, label):
+        return self.path / "claims" / ("%s.lock" % label)
+
+    def _finished(self, label):
+        return any((self.path / folder / label).exists() for folder in ("done", "failed"))
+
+    def _create(self, lockfile):
+        try:
+            fd = os.open(str(lockfile), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as fobj:
+            fobj.write(self._owner)
+        return True
+
+    def _reclaim(self, lockfile):
+        """Remove ``lockfile`` if its owner stopped refreshing it."""
+        try:
+            stat = lockfile.stat()
+            if time.time() - stat.st_mtime < self.timeout:
+                return False
+            stale = lockfile.with_name("%s.%s.stale" % (lockfile.name, uuid4().hex[:8]))
+            lockfile.rename(stale)
+        except FileNotFoundError:
+            return False
+
+        # Another process may have reclaimed the lock and claimed it afresh
+        # since it was checked: then, put its claim back and give up
+        moved = stale.stat()
+        if (moved.st_ino, moved.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+            try:
+                os.link(str(stale), str(lockfile))
+            except FileExistsError:
+                pass
+            stale.unlink()
+            return False
+        stale.unlink()
+        return True
+
+    def claim(self, label):
+        """Try to claim ``label``, return whether it is now held by this process."""
+        if self._finished(label):
+            return False
+        lockfile = self._lockfile(label)
+        if not self._create(lockfile):
+            if not self._reclaim(lockfile) or not self._create(lockfile):
+                return False
+        # The owner may have finished between the first check and the claim
+        if self._finished(label):
+            lockfile.unlink()
+            return False
+
+        with self._lock:
+            self._held.add(label)
+        self._start_heartbeat()
+        return True
+
+    def release(self, label, status="done"):
+        """Record ``label`` as ``"done"`` or ``"failed"``, and drop its claim."""
+        (self.path / status / label).write_text(self._owner)
+        with self._lock:
+            self._held.discard(label)
+        try:
+            self._lockfile(label).unlink()
+        except FileNotFoundError:
+            pass
+
+    def claims(self, labels):
+        """Iterate over the items of ``labels`` successfully claimed, in order."""
+        for label in labels:
+            if self.claim(label):
+                yield label
+
+    def close(self):
+        """Stop refreshing the claims, and drop those still held for other processes."""
+        self._stop.set()
+        with self._lock:
+            held, self._held = list(self._held), set()
+        for label in held:
+            try:
+                self._lockfile(label).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _start_heartbeat(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+        self._thread.start()
+
+    def _beat(self):
+        while not self._stop.wait(self.heartbeat):
+            with self._lock:
+                held = list(self._held)
+            for label in held:
+                try:
+                    os.utime(str(self._lockfile(label)))
+                except FileNotFoundError:
+                    pass
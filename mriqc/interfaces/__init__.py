@@ -3,24 +3,32 @@
 """mriqc nipype interfaces """
 
 from .anatomical import StructuralQC, ArtifactMask, ComputeQI2, Harmonize, RotationMask
-from .functional import FunctionalQC, Spikes
+from .functional import FunctionalQC, MultiEchoQC, PrepareBOLD, Spikes
 from .bids import IQMFileSink
-from .viz import PlotMosaic, PlotContours, PlotSpikes
-from .common import ConformImage, EnsureSize
+from .viz import PlotCarpet, PlotContours, PlotICA, PlotMosaic, PlotSpikes
+from .common import CacheData, CleanWorkDir, ConformImage, Deoblique, EnsureSize, ReleaseData
 from .webapi import UploadIQMs
 
 
 __all__ = [
     "ArtifactMask",
+    "CacheData",
+    "CleanWorkDir",
     "ComputeQI2",
     "ConformImage",
+    "Deoblique",
     "EnsureSize",
     "FunctionalQC",
     "Harmonize",
     "IQMFileSink",
+    "MultiEchoQC",
+    "PlotCarpet",
     "PlotContours",
+    "PlotICA",
     "PlotMosaic",
     "PlotSpikes",
+    "PrepareBOLD",
+    "ReleaseData",
     "RotationMask",
     "Spikes",
     "StructuralQC",
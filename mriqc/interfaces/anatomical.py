@@ -20,6 +20,8 @@ from nipype.interfaces.base import (
 )
 
 from ..utils.misc import _flatten_dict
+from ..utils.nifti import image_info, load_data
+from .common import PrecisionInputSpec
 from ..qc.anatomical import (
     snr,
     snr_dietrich,
@@ -36,7 +38,7 @@ from ..qc.anatomical import (
 )
 
 
-class StructuralQCInputSpec(BaseInterfaceInputSpec):
+class StructuralQCInputSpec(PrecisionInputSpec):
     in_file = File(exists=True, mandatory=True, desc="file to be plotted")
     in_noinu = File(exists=True, mandatory=True, desc="image after INU correction")
     in_segm = File(exists=True, mandatory=True, desc="segmentation file from FSL FAST")
@@ -88,26 +90,28 @@ class StructuralQC(SimpleInterface):
 
     def _run_interface(self, runtime):  # pylint: disable=R0914,E1101
         imnii = nb.load(self.inputs.in_noinu)
-        erode = np.all(np.array(imnii.header.get_zooms()[:3], dtype=np.float32) < 1.9)
+        iminfo = image_info(imnii)
+        erode = np.all(np.array(iminfo.zooms[:3], dtype=np.float32) < 1.9)
 
         # Load image corrected for INU
-        inudata = np.nan_to_num(imnii.get_data())
+        dtype = self.inputs.dtype
+        inudata = np.nan_to_num(load_data(imnii, dtype), copy=False)
         inudata[inudata < 0] = 0
 
         # Load binary segmentation from FSL FAST
         segnii = nb.load(self.inputs.in_segm)
-        segdata = segnii.get_data().astype(np.uint8)
+        segdata = load_data(segnii, None).astype(np.uint8)
 
         # Load air, artifacts and head masks
-        airdata = nb.load(self.inputs.air_msk).get_data().astype(np.uint8)
-        artdata = nb.load(self.inputs.artifact_msk).get_data().astype(np.uint8)
-        headdata = nb.load(self.inputs.head_msk).get_data().astype(np.uint8)
-        rotdata = nb.load(self.inputs.rot_msk).get_data().astype(np.uint8)
+        airdata = load_data(self.inputs.air_msk, None).astype(np.uint8)
+        artdata = load_data(self.inputs.artifact_msk, None).astype(np.uint8)
+        headdata = load_data(self.inputs.head_msk, None).astype(np.uint8)
+        rotdata = load_data(self.inputs.rot_msk, None).astype(np.uint8)
 
         # Load Partial Volume Maps (pvms) from FSL FAST
         pvmdata = []
         for fname in self.inputs.in_pvms:
-            pvmdata.append(nb.load(fname).get_data().astype(np.float32))
+            pvmdata.append(load_data(fname, dtype))
 
         # Summary stats
         stats = summary_stats(inudata, pvmdata, airdata, erode=erode)
@@ -161,9 +165,7 @@ class StructuralQC(SimpleInterface):
         )
 
         # FWHM
-        fwhm = np.array(self.inputs.in_fwhm[:3]) / np.array(
-            imnii.header.get_zooms()[:3]
-        )
+        fwhm = np.array(self.inputs.in_fwhm[:3]) / np.array(iminfo.zooms[:3])
         self._results["fwhm"] = {
             "x": float(fwhm[0]),
             "y": float(fwhm[1]),
@@ -178,27 +180,13 @@ class StructuralQC(SimpleInterface):
         self._results["rpve"] = rpve(pvmdata, segdata)
 
         # Image specs
-        self._results["size"] = {
-            "x": int(inudata.shape[0]),
-            "y": int(inudata.shape[1]),
-            "z": int(inudata.shape[2]),
-        }
-        self._results["spacing"] = {
-            i: float(v) for i, v in zip(["x", "y", "z"], imnii.header.get_zooms()[:3])
-        }
-
-        try:
-            self._results["size"]["t"] = int(inudata.shape[3])
-        except IndexError:
-            pass
-
-        try:
-            self._results["spacing"]["tr"] = float(imnii.header.get_zooms()[3])
-        except IndexError:
-            pass
+        self._results["size"] = dict(zip(["x", "y", "z", "t"], iminfo.shape))
+        self._results["spacing"] = dict(zip(["x", "y", "z"], iminfo.zooms[:3]))
+        if iminfo.tr is not None:
+            self._results["spacing"]["tr"] = iminfo.tr
 
         # Bias
-        bias = nb.load(self.inputs.in_bias).get_data()[segdata > 0]
+        bias = load_data(self.inputs.in_bias, dtype)[segdata > 0]
         self._results["inu"] = {
             "range": float(
                 np.abs(np.percentile(bias, 95.0) - np.percentile(bias, 5.0))
@@ -206,8 +194,8 @@ class StructuralQC(SimpleInterface):
             "med": float(np.median(bias)),
         }  # pylint: disable=E1101
 
-        mni_tpms = [nb.load(tpm).get_data() for tpm in self.inputs.mni_tpms]
-        in_tpms = [nb.load(tpm).get_data() for tpm in self.inputs.in_pvms]
+        mni_tpms = [load_data(tpm, dtype) for tpm in self.inputs.mni_tpms]
+        in_tpms = [load_data(tpm, dtype) for tpm in self.inputs.in_pvms]
         overlap = fuzzy_jaccard(in_tpms, mni_tpms)
         self._results["tpm_overlap"] = {
             "csf": overlap[0],
@@ -220,7 +208,7 @@ class StructuralQC(SimpleInterface):
         return runtime
 
 
-class ArtifactMaskInputSpec(BaseInterfaceInputSpec):
+class ArtifactMaskInputSpec(PrecisionInputSpec):
     in_file = File(exists=True, mandatory=True, desc="File to be plotted")
     head_mask = File(exists=True, mandatory=True, desc="head mask")
     rot_mask = File(exists=True, desc="a rotation mask")
@@ -245,13 +233,13 @@ class ArtifactMask(SimpleInterface):
 
     def _run_interface(self, runtime):
         imnii = nb.load(self.inputs.in_file)
-        imdata = np.nan_to_num(imnii.get_data().astype(np.float32))
+        imdata = np.nan_to_num(load_data(imnii, self.inputs.dtype), copy=False)
 
         # Remove negative values
         imdata[imdata < 0] = 0
 
-        hmdata = nb.load(self.inputs.head_mask).get_data()
-        npdata = nb.load(self.inputs.nasion_post_mask).get_data()
+        hmdata = load_data(self.inputs.head_mask, None)
+        npdata = load_data(self.inputs.nasion_post_mask, None)
 
         # Invert head mask
         airdata = np.ones_like(hmdata, dtype=np.uint8)
@@ -267,7 +255,7 @@ class ArtifactMask(SimpleInterface):
 
         # Apply rotation mask (if supplied)
         if isdefined(self.inputs.rot_mask):
-            rotmskdata = nb.load(self.inputs.rot_mask).get_data()
+            rotmskdata = load_data(self.inputs.rot_mask, None)
             airdata[rotmskdata == 1] = 0
 
         # Run the artifact detection
@@ -299,7 +287,7 @@ class ArtifactMask(SimpleInterface):
         return runtime
 
 
-class ComputeQI2InputSpec(BaseInterfaceInputSpec):
+class ComputeQI2InputSpec(PrecisionInputSpec):
     in_file = File(exists=True, mandatory=True, desc="File to be plotted")
     air_msk = File(exists=True, mandatory=True, desc="air (without artifacts) mask")
 
@@ -318,15 +306,15 @@ class ComputeQI2(SimpleInterface):
     output_spec = ComputeQI2OutputSpec
 
     def _run_interface(self, runtime):
-        imdata = nb.load(self.inputs.in_file).get_data()
-        airdata = nb.load(self.inputs.air_msk).get_data()
+        imdata = load_data(self.inputs.in_file, self.inputs.dtype)
+        airdata = load_data(self.inputs.air_msk, None)
         qi2, out_file = art_qi2(imdata, airdata)
         self._results["qi2"] = qi2
         self._results["out_file"] = out_file
         return runtime
 
 
-class HarmonizeInputSpec(BaseInterfaceInputSpec):
+class HarmonizeInputSpec(PrecisionInputSpec):
     in_file = File(
         exists=True, mandatory=True, desc="input data (after bias correction)"
     )
@@ -349,7 +337,7 @@ class Harmonize(SimpleInterface):
     def _run_interface(self, runtime):
 
         in_file = nb.load(self.inputs.in_file)
-        wm_mask = nb.load(self.inputs.wm_mask).get_data()
+        wm_mask = load_data(self.inputs.wm_mask, self.inputs.dtype)
         wm_mask[wm_mask < 0.9] = 0
         wm_mask[wm_mask > 0] = 1
         wm_mask = wm_mask.astype(np.uint8)
@@ -360,7 +348,7 @@ class Harmonize(SimpleInterface):
             # Perform an opening operation on the background data.
             wm_mask = nd.binary_erosion(wm_mask, structure=struc).astype(np.uint8)
 
-        data = in_file.get_data()
+        data = load_data(in_file, self.inputs.dtype)
         data *= 1000.0 / np.median(data[wm_mask > 0])
 
         out_file = fname_presuffix(
@@ -391,7 +379,7 @@ class RotationMask(SimpleInterface):
 
     def _run_interface(self, runtime):
         in_file = nb.load(self.inputs.in_file)
-        data = in_file.get_data()
+        data = load_data(in_file, None)
         mask = data <= 0
 
         # Pad one pixel to control behavior on borders of binary_opening
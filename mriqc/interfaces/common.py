@@ -17,12 +17,23 @@ from nipype.interfaces.base import (
 )
 from nipype.interfaces.ants import ApplyTransforms
 from .. import config
+from ..utils.nifti import copy_nifti, load_data, symlink_image
+
+
+class PrecisionInputSpec(BaseInterfaceInputSpec):
+    dtype = traits.Enum(
+        "float32", "float64", usedefault=True,
+        desc="floating point precision of the data arrays",
+    )
 
 
 class ConformImageInputSpec(BaseInterfaceInputSpec):
     in_file = File(exists=True, mandatory=True, desc="input image")
     check_ras = traits.Bool(True, usedefault=True, desc="check that orientation is RAS")
     check_dtype = traits.Bool(True, usedefault=True, desc="check data type")
+    out_ext = traits.Enum(
+        ".nii.gz", ".nii", desc="extension of the output (default: the input's)"
+    )
 
 
 class ConformImageOutputSpec(TraitedSpec):
@@ -34,6 +45,10 @@ class ConformImage(SimpleInterface):
     """
     Conforms an input image
 
+    Inputs that are already conformant are not rewritten: the output is a
+    symbolic link to the input, or a copy of its data block with a revised
+    header when only the header changes (e.g., squeezing the 4th dimension).
+
     List of nifti datatypes:
 
     .. note: original Analyze 7.5 types
@@ -93,14 +108,11 @@ class ConformImage(SimpleInterface):
     output_spec = ConformImageOutputSpec
 
     def _run_interface(self, runtime):
-        # Squeeze 4th dimension if possible (#660)
-        nii = nb.squeeze_image(nb.load(self.inputs.in_file))
-        hdr = nii.header.copy()
-        if self.inputs.check_ras:
-            nii = nb.as_closest_canonical(nii)
+        img = nb.load(self.inputs.in_file)
+        hdr = img.header
 
+        dtype = None
         if self.inputs.check_dtype:
-            changed = True
             datatype = int(hdr["datatype"])
 
             if datatype == 1:
@@ -125,21 +137,47 @@ class ConformImage(SimpleInterface):
             # Floats over 32 bits
             elif datatype == 64 or datatype == 1536:
                 dtype = np.float32
-            else:
-                changed = False
 
-            if changed:
-                hdr.set_data_dtype(dtype)
-                nii = nb.Nifti1Image(nii.get_data().astype(dtype), nii.affine, hdr)
+        reorient = self.inputs.check_ras and not np.array_equal(
+            nb.io_orientation(img.affine), [[0, 1], [1, 1], [2, 1]]
+        )
 
         # Generate name
-        out_file, ext = op.splitext(op.basename(self.inputs.in_file))
-        if ext == ".gz":
+        out_file, in_ext = op.splitext(op.basename(self.inputs.in_file))
+        if in_ext == ".gz":
             out_file, ext2 = op.splitext(out_file)
-            ext = ext2 + ext
+            in_ext = ext2 + in_ext
+        ext = self.inputs.out_ext if isdefined(self.inputs.out_ext) else in_ext
+        out_file = op.abspath("{}_conformed{}".format(out_file, ext))
+        self._results["out_file"] = out_file
+
+        if dtype is None and not reorient:
+            # Squeeze 4th dimension if possible (#660), which only modifies the header
+            shape = list(img.shape)
+            while len(shape) > 3 and shape[-1] == 1:
+                shape.pop()
+
+            if len(shape) == len(img.shape) and ext == in_ext:
+                symlink_image(self.inputs.in_file, out_file)
+            else:
+                hdr = hdr.copy()
+                hdr.set_data_shape(shape)
+                self._results["out_file"] = copy_nifti(
+                    self.inputs.in_file, out_file, header=hdr
+                )
+            return runtime
+
+        # Squeeze 4th dimension if possible (#660)
+        nii = nb.squeeze_image(img)
+        hdr = nii.header.copy()
+        if self.inputs.check_ras:
+            nii = nb.as_closest_canonical(nii)
 
-        self._results["out_file"] = op.abspath("{}_conformed{}".format(out_file, ext))
-        nii.to_filename(self._results["out_file"])
+        if dtype is not None:
+            hdr.set_data_dtype(dtype)
+            nii = nb.Nifti1Image(load_data(nii, None).astype(dtype), nii.affine, hdr)
+
+        nii.to_filename(out_file)
         return runtime
 
 
@@ -268,3 +306,172 @@ class EnsureSize(SimpleInterface):
             self._results["out_mask"] = out_mask
 
         return runtime
+
+
+class CacheDataInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, mandatory=True, desc="input image")
+    cache_dir = traits.Str(mandatory=True, desc="root of the data cache")
+    tag = traits.Str(mandatory=True, desc="identifier of the user of the cached copy")
+
+
+class CacheDataOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc="uncompressed, page-aligned copy")
+
+
+class CacheData(SimpleInterface):
+    """
+    Replace an image with its copy in the work-directory data cache.
+
+    The copy is uncompressed and its data block aligned to memory pages,
+    so that the downstream nodes memory-map it instead of inflating the
+    original file every time.
+
+    """
+
+    input_spec = CacheDataInputSpec
+    output_spec = CacheDataOutputSpec
+    # The copy may have been evicted after a previous run
+    _always_run = True
+
+    def _run_interface(self, runtime):
+        from ..utils.datacache import DataCache
+
+        self._results["out_file"] = DataCache(self.inputs.cache_dir).acquire(
+            self.inputs.in_file, self.inputs.tag
+        )
+        return runtime
+
+
+class ReleaseDataInputSpec(BaseInterfaceInputSpec):
+    cache_dir = traits.Str(mandatory=True, desc="root of the data cache")
+    tag = traits.Str(mandatory=True, desc="identifier of the user of the cached copies")
+    wait = traits.List(
+        traits.Any, desc="outputs of the last nodes reading the cached copies"
+    )
+
+
+class ReleaseDataOutputSpec(TraitedSpec):
+    evicted = traits.Int(desc="number of evicted files")
+
+
+class ReleaseData(SimpleInterface):
+    """Release the cached copies acquired with a tag, evicting those unused."""
+
+    input_spec = ReleaseDataInputSpec
+    output_spec = ReleaseDataOutputSpec
+    _always_run = True
+
+    def _run_interface(self, runtime):
+        from ..utils.datacache import DataCache
+
+        self._results["evicted"] = DataCache(self.inputs.cache_dir).release(
+            self.inputs.tag
+        )
+        return runtime
+
+
+class CleanWorkDirInputSpec(BaseInterfaceInputSpec):
+    min_size = traits.Int(
+        2 ** 20, usedefault=True, desc="delete files of at least this size (bytes)"
+    )
+    wait = traits.List(traits.Any, desc="outputs of the last nodes of the branch")
+
+
+class CleanWorkDirOutputSpec(TraitedSpec):
+    deleted = traits.Int(desc="number of deleted files")
+    freed = traits.Int(desc="disk space freed (bytes)")
+
+
+class CleanWorkDir(SimpleInterface):
+    """
+    Delete the bulky intermediates of the iterable branch this node belongs to.
+
+    The branch is identified by the parameterization folder (e.g.,
+    ``_in_file_..sub-01..``, or its SHA-1 when nipype shortens long
+    parameterizations, as those of multi-echo runs) the node runs within, and
+    all the folders with that name under the workflow's directory (including
+    those of nested workflows) are cleaned up.
+    Files smaller than ``min_size``, and nipype's bookkeeping and reporting
+    files (pickles, JSON, SVG, HTML and text), are kept.
+
+    """
+
+    input_spec = CleanWorkDirInputSpec
+    output_spec = CleanWorkDirOutputSpec
+    _always_run = True
+    _keep = (".pklz", ".json", ".svg", ".html", ".txt", ".tsv", ".csv", ".rst")
+
+    def _run_interface(self, runtime):
+        import re
+        from pathlib import Path
+
+        node_dir = Path(runtime.cwd).absolute()
+        branch = node_dir.parent.name
+        deleted, freed = 0, 0
+        if branch.startswith("_") or re.fullmatch("[0-9a-f]{40}", branch):
+            for branch_dir in node_dir.parent.parent.rglob(branch):
+                for fpath in branch_dir.rglob("*"):
+                    if (
+                        fpath.is_symlink()
+                        or not fpath.is_file()
+                        or fpath.name.endswith(self._keep)
+                        or node_dir in fpath.parents
+                    ):
+                        continue
+                    size = fpath.stat().st_size
+                    if size >= self.inputs.min_size:
+                        fpath.unlink()
+                        deleted += 1
+                        freed += size
+
+        self._results["deleted"] = deleted
+        self._results["freed"] = freed
+        return runtime
+
+
+class DeobliqueInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, mandatory=True, desc="input image")
+
+
+class DeobliqueOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc="image with a cardinal (non-oblique) affine")
+
+
+class Deoblique(SimpleInterface):
+    """
+    Replace an oblique affine with the closest cardinal one, as ``3drefit -deoblique``.
+
+    Voxel sizes and the coordinates of the first voxel are kept, and the data
+    are not resampled: only the header is rewritten (and nothing at all if the
+    image is not oblique).
+
+    """
+
+    input_spec = DeobliqueInputSpec
+    output_spec = DeobliqueOutputSpec
+
+    def _run_interface(self, runtime):
+        from nipype.utils.filemanip import fname_presuffix
+
+        img = nb.load(self.inputs.in_file)
+        affine = img.affine
+        zooms = img.header.get_zooms()[:3]
+
+        cardinal = np.eye(4)
+        cardinal[:3, :3] = 0
+        for i, (axis, flip) in enumerate(nb.io_orientation(affine)):
+            cardinal[int(axis), i] = flip * zooms[i]
+        cardinal[:3, 3] = affine[:3, 3]
+
+        out_file = fname_presuffix(
+            self.inputs.in_file, suffix="_deoblique", newpath=runtime.cwd
+        )
+        if np.allclose(cardinal, affine):
+            self._results["out_file"] = symlink_image(self.inputs.in_file, out_file)
+            return runtime
+
+        hdr = img.header.copy()
+        hdr.set_qform(cardinal, max(int(hdr["qform_code"]), 1))
+        hdr.set_sform(cardinal, max(int(hdr["sform_code"]), 1))
+        self._results["out_file"] = copy_nifti(self.inputs.in_file, out_file, header=hdr)
+        return runtime
@@ -14,13 +14,18 @@ from nipype.interfaces.base import (
     BaseInterfaceInputSpec,
     SimpleInterface,
 )
+from nipype.utils.filemanip import fname_presuffix
 
 from ..utils.misc import _flatten_dict
+from ..utils.nifti import (
+    copy_nifti, image_info, load_data, stream_blocks, symlink_image, write_chunks
+)
 from ..qc.anatomical import snr, fber, efc, summary_stats
 from ..qc.functional import gsr
+from .common import PrecisionInputSpec
 
 
-class FunctionalQCInputSpec(BaseInterfaceInputSpec):
+class FunctionalQCInputSpec(PrecisionInputSpec):
     in_epi = File(exists=True, mandatory=True, desc="input EPI file")
     in_hmc = File(exists=True, mandatory=True, desc="input motion corrected file")
     in_tsnr = File(exists=True, mandatory=True, desc="input tSNR volume")
@@ -75,19 +80,15 @@ class FunctionalQC(SimpleInterface):
     def _run_interface(self, runtime):
         # Get the mean EPI data and get it ready
         epinii = nb.load(self.inputs.in_epi)
-        epidata = np.nan_to_num(epinii.get_data())
-        epidata = epidata.astype(np.float32)
+        epidata = np.nan_to_num(load_data(epinii, self.inputs.dtype), copy=False)
         epidata[epidata < 0] = 0
 
-        # Get EPI data (with mc done) and get it ready
-        hmcnii = nb.load(self.inputs.in_hmc)
-        hmcdata = np.nan_to_num(hmcnii.get_data())
-        hmcdata = hmcdata.astype(np.float32)
-        hmcdata[hmcdata < 0] = 0
+        # Only the metadata of the HMC'ed timeseries are necessary
+        hmcinfo = image_info(self.inputs.in_hmc)
 
         # Get EPI data (with mc done) and get it ready
         msknii = nb.load(self.inputs.in_mask)
-        mskdata = np.nan_to_num(msknii.get_data())
+        mskdata = np.nan_to_num(load_data(msknii, self.inputs.dtype), copy=False)
         mskdata[mskdata < 0] = 0
         mskdata[mskdata > 0] = 1
         mskdata = mskdata.astype(np.uint8)
@@ -124,12 +125,12 @@ class FunctionalQC(SimpleInterface):
         }
 
         # tSNR
-        tsnr_data = nb.load(self.inputs.in_tsnr).get_data()
+        tsnr_data = load_data(self.inputs.in_tsnr, self.inputs.dtype)
         self._results["tsnr"] = float(np.median(tsnr_data[mskdata > 0]))
 
         # FD
         fd_data = np.loadtxt(self.inputs.in_fd, skiprows=1)
-        num_fd = np.float((fd_data > self.inputs.fd_thres).sum())
+        num_fd = float((fd_data > self.inputs.fd_thres).sum())
         self._results["fd"] = {
             "mean": float(fd_data.mean()),
             "num": int(num_fd),
@@ -137,9 +138,7 @@ class FunctionalQC(SimpleInterface):
         }
 
         # FWHM
-        fwhm = np.array(self.inputs.in_fwhm[:3]) / np.array(
-            hmcnii.header.get_zooms()[:3]
-        )
+        fwhm = np.array(self.inputs.in_fwhm[:3]) / np.array(hmcinfo.zooms[:3])
         self._results["fwhm"] = {
             "x": float(fwhm[0]),
             "y": float(fwhm[1]),
@@ -148,30 +147,16 @@ class FunctionalQC(SimpleInterface):
         }
 
         # Image specs
-        self._results["size"] = {
-            "x": int(hmcdata.shape[0]),
-            "y": int(hmcdata.shape[1]),
-            "z": int(hmcdata.shape[2]),
-        }
-        self._results["spacing"] = {
-            i: float(v) for i, v in zip(["x", "y", "z"], hmcnii.header.get_zooms()[:3])
-        }
-
-        try:
-            self._results["size"]["t"] = int(hmcdata.shape[3])
-        except IndexError:
-            pass
-
-        try:
-            self._results["spacing"]["tr"] = float(hmcnii.header.get_zooms()[3])
-        except IndexError:
-            pass
+        self._results["size"] = dict(zip(["x", "y", "z", "t"], hmcinfo.shape))
+        self._results["spacing"] = dict(zip(["x", "y", "z"], hmcinfo.zooms[:3]))
+        if hmcinfo.tr is not None:
+            self._results["spacing"]["tr"] = hmcinfo.tr
 
         self._results["out_qc"] = _flatten_dict(self._results)
         return runtime
 
 
-class SpikesInputSpec(BaseInterfaceInputSpec):
+class SpikesInputSpec(PrecisionInputSpec):
     in_file = File(exists=True, mandatory=True, desc="input fMRI dataset")
     in_mask = File(exists=True, desc="brain mask")
     invert_mask = traits.Bool(False, usedefault=True, desc="invert mask")
@@ -210,7 +195,7 @@ class Spikes(SimpleInterface):
 
     def _run_interface(self, runtime):
         func_nii = nb.load(self.inputs.in_file)
-        func_data = func_nii.get_data()
+        func_data = load_data(func_nii, self.inputs.dtype)
         func_shape = func_data.shape
         ntsteps = func_shape[-1]
         tr = func_nii.header.get_zooms()[-1]
@@ -227,13 +212,13 @@ class Spikes(SimpleInterface):
                 func_shape[2],
                 clean_data.shape[-1],
             )
-            func_data = np.zeros(func_shape)
+            func_data = np.zeros(func_shape, dtype=self.inputs.dtype)
             func_data[..., nskip:] = clean_data.reshape(new_shape)
 
         if not isdefined(self.inputs.in_mask):
             _, mask_data, _ = auto_mask(func_data, nskip=self.inputs.skip_frames)
         else:
-            mask_data = nb.load(self.inputs.in_mask).get_data()
+            mask_data = load_data(self.inputs.in_mask, None)
             mask_data[..., :nskip] = 0
             mask_data = np.stack([mask_data] * ntsteps, axis=-1)
 
@@ -261,6 +246,288 @@ class Spikes(SimpleInterface):
         return runtime
 
 
+class PrepareBOLDInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, mandatory=True, desc="input BOLD timeseries")
+    n_volumes_to_discard = traits.Int(
+        desc="number of non-steady state volumes (estimated if not set)"
+    )
+    n_detect = traits.Int(
+        50,
+        usedefault=True,
+        desc="number of leading volumes inspected to detect non-steady states",
+    )
+    start_idx = traits.Int(desc="first volume to keep")
+    stop_idx = traits.Int(desc="last volume to keep (inclusive)")
+    max_32bit = traits.Bool(
+        False,
+        usedefault=True,
+        desc="cast data to float32 if higher precision is encountered",
+    )
+    chunk_size = traits.Int(
+        32, usedefault=True, desc="number of volumes read and written at once"
+    )
+    out_ext = traits.Enum(
+        ".nii.gz", ".nii", desc="extension of the output (default: the input's)"
+    )
+    num_threads = traits.Int(
+        1, usedefault=True, nohash=True, desc="number of threads compressing the output"
+    )
+
+
+class PrepareBOLDOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc="sanitized and trimmed BOLD timeseries")
+    n_volumes_to_discard = traits.Int(desc="number of non-steady state volumes")
+
+
+class PrepareBOLD(SimpleInterface):
+    """
+    Prepare a BOLD timeseries for the functional workflow in a single pass.
+
+    Detects non-steady state volumes (with the algorithm of
+    :py:class:`nipype.algorithms.confounds.NonSteadyStateDetector`, which only
+    inspects the first ``n_detect`` volumes), revises the qform/sform
+    matrices and codes (as :py:class:`niworkflows.interfaces.utils.SanitizeImage`),
+    optionally casts the data to float32, and drops non-steady states and
+    volumes outside the ``start_idx``/``stop_idx`` range.
+    The output is written by blocks of ``chunk_size`` volumes, so the full
+    timeseries is never loaded in memory.
+
+    """
+
+    input_spec = PrepareBOLDInputSpec
+    output_spec = PrepareBOLDOutputSpec
+
+    def _run_interface(self, runtime):
+        from nipype.algorithms.confounds import is_outlier
+
+        img = nb.load(self.inputs.in_file)
+        nvols = img.shape[3]
+
+        # Non-steady states are estimated on the leading volumes, kept for reuse
+        head = np.asanyarray(img.dataobj[..., : self.inputs.n_detect])
+        if isdefined(self.inputs.n_volumes_to_discard):
+            n_discard = self.inputs.n_volumes_to_discard
+        else:
+            n_discard = is_outlier(head.mean(axis=(0, 1, 2)))
+        self._results["n_volumes_to_discard"] = int(n_discard)
+
+        first = n_discard
+        if isdefined(self.inputs.start_idx) and 0 <= self.inputs.start_idx < nvols:
+            first = max(first, self.inputs.start_idx)
+        last = nvols - 1
+        if isdefined(self.inputs.stop_idx) and first <= self.inputs.stop_idx < last:
+            last = self.inputs.stop_idx
+        first = min(first, last)
+
+        hdr = img.header.copy()
+        new_xforms = _sanitize_xforms(hdr)
+
+        in_dtype = out_dtype = hdr.get_data_dtype()
+        slope, inter = hdr.get_slope_inter()
+        if (slope, inter) not in ((None, None), (1.0, 0.0)):
+            # Data are written already scaled
+            out_dtype = head.dtype
+            hdr.set_slope_inter(np.nan, np.nan)
+        if self.inputs.max_32bit and np.dtype(out_dtype).itemsize > 4:
+            out_dtype = np.float32
+        hdr.set_data_dtype(out_dtype)
+        hdr.set_data_shape(img.shape[:3] + (last - first + 1,) + img.shape[4:])
+
+        if isdefined(self.inputs.out_ext):
+            out_file = fname_presuffix(
+                self.inputs.in_file, suffix="_valid" + self.inputs.out_ext,
+                newpath=runtime.cwd, use_ext=False,
+            )
+        else:
+            out_file = fname_presuffix(
+                self.inputs.in_file, suffix="_valid", newpath=runtime.cwd
+            )
+
+        if first == 0 and last == nvols - 1 and out_dtype == in_dtype:
+            # The data block is kept as is
+            same_ext = out_file.endswith(".gz") == self.inputs.in_file.endswith(".gz")
+            if not new_xforms and same_ext:
+                self._results["out_file"] = symlink_image(self.inputs.in_file, out_file)
+            else:
+                self._results["out_file"] = copy_nifti(
+                    self.inputs.in_file, out_file, header=hdr
+                )
+            return runtime
+
+        chunk_size = max(self.inputs.chunk_size, 1)
+
+        def _chunks():
+            # Volumes already read are reused, the rest are streamed in one pass
+            nhead = head.shape[3]
+            for t0 in range(first, min(last + 1, nhead), chunk_size):
+                yield head[..., t0:min(t0 + chunk_size, last + 1, nhead)]
+            if last + 1 > nhead:
+                yield from stream_blocks(
+                    img, chunk_size, start=max(first, nhead), stop=last + 1
+                )
+
+        self._results["out_file"] = write_chunks(
+            hdr, _chunks(), out_file, nthreads=self.inputs.num_threads
+        )
+        return runtime
+
+
+class MultiEchoQCInputSpec(BaseInterfaceInputSpec):
+    in_files = traits.List(
+        File(exists=True),
+        mandatory=True,
+        desc="motion-corrected echoes of one run, sorted by echo time",
+    )
+    echo_times = traits.List(
+        traits.Float, mandatory=True, desc="echo times (in seconds)"
+    )
+    in_mask = File(exists=True, mandatory=True, desc="brain mask")
+    chunk_size = traits.Int(
+        32, usedefault=True, desc="number of volumes read at once"
+    )
+
+
+class MultiEchoQCOutputSpec(TraitedSpec):
+    out_qc = traits.Dict(desc="output flattened dictionary with all measures")
+
+
+class MultiEchoQC(SimpleInterface):
+    """
+    Computes per-echo and combined measures of a multi-echo BOLD run.
+
+    All echoes are read together, by blocks of volumes, and voxelwise temporal
+    moments (including the cross-echo covariances) are accumulated within the
+    brain mask.
+    From those, a single pass yields the :abbr:`tSNR (temporal SNR)` and mean
+    signal of each echo, a log-linear fit of :math:`T_2^*` and :math:`S_0`
+    on the mean signal, and the tSNR of the optimally combined series
+    (weights :math:`TE \\cdot e^{-TE / T_2^*}`).
+    The :py:class:`FunctionalQC` measures of each echo are computed separately
+    (see :py:func:`~mriqc.workflows.functional.fmri_qc_workflow`).
+
+    """
+
+    input_spec = MultiEchoQCInputSpec
+    output_spec = MultiEchoQCOutputSpec
+
+    def _run_interface(self, runtime):
+        mask = np.asanyarray(nb.load(self.inputs.in_mask).dataobj) > 0
+        imgs = [nb.load(fname) for fname in self.inputs.in_files]
+        echo_times = np.array(self.inputs.echo_times, dtype=float) * 1e3  # ms
+        ntsteps = min(img.shape[3] for img in imgs)
+        chunk_size = max(self.inputs.chunk_size, 1)
+
+        # Moments are accumulated on data shifted by the first volume
+        shift = sums = cross = None
+        blocks = zip(*(stream_blocks(img, chunk_size, stop=ntsteps) for img in imgs))
+        for echo_blocks in blocks:
+            block = np.stack([
+                np.asanyarray(data)[mask] for data in echo_blocks
+            ]).astype(np.float64)
+            if shift is None:
+                shift = block[..., 0].copy()
+                sums = np.zeros_like(shift)
+                cross = np.zeros((len(imgs),) + shift.shape)
+            block -= shift[..., np.newaxis]
+            sums += block.sum(axis=-1)
+            cross += np.einsum("evt,fvt->efv", block, block)
+
+        mean = sums / ntsteps
+        cov = cross / ntsteps - mean[:, np.newaxis] * mean[np.newaxis]
+        mean += shift
+
+        self._results["out_qc"] = multiecho_measures(mean, cov, echo_times)
+        return runtime
+
+
+def multiecho_measures(mean, cov, echo_times):
+    """
+    Summarize the temporal moments of a multi-echo run.
+
+    :param numpy.ndarray mean: voxelwise mean signal of each echo (echoes x voxels)
+    :param numpy.ndarray cov: voxelwise covariance across echoes
+        (echoes x echoes x voxels)
+    :param echo_times: echo times (in ms)
+    :return: a flat dictionary of measures
+
+    """
+    echo_times = np.asanyarray(echo_times, dtype=float)
+    var = np.clip(np.einsum("eev->ev", cov), 0, None)
+    tsnr = np.zeros_like(mean)
+    np.divide(mean, np.sqrt(var), out=tsnr, where=var > 0)
+
+    # Log-linear fit of the mono-exponential decay
+    logsig = np.log(np.clip(mean, 1e-6, None))
+    te_c = echo_times - echo_times.mean()
+    r2star = -(te_c @ (logsig - logsig.mean(axis=0))) / (te_c ** 2).sum()
+    valid = r2star > 0
+    t2star = np.zeros_like(r2star)
+    t2star[valid] = 1.0 / r2star[valid]
+    s0 = np.exp(logsig.mean(axis=0) + r2star * echo_times.mean())
+
+    # Optimal combination, equal weights where the fit failed
+    weights = np.ones_like(mean)
+    weights[:, valid] = echo_times[:, np.newaxis] * np.exp(
+        -echo_times[:, np.newaxis] / t2star[valid]
+    )
+    weights /= weights.sum(axis=0)
+    oc_mean = (weights * mean).sum(axis=0)
+    oc_var = np.einsum("ev,fv,efv->v", weights, weights, cov)
+    oc_tsnr = np.zeros_like(oc_mean)
+    np.divide(oc_mean, np.sqrt(np.clip(oc_var, 0, None)), out=oc_tsnr,
+              where=oc_var > 0)
+
+    t2s_valid = t2star[valid] if valid.any() else np.zeros(1)
+    measures = {
+        "me_necho": int(len(echo_times)),
+        "me_t2star_median": float(np.median(t2s_valid)),
+        "me_t2star_p05": float(np.percentile(t2s_valid, 5)),
+        "me_t2star_p95": float(np.percentile(t2s_valid, 95)),
+        "me_t2star_fail": float(1.0 - valid.mean()),
+        "me_s0_median": float(np.median(s0[valid])) if valid.any() else 0.0,
+        "me_tsnr_oc": float(np.median(oc_tsnr)),
+    }
+    for i, (echo_tsnr, echo_mean) in enumerate(zip(tsnr, mean), 1):
+        measures["me_tsnr_echo%d" % i] = float(np.median(echo_tsnr))
+        measures["me_mean_echo%d" % i] = float(np.median(echo_mean))
+    return measures
+
+
+def _sanitize_xforms(hdr):
+    """
+    Revise the qform/sform of a NIfTI header in place.
+
+    Follows the same decision table as
+    :py:class:`niworkflows.interfaces.utils.SanitizeImage`.
+    Returns ``True`` if the header was modified.
+
+    """
+    sform_code = int(hdr["sform_code"])
+    qform_code = int(hdr["qform_code"])
+
+    valid_qform = False
+    try:
+        qform = hdr.get_qform()
+        valid_qform = True
+    except ValueError:
+        pass
+
+    matching_affines = valid_qform and np.allclose(qform, hdr.get_sform())
+
+    if matching_affines and qform_code > 0 and sform_code > 0:
+        return False
+
+    if valid_qform and qform_code > 0:
+        hdr.set_sform(qform, qform_code)
+    elif sform_code > 0:
+        hdr.set_qform(hdr.get_sform(), sform_code)
+    else:
+        affine = hdr.get_best_affine()
+        hdr.set_sform(affine, nb.nifti1.xform_codes["scanner"])
+        hdr.set_qform(affine, nb.nifti1.xform_codes["scanner"])
+    return True
+
+
 def find_peaks(data):
     t_z = [data[:, :, i, :].mean(axis=0).mean(axis=0) for i in range(data.shape[2])]
     return t_z
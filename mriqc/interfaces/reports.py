@@ -59,10 +59,12 @@ class AddProvenance(SimpleInterface):
     output_spec = _AddProvenanceOutputSpec
 
     def _run_interface(self, runtime):
-        from nipype.utils.filemanip import hash_infile
+        from ..utils.digest import file_digest
 
         self._results["out_prov"] = {
-            "md5sum": hash_infile(self.inputs.in_file),
+            "md5sum": file_digest(
+                self.inputs.in_file, cache=config.execution.work_dir / "digests.db"
+            ),
             "version": config.environment.version,
             "software": "mriqc",
             "webapi_url": config.execution.webapi_url,
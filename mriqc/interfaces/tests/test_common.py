@@ -0,0 +1,66 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Common interfaces tests"""
+import os
+
+import pytest
+from nipype.pipeline.engine.utils import _parameterization_dir
+
+from mriqc.interfaces.common import CleanWorkDir
+
+
+def _write(fpath, size):
+    fpath.parent.mkdir(parents=True, exist_ok=True)
+    fpath.write_bytes(b"\x00" * size)
+    return fpath
+
+
+def _echoes(subject):
+    """Parameterization of a multi-echo run, longer than nipype's limit."""
+    files = [
+        "..data..sub-%s..ses-01..func..sub-%s_ses-01_task-rest_acq-mb4_echo-%d_bold.nii.gz"
+        % (subject, subject, echo)
+        for echo in (1, 2, 3)
+    ]
+    return _parameterization_dir(
+        "_echo_times_0.0135.0.0298.0.0461_in_echoes_%s_in_file_%s"
+        % ("..".join(files), files[0]),
+        252,
+    )
+
+
+@pytest.mark.parametrize("branch,sibling", [
+    (
+        "_in_file_..data..sub-01_task-rest_bold.nii.gz",
+        "_in_file_..data..sub-02_task-rest_bold.nii.gz",
+    ),
+    (_echoes("01"), _echoes("02")),
+])
+def test_clean_workdir(tmp_path, monkeypatch, branch, sibling):
+    wf_dir = tmp_path / "funcMRIQC"
+
+    deleted = [
+        _write(wf_dir / branch / "sanitize" / "bold.nii.gz", 1000),
+        # Same branch within a nested workflow
+        _write(wf_dir / "fMRI_HMC" / branch / "motion_correct" / "bold_volreg.nii", 1000),
+    ]
+    kept = [
+        _write(wf_dir / branch / "sanitize" / "small.nii.gz", 10),
+        _write(wf_dir / branch / "sanitize" / "result_sanitize.pklz", 1000),
+        _write(wf_dir / branch / "PlotMosaicMean" / "plot_func_mean_mosaic1.svg", 1000),
+        _write(wf_dir / branch / "measures" / "iqms.json", 1000),
+        _write(wf_dir / sibling / "sanitize" / "bold.nii.gz", 1000),
+        _write(wf_dir / branch / "clean_workdir" / "bulky.nii.gz", 1000),
+    ]
+    link = wf_dir / branch / "cache_ras" / "bold.nii.gz"
+    link.parent.mkdir(parents=True)
+    os.symlink(str(kept[4]), str(link))
+
+    monkeypatch.chdir(wf_dir / branch / "clean_workdir")
+    result = CleanWorkDir(min_size=100).run()
+
+    assert result.outputs.deleted == len(deleted)
+    assert result.outputs.freed == 1000 * len(deleted)
+    assert not any(fpath.exists() for fpath in deleted)
+    assert all(fpath.exists() for fpath in kept)
+    assert link.is_symlink() and link.exists()
@@ -0,0 +1,102 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Single- vs. double-precision IQMs"""
+import numpy as np
+import nibabel as nb
+import pytest
+from scipy import ndimage as nd
+
+from mriqc.interfaces.anatomical import StructuralQC
+from mriqc.interfaces.functional import FunctionalQC
+
+
+def _save(data, fname, dtype=None):
+    img = nb.Nifti1Image(np.asanyarray(data, dtype=np.float32), np.eye(4))
+    if dtype is not None:
+        img.set_data_dtype(dtype)
+    img.to_filename(str(fname))
+    return str(fname)
+
+
+def _phantom(shape=(48, 48, 48)):
+    """Nested spheres of WM, GM and CSF within a head, surrounded by air."""
+    grid = np.indices(shape) - ((np.array(shape) - 1) / 2)[:, None, None, None]
+    radius = np.sqrt((grid ** 2).sum(0))
+    segm = np.zeros(shape, dtype=np.uint8)
+    segm[radius < 19] = 1
+    segm[radius < 14] = 2
+    segm[radius < 9] = 3
+    head = radius < 22
+    return segm, head
+
+
+def _compare(single, double):
+    assert set(single) == set(double)
+    for key, value in double.items():
+        if isinstance(value, (int, float)):
+            assert np.isclose(single[key], value, rtol=1e-4, atol=1e-6), key
+
+
+@pytest.fixture
+def anat_inputs(tmp_path):
+    rng = np.random.RandomState(0)
+    segm, head = _phantom()
+    means = np.array([0, 300, 600, 900])
+    data = means[segm] + head * 50 + rng.rayleigh(20, size=segm.shape)
+    pvms = [
+        nd.gaussian_filter((segm == label).astype(float), 0.7) for label in (1, 2, 3)
+    ]
+    air = (~nd.binary_dilation(head, iterations=2)).astype(np.uint8)
+    return {
+        "in_file": _save(data, tmp_path / "t1w.nii.gz", np.int16),
+        "in_noinu": _save(data, tmp_path / "noinu.nii.gz", np.int16),
+        "in_segm": _save(segm, tmp_path / "segm.nii.gz", np.uint8),
+        "in_bias": _save(1 + rng.uniform(-0.05, 0.05, segm.shape), tmp_path / "bias.nii.gz"),
+        "head_msk": _save(head, tmp_path / "head.nii.gz", np.uint8),
+        "air_msk": _save(air, tmp_path / "air.nii.gz", np.uint8),
+        "rot_msk": _save(np.zeros(segm.shape), tmp_path / "rot.nii.gz", np.uint8),
+        "artifact_msk": _save(np.zeros(segm.shape), tmp_path / "art.nii.gz", np.uint8),
+        "in_pvms": [
+            _save(pvm, tmp_path / ("pvm%d.nii.gz" % i)) for i, pvm in enumerate(pvms)
+        ],
+        "mni_tpms": [
+            _save(nd.gaussian_filter(pvm, 1.5), tmp_path / ("tpm%d.nii.gz" % i))
+            for i, pvm in enumerate(pvms)
+        ],
+        "in_fwhm": [2.1, 2.2, 2.3, 2.2],
+    }
+
+
+@pytest.fixture
+def func_inputs(tmp_path):
+    rng = np.random.RandomState(1)
+    segm, head = _phantom((30, 30, 30))
+    base = np.array([0, 500, 700, 600])[segm] + 10
+    series = base[..., np.newaxis] + rng.normal(0, 15, size=segm.shape + (40,))
+    np.savetxt(str(tmp_path / "fd.txt"), rng.uniform(0, 0.4, 39), header="FramewiseDisplacement")
+    np.savetxt(str(tmp_path / "dvars.tsv"), rng.uniform(0.5, 30, (39, 3)), header="std nstd vstd")
+    return {
+        "in_epi": _save(series.mean(-1), tmp_path / "mean.nii.gz"),
+        "in_hmc": _save(series, tmp_path / "hmc.nii.gz", np.int16),
+        "in_tsnr": _save(series.mean(-1) / series.std(-1), tmp_path / "tsnr.nii.gz"),
+        "in_mask": _save(segm > 0, tmp_path / "mask.nii.gz", np.uint8),
+        "in_fd": str(tmp_path / "fd.txt"),
+        "in_dvars": str(tmp_path / "dvars.tsv"),
+        "in_fwhm": [2.5, 2.6, 2.4, 2.5],
+    }
+
+
+def test_structural_precision(anat_inputs, tmp_path, monkeypatch):
+    """StructuralQC IQMs are insensitive to loading the data in single precision"""
+    monkeypatch.chdir(tmp_path)
+    single = StructuralQC(dtype="float32", **anat_inputs).run().outputs.out_qc
+    double = StructuralQC(dtype="float64", **anat_inputs).run().outputs.out_qc
+    _compare(single, double)
+
+
+def test_functional_precision(func_inputs, tmp_path, monkeypatch):
+    """FunctionalQC IQMs are insensitive to loading the data in single precision"""
+    monkeypatch.chdir(tmp_path)
+    single = FunctionalQC(dtype="float32", **func_inputs).run().outputs.out_qc
+    double = FunctionalQC(dtype="float64", **func_inputs).run().outputs.out_qc
+    _compare(single, double)
@@ -13,10 +13,19 @@ from nipype.interfaces.base import (
 )
 
 from io import open  # pylint: disable=W0622
-from ..viz.utils import plot_mosaic, plot_segmentation, plot_spikes
+from .common import PrecisionInputSpec
+from ..viz.utils import (
+    carpet_data,
+    plot_carpet,
+    plot_ica_components,
+    plot_mosaic,
+    plot_segmentation,
+    plot_spikes,
+    slice_background,
+)
 
 
-class PlotContoursInputSpec(BaseInterfaceInputSpec):
+class PlotContoursInputSpec(PrecisionInputSpec):
     in_file = File(exists=True, mandatory=True, desc="File to be plotted")
     in_contours = File(
         exists=True, mandatory=True, desc="file to pick the contours from"
@@ -79,12 +88,13 @@ class PlotContours(SimpleInterface):
             saturate=self.inputs.saturate,
             vmin=vmin,
             vmax=vmax,
+            dtype=self.inputs.dtype,
         )
 
         return runtime
 
 
-class PlotBaseInputSpec(BaseInterfaceInputSpec):
+class PlotBaseInputSpec(PrecisionInputSpec):
     in_file = File(exists=True, mandatory=True, desc="File to be plotted")
     title = traits.Str(desc="a title string for the plot")
     annotate = traits.Bool(True, usedefault=True, desc="annotate left/right")
@@ -131,6 +141,7 @@ class PlotMosaic(SimpleInterface):
             bbox_mask_file=mask,
             cmap=self.inputs.cmap,
             annotate=self.inputs.annotate,
+            dtype=self.inputs.dtype,
         )
         self._results["out_file"] = str(
             (Path(runtime.cwd) / self.inputs.out_file).resolve()
@@ -168,6 +179,274 @@ class PlotSpikes(SimpleInterface):
 
         spikes_list = [tuple(i) for i in np.atleast_2d(spikes_list).tolist()]
         plot_spikes(
-            self.inputs.in_file, self.inputs.in_fft, spikes_list, out_file=out_file
+            self.inputs.in_file, self.inputs.in_fft, spikes_list, out_file=out_file,
+            dtype=self.inputs.dtype,
+        )
+        return runtime
+
+
+class PlotCarpetInputSpec(BaseInterfaceInputSpec):
+    in_func = File(exists=True, mandatory=True, desc="BOLD timeseries")
+    in_segm = File(exists=True, mandatory=True, desc="carpet segmentation")
+    in_spikes_bg = File(
+        exists=True, xor=["in_bg_mask"], desc="slice-wise background timeseries"
+    )
+    in_bg_mask = File(
+        exists=True,
+        xor=["in_spikes_bg"],
+        desc="background mask to extract the slice-wise background timeseries",
+    )
+    in_bg_func = File(
+        exists=True,
+        requires=["in_bg_mask"],
+        desc="BOLD timeseries to extract the slice-wise background timeseries from "
+        "(by default, ``in_func``)",
+    )
+    fd = File(exists=True, mandatory=True, desc="framewise displacement")
+    fd_thres = traits.Float(0.2, usedefault=True, desc="FD threshold")
+    dvars = File(exists=True, mandatory=True, desc="DVARS")
+    outliers = File(exists=True, mandatory=True, desc="fraction of outliers")
+    tr = traits.Float(desc="the repetition time")
+    max_rows = traits.Int(
+        800, usedefault=True, desc="maximum number of voxels plotted"
+    )
+    max_cols = traits.Int(
+        800, usedefault=True, desc="maximum number of time bins plotted"
+    )
+    chunk_size = traits.Int(
+        32, usedefault=True, desc="number of volumes read at once"
+    )
+    out_file = File("plot_func_carpet.svg", usedefault=True, desc="output file name")
+
+
+class PlotCarpetOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc="output svg file")
+    out_spikes_bg = File(desc="slice-wise background timeseries")
+
+
+class PlotCarpet(SimpleInterface):
+    """
+    Plot the fMRI summary (confounds and carpet plot) of a BOLD run.
+
+    A drop-in for niworkflows' ``FMRISummary`` with bounded memory and output
+    size: the carpet is built from a stratified sample of voxels and binned
+    timepoints (see :py:func:`~mriqc.viz.utils.carpet_data`), and it is
+    embedded as a raster image.
+    With ``in_bg_mask``, the slice-wise background timeseries are extracted
+    in the same pass over the data, or from ``in_bg_func`` if given (e.g., to
+    find spikes on the series before head-motion correction).
+
+    """
+
+    input_spec = PlotCarpetInputSpec
+    output_spec = PlotCarpetOutputSpec
+
+    def _run_interface(self, runtime):
+        import nibabel as nb
+
+        img = nb.load(self.inputs.in_func)
+        tr = (
+            self.inputs.tr if isdefined(self.inputs.tr)
+            else float(img.header.get_zooms()[3])
+        )
+
+        bg_mask = None
+        if isdefined(self.inputs.in_bg_mask):
+            bg_mask = np.asanyarray(nb.load(self.inputs.in_bg_mask).dataobj)
+
+        bg_func = self.inputs.in_bg_func if isdefined(self.inputs.in_bg_func) else None
+
+        data, labels, edges, spikes = carpet_data(
+            img,
+            np.asanyarray(nb.load(self.inputs.in_segm).dataobj),
+            max_rows=self.inputs.max_rows,
+            max_cols=self.inputs.max_cols,
+            chunk_size=self.inputs.chunk_size,
+            bg_mask=None if bg_func else bg_mask,
+        )
+        if bg_func:
+            spikes = slice_background(bg_func, bg_mask, chunk_size=self.inputs.chunk_size)
+
+        confounds = [
+            ("outliers", np.loadtxt(self.inputs.outliers, usecols=[0]), "%", None),
+            # Pick non-standardize dvars (col 1), first timepoint is NaN (difference)
+            ("DVARS", np.hstack((
+                [np.nan], np.loadtxt(self.inputs.dvars, skiprows=1, usecols=[1]))),
+             None, None),
+            # First timepoint is zero (reference volume)
+            ("FD", np.hstack((
+                [0.0], np.loadtxt(self.inputs.fd, skiprows=1, usecols=[0]))),
+             "mm", self.inputs.fd_thres),
+        ]
+
+        if spikes is not None:
+            self._results["out_spikes_bg"] = str(
+                Path(runtime.cwd) / "spikes_bg_tsz.txt")
+            np.savetxt(self._results["out_spikes_bg"], spikes)
+        elif isdefined(self.inputs.in_spikes_bg):
+            spikes = np.atleast_2d(np.loadtxt(self.inputs.in_spikes_bg))
+
+        out_file = str((Path(runtime.cwd) / self.inputs.out_file).resolve())
+        self._results["out_file"] = plot_carpet(
+            data, labels, edges, tr=tr, confounds=confounds, spikes=spikes,
+            out_file=out_file,
         )
         return runtime
+
+
+class PlotICAInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, mandatory=True, desc="BOLD timeseries")
+    in_mask = File(exists=True, mandatory=True, desc="brain mask")
+    n_components = traits.Int(
+        20, usedefault=True, desc="number of independent components"
+    )
+    n_power_iter = traits.Int(
+        1, usedefault=True, desc="power iterations of the randomized SVD"
+    )
+    chunk_size = traits.Int(
+        32, usedefault=True, desc="number of volumes read at once"
+    )
+    seed = traits.Int(1234, usedefault=True, desc="seed of the random generators")
+    out_file = File(
+        "plot_func_ica_components.svg", usedefault=True, desc="output file name"
+    )
+
+
+class PlotICAOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc="output svg file")
+
+
+class PlotICA(SimpleInterface):
+    """
+    Plot the spatial independent components of a BOLD timeseries.
+
+    A lightweight replacement of FSL MELODIC for the individual reports: the
+    timeseries within the mask is reduced with a randomized SVD (see
+    :py:func:`ica_decomposition`) and FastICA is run on the reduced
+    data, then maps and timecourses of the components are plotted.
+
+    """
+
+    input_spec = PlotICAInputSpec
+    output_spec = PlotICAOutputSpec
+
+    def _run_interface(self, runtime):
+        import nibabel as nb
+
+        img = nb.load(self.inputs.in_file)
+        mask = np.asanyarray(nb.load(self.inputs.in_mask).dataobj) > 0
+
+        maps, timecourses, mean = ica_decomposition(
+            img,
+            mask,
+            n_components=self.inputs.n_components,
+            n_power_iter=self.inputs.n_power_iter,
+            chunk_size=self.inputs.chunk_size,
+            seed=self.inputs.seed,
+            cache_dir=runtime.cwd,
+        )
+
+        out_file = str((Path(runtime.cwd) / self.inputs.out_file).resolve())
+        self._results["out_file"] = out_file
+
+        volumes = np.zeros(mask.shape + (maps.shape[1],), dtype=np.float32)
+        volumes[mask] = maps
+        bg_data = np.zeros(mask.shape, dtype=np.float32)
+        bg_data[mask] = mean
+        plot_ica_components(
+            nb.Nifti1Image(volumes, img.affine),
+            timecourses,
+            nb.Nifti1Image(bg_data, img.affine),
+            tr=float(img.header.get_zooms()[3]),
+            out_file=out_file,
+        )
+        return runtime
+
+
+def ica_decomposition(img, mask, n_components=20, n_power_iter=1, oversampling=10,
+                      chunk_size=32, seed=1234, cache_dir=None):
+    """
+    Spatial ICA of a BOLD timeseries, reading it by blocks of volumes.
+
+    The variance-normalized data matrix :math:`X` (voxels within the mask by
+    timepoints) is approximated with a randomized SVD
+    (Halko et al., 2011, doi:10.1137/090771806), which only requires products
+    of :math:`X` and :math:`X^T` with thin matrices.
+    These products are accumulated over blocks of volumes, so only one block
+    and a few (voxels by components) matrices are held in memory.
+    The file is decompressed only once: the voxels within the mask are copied
+    (as float32) into a temporary file under ``cache_dir``, which the
+    remaining ``2 + 2 * n_power_iter`` passes read back by blocks.
+    Finally, FastICA is run on the (whitened) left singular vectors.
+
+    :return: the component maps (z-scored, voxels x components), their
+        timecourses (timepoints x components), sorted by explained variance,
+        and the temporal mean of the voxels within the mask
+
+    """
+    from tempfile import TemporaryFile
+    from sklearn.decomposition import FastICA
+    from ..utils.nifti import stream_blocks
+
+    mask = np.asanyarray(mask, dtype=bool)
+    ntsteps = img.shape[3]
+    nvox = int(mask.sum())
+    rank = min(n_components + oversampling, ntsteps, nvox)
+    chunks = [
+        (t0, min(t0 + chunk_size, ntsteps)) for t0 in range(0, ntsteps, chunk_size)
+    ]
+
+    # Voxelwise moments, caching the masked data (single pass over the file)
+    cache = np.memmap(TemporaryFile(dir=cache_dir), dtype=np.float32, mode="w+",
+                      shape=(ntsteps, nvox))
+    mean = np.zeros(nvox)
+    sqsum = np.zeros(nvox)
+    for (t0, t1), block in zip(chunks, stream_blocks(img, chunk_size)):
+        block = np.asanyarray(block)[mask].astype(np.float64)
+        cache[t0:t1] = block.T
+        mean += block.sum(axis=1)
+        sqsum += (block ** 2).sum(axis=1)
+    mean /= ntsteps
+    std = np.sqrt(np.clip(sqsum / ntsteps - mean ** 2, 0, None))
+    std[std < 1e-8] = 1.0
+
+    def _normalized(t0, t1):
+        block = cache[t0:t1].T.astype(np.float64)
+        return (block - mean[:, np.newaxis]) / std[:, np.newaxis]
+
+    def _xt_dot(mat):  # X^T @ mat
+        return np.vstack([_normalized(t0, t1).T @ mat for t0, t1 in chunks])
+
+    def _x_dot(mat):  # X @ mat
+        out = np.zeros((nvox, mat.shape[1]))
+        for t0, t1 in chunks:
+            out += _normalized(t0, t1) @ mat[t0:t1]
+        return out
+
+    # Randomized range finder on the temporal side
+    rng = np.random.RandomState(seed)
+    basis = np.linalg.qr(_xt_dot(rng.normal(size=(nvox, rank))))[0]
+    for _ in range(n_power_iter):
+        basis = np.linalg.qr(_x_dot(basis))[0]
+        basis = np.linalg.qr(_xt_dot(basis))[0]
+
+    # X ~ U diag(s) (basis @ Vt)^T
+    u, s, vt = np.linalg.svd(_x_dot(basis), full_matrices=False)
+    n_components = min(n_components, len(s))
+    u = u[:, :n_components]
+    timecourses = basis @ vt[:n_components].T * s[:n_components]
+
+    ica = FastICA(n_components=n_components, whiten=False, max_iter=500,
+                  random_state=seed)
+    sources = ica.fit_transform(u * np.sqrt(nvox))
+    unmixing = ica.components_
+    timecourses = timecourses @ unmixing.T / np.sqrt(nvox)
+
+    # Positive skew, z-scored maps and variance ordering
+    sign = np.sign(((sources - sources.mean(0)) ** 3).mean(0))
+    sign[sign == 0] = 1
+    sources *= sign
+    timecourses *= sign
+    sources = (sources - sources.mean(0)) / sources.std(0)
+    order = np.argsort(-timecourses.var(axis=0))
+    return sources[:, order], timecourses[:, order], mean
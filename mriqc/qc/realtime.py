@@ -0,0 +1,428 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+r"""
+Streaming (real-time) quality control of BOLD acquisitions.
+
+The measures in this module are updated volume by volume, as the data
+arrive from the scanner, with online algorithms whose cost per volume
+does not depend on the number of volumes already seen:
+
+Framewise displacement
+  The rigid-body parameters of each volume with respect to a fixed
+  reference are estimated with a few Gauss-Newton iterations on a sample of
+  voxels, linearizing around the reference image as in [Friston1995]_.
+  The parameters of the previous volume act as a weak (random-walk) prior,
+  which damps the directions the image barely constrains (e.g., rotations of
+  nearly symmetric objects) so that thermal noise is not reported as motion.
+  FD is then calculated as in [Power2012]_.
+
+DVARS
+  The root-mean-square of the temporal derivative within the mask, which
+  only requires the previous volume.
+  As in :py:func:`nipype.algorithms.confounds.compute_dvars`, the summary
+  ``dvars_nstd`` is calculated on data scaled to a median of 1000 within the
+  mask (the median of the reference volume is used).
+
+Temporal SNR
+  Voxelwise mean and variance are accumulated with Welford's algorithm.
+
+Global signal and spikes
+  The global signal is the average within the mask.
+  For spikes, slice-wise averages are z-scored against their running
+  mean and standard deviation (before the current volume is accumulated).
+
+.. topic:: References
+
+  .. [Friston1995] Friston KJ, Ashburner J, Frith CD, Poline J-B, Heather JD,
+    Frackowiak RSJ, *Spatial registration and normalization of images*,
+    Hum Brain Mapp 3:165-189, 1995. doi:`10.1002/hbm.460030303
+    <https://doi.org/10.1002/hbm.460030303>`_.
+
+"""
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import nibabel as nb
+from scipy import ndimage as nd
+
+
+class OnlineMoments:
+    """Running mean and variance (Welford's algorithm) of arrays."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self._m2 = None
+
+    def update(self, data):
+        """Accumulate one observation."""
+        data = np.asanyarray(data, dtype=np.float64)
+        if self.mean is None:
+            self.mean = np.zeros_like(data)
+            self._m2 = np.zeros_like(data)
+        self.n += 1
+        delta = data - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (data - self.mean)
+
+    @property
+    def var(self):
+        """Population variance of the observations."""
+        if self.n < 1:
+            return None
+        return self._m2 / self.n
+
+    @property
+    def std(self):
+        """Population standard deviation of the observations."""
+        if self.n < 1:
+            return None
+        return np.sqrt(self.var)
+
+
+class RigidTracker:
+    """
+    Estimate the rigid-body motion of volumes with respect to a fixed reference.
+
+    The Jacobian of the reference image with respect to three translations (mm)
+    and three rotations (rad) about the center of the grid is computed once,
+    on a sample of voxels within the mask.
+    Each new volume is then only interpolated at the sampled locations.
+
+    When an initial estimate is given, the volume-to-volume change of the
+    parameters has a zero-mean Gaussian prior of standard deviation
+    ``motion_prior`` (mm, rotations taken at ``radius`` mm), weighted against
+    the residual variance of the fit.
+    Well-determined parameters are left virtually unchanged, while those within
+    the noise level are shrunk towards the previous volume.
+
+    """
+
+    def __init__(self, reference, zooms, mask=None, n_samples=20000, n_iter=3,
+                 smooth=1.0, motion_prior=0.05, radius=50.0):
+        reference = nd.gaussian_filter(
+            np.asanyarray(reference, dtype=np.float32), smooth)
+        if mask is None:
+            mask = reference > reference.mean()
+
+        self.smooth = smooth
+        self.n_iter = n_iter
+        scale = np.array([1.0] * 3 + [radius] * 3) / motion_prior
+        self._prior = np.diag(scale ** 2)
+        # Smoothing correlates the residuals over about one FWHM^3 (in voxels)
+        self._resel = max((2.0 * np.sqrt(2.0 * np.log(2.0)) * smooth) ** 3, 1.0)
+        self.zooms = np.array(zooms[:3], dtype=float)
+        self.center = (np.array(reference.shape[:3]) - 1) * 0.5
+
+        # Sample voxels, avoiding the borders where gradients are not reliable
+        inner = np.zeros_like(mask, dtype=bool)
+        inner[2:-2, 2:-2, 2:-2] = True
+        ijk = np.argwhere(np.asanyarray(mask, dtype=bool) & inner)
+        if len(ijk) > n_samples:
+            ijk = ijk[np.random.RandomState(1234).choice(len(ijk), n_samples,
+                                                         replace=False)]
+        self._ijk = ijk.T
+        self._xyz = (ijk - self.center) * self.zooms  # mm, centered
+        self._ref = reference[tuple(self._ijk)]
+
+        grads = np.stack([
+            g[tuple(self._ijk)] for g in np.gradient(reference, *self.zooms)
+        ], axis=-1)
+        self._jacobian = np.hstack((grads, np.cross(self._xyz, grads)))
+        self._pinv = np.linalg.pinv(self._jacobian)
+        self._hessian = self._jacobian.T @ self._jacobian
+
+    def _sample(self, volume, params):
+        trans, rot = params[:3], params[3:]
+        moved = self._xyz + trans + np.cross(rot, self._xyz)
+        coords = moved / self.zooms + self.center
+        return nd.map_coordinates(volume, coords.T, order=1, mode="nearest")
+
+    def estimate(self, volume, init=None):
+        """
+        Estimate the motion parameters of one volume.
+
+        :param volume: the 3D data array
+        :param init: initial parameters (e.g., those of the previous volume),
+            also the mean of the prior
+        :return: translations (mm) and rotations (rad) as an array of six
+            parameters
+
+        """
+        volume = nd.gaussian_filter(
+            np.asanyarray(volume, dtype=np.float32), self.smooth)
+        if init is None:
+            params = np.zeros(6)
+            for _ in range(self.n_iter):
+                residual = self._sample(volume, params) - self._ref
+                params -= self._pinv @ residual
+            return params
+
+        init = np.array(init, dtype=float)
+        params = init.copy()
+        for _ in range(self.n_iter):
+            residual = self._sample(volume, params) - self._ref
+            sigma2 = self._resel * max(np.mean(residual ** 2), np.finfo(float).eps)
+            params -= np.linalg.solve(
+                self._hessian + sigma2 * self._prior,
+                self._jacobian.T @ residual + sigma2 * self._prior @ (params - init),
+            )
+        return params
+
+
+class RealTimeQC:
+    """
+    Online quality control of a BOLD run, one volume at a time.
+
+    >>> rtqc = RealTimeQC()  # doctest: +SKIP
+    >>> for img in iter_volumes('sub-01_task-rest_bold.nii.gz'):  # doctest: +SKIP
+    ...     record = rtqc.update(img)
+    >>> iqms = rtqc.summary()  # doctest: +SKIP
+
+    :param reference: reference volume for motion estimation (a nibabel image,
+        a path or an array), defaults to the first volume received
+    :param mask: mask of the brain (a nibabel image, a path or an array), by
+        default the voxels of the reference brighter than its mean
+    :param float fd_radius: radius (mm) of the sphere for the FD calculation
+    :param float fd_thres: motion threshold for FD outliers
+    :param float spike_thresh: z-score to call one timepoint of one slice a spike
+    :param feed: a writable file object where one JSON record per volume is written
+
+    """
+
+    def __init__(self, reference=None, mask=None, fd_radius=50.0, fd_thres=0.2,
+                 spike_thresh=6.0, n_samples=20000, feed=None):
+        self.fd_radius = fd_radius
+        self.fd_thres = fd_thres
+        self.spike_thresh = spike_thresh
+        self.n_samples = n_samples
+        self.feed = feed
+
+        self._reference = reference
+        self._mask = None if mask is None else _get_data(mask) > 0
+        self._tracker = None
+        self._zooms = None
+        self._shape = None
+        self._tr = None
+        self._params = None
+        self._prev = None
+        self._dvars_scale = 1.0
+        self._moments = OnlineMoments()
+        self._slices = OnlineMoments()
+        self.records = []
+
+    def _init(self, volume, zooms):
+        reference = (
+            volume if self._reference is None else _get_data(self._reference)
+        )
+        reference = np.squeeze(reference).astype(np.float32)
+        if self._mask is None:
+            self._mask = reference > reference.mean()
+        median = np.median(reference[self._mask]) if self._mask.any() else 0.0
+        if median > 0:
+            self._dvars_scale = 1000.0 / float(median)
+        self._tracker = RigidTracker(
+            reference, zooms, mask=self._mask, n_samples=self.n_samples,
+            radius=self.fd_radius)
+        self._zooms = zooms
+        self._shape = reference.shape
+
+    def update(self, volume):
+        """
+        Process one volume.
+
+        :param volume: a nibabel image, a path or a 3D array
+        :return: a dictionary with the measures of this volume
+
+        """
+        tic = time.time()
+        zooms = (1.0, 1.0, 1.0)
+        if hasattr(volume, "header") or isinstance(volume, (str, Path)):
+            img = volume if hasattr(volume, "header") else nb.load(str(volume))
+            zooms = img.header.get_zooms()
+            if len(zooms) > 3 and self._tr is None:
+                self._tr = float(zooms[3])
+            volume = img.dataobj
+        volume = np.squeeze(np.asanyarray(volume)).astype(np.float32)
+
+        if self._tracker is None:
+            self._init(volume, zooms)
+
+        index = self._moments.n
+        params = self._tracker.estimate(volume, init=self._params)
+        fd = 0.0
+        if self._params is not None:
+            delta = np.abs(params - self._params)
+            fd = float(delta[:3].sum() + self.fd_radius * delta[3:].sum())
+        self._params = params
+
+        masked = volume[self._mask]
+        dvars = 0.0
+        if self._prev is not None:
+            dvars = float(np.sqrt(np.mean((masked - self._prev) ** 2)))
+        self._prev = masked
+
+        # Slice-wise averages, z-scored with the statistics of previous volumes
+        slice_means = np.array([
+            volume[..., k][self._mask[..., k]].mean()
+            if self._mask[..., k].any() else 0.0
+            for k in range(volume.shape[2])
+        ])
+        spike_z = 0.0
+        if self._slices.n > 2:
+            std = self._slices.std
+            valid = std > 0
+            if valid.any():
+                spike_z = float(np.abs(
+                    (slice_means[valid] - self._slices.mean[valid]) / std[valid]
+                ).max())
+        self._slices.update(slice_means)
+        self._moments.update(volume)
+
+        record = {
+            "volume": index,
+            "fd": fd,
+            "dvars": dvars,
+            "global_signal": float(masked.mean()),
+            "spike_z": spike_z,
+            "spike": bool(spike_z > self.spike_thresh),
+            "motion": [float(p) for p in params],
+            "latency": time.time() - tic,
+        }
+        self.records.append(record)
+        if self.feed is not None:
+            self.feed.write(json.dumps(record) + "\n")
+            self.feed.flush()
+        return record
+
+    @property
+    def tsnr(self):
+        """Current temporal SNR map."""
+        std = self._moments.std
+        tsnr = np.zeros_like(std)
+        np.divide(self._moments.mean, std, out=tsnr, where=std > 0)
+        return tsnr
+
+    def summary(self):
+        """
+        Calculate the IQMs of the volumes processed so far.
+
+        The names of the measures follow those of the regular functional
+        workflow, see :py:mod:`mriqc.qc.functional`.
+
+        """
+        if not self.records:
+            return {}
+
+        # As in the offline workflow, FD and DVARS are undefined for the first volume
+        fd = np.array([rec["fd"] for rec in self.records][1:] or [0.0])
+        dvars = np.array([rec["dvars"] for rec in self.records][1:] or [0.0])
+        num_fd = int((fd > self.fd_thres).sum())
+        iqms = {
+            "fd_mean": float(fd.mean()),
+            "fd_num": num_fd,
+            "fd_perc": float(num_fd * 100 / (len(fd) + 1)),
+            "dvars_nstd": float(dvars.mean() * self._dvars_scale),
+            "tsnr": float(np.median(self.tsnr[self._mask])),
+            "spikes_num": int(sum(rec["spike"] for rec in self.records)),
+            "gs_std": float(np.std([rec["global_signal"] for rec in self.records])),
+        }
+        for axis, value in zip("xyz", self._shape):
+            iqms["size_%s" % axis] = int(value)
+        iqms["size_t"] = len(self.records)
+        for axis, value in zip("xyz", self._zooms):
+            iqms["spacing_%s" % axis] = float(value)
+        if self._tr is not None:
+            iqms["spacing_tr"] = self._tr
+        return iqms
+
+    def write_iqms(self, out_file, metadata=None):
+        """
+        Write the final IQMs as a JSON file.
+
+        The layout of the file matches that of the files written by
+        :py:class:`~mriqc.interfaces.bids.IQMFileSink`.
+
+        """
+        from .. import __version__
+
+        iqms = self.summary()
+        iqms["bids_meta"] = {"modality": "bold"}
+        iqms["bids_meta"].update(metadata or {})
+        iqms["provenance"] = {
+            "software": "mriqc",
+            "version": __version__,
+            "realtime": True,
+            "settings": {"fd_thres": self.fd_thres},
+        }
+        Path(out_file).write_text(
+            json.dumps(iqms, sort_keys=True, indent=2, ensure_ascii=False)
+        )
+        return out_file
+
+    def run(self, volumes):
+        """Process all the volumes from an iterable and return the IQMs."""
+        for volume in volumes:
+            self.update(volume)
+        return self.summary()
+
+
+def iter_volumes(in_file):
+    """Iterate over the volumes of a 4D NIfTI file (e.g., to replay a run)."""
+    from ..utils.nifti import stream_blocks
+
+    img = nb.load(str(in_file))
+    for block in stream_blocks(img, chunk_size=1):
+        yield nb.Nifti1Image(block[..., 0], img.affine, img.header)
+
+
+def iter_volumes_from_dir(path, pattern="*.nii*", timeout=30.0, poll=0.05,
+                          n_volumes=None):
+    """
+    Iterate over per-volume NIfTI files as they appear in a directory.
+
+    Files are consumed in lexicographical order, once their size has not
+    changed between two consecutive polls (i.e., the writer has finished).
+    The iteration ends after ``n_volumes`` volumes, or when no new file has
+    been completed for ``timeout`` seconds.
+
+    """
+    path = Path(path)
+    seen = set()
+    sizes = {}
+    count = 0
+    last = time.time()
+    while n_volumes is None or count < n_volumes:
+        pending = sorted(f for f in path.glob(pattern) if f not in seen)
+        ready = []
+        for fname in pending:
+            size = fname.stat().st_size
+            if size > 0 and sizes.get(fname) == size:
+                ready.append(fname)
+            else:
+                sizes[fname] = size
+                break  # preserve the acquisition order
+
+        for fname in ready:
+            seen.add(fname)
+            sizes.pop(fname, None)
+            count += 1
+            last = time.time()
+            yield nb.load(str(fname))
+            if n_volumes is not None and count >= n_volumes:
+                return
+
+        if not ready:
+            if time.time() - last > timeout:
+                return
+            time.sleep(poll)
+
+
+def _get_data(data):
+    if isinstance(data, (str, Path)):
+        data = nb.load(str(data))
+    if hasattr(data, "dataobj"):
+        data = data.dataobj
+    return np.squeeze(np.asanyarray(data))
@@ -11,8 +11,6 @@
 """
 Anatomical tests
 """
-from tempfile import mkdtemp
-from shutil import rmtree
 import numpy as np
 import pytest
 from scipy.stats import rice
@@ -93,9 +91,27 @@ def gtruth():
 
 
 @pytest.mark.parametrize("sigma", [0.02, 0.03, 0.05, 0.08, 0.12, 0.15, 0.2, 0.4, 0.5])
-def test_qi2(gtruth, sigma):
-    tmpdir = mkdtemp()
+def test_qi2(gtruth, tmp_path, monkeypatch, sigma):
+    monkeypatch.chdir(tmp_path)  # art_qi2 writes a placeholder plot
     data, _, bgdata = gtruth.get_data(sigma, rice)
     value, _ = art_qi2(data, bgdata, save_plot=False)
-    rmtree(tmpdir)
     assert value > 0.0 and value < 0.04
+
+
+@pytest.mark.parametrize("sigma", [0.05, 0.2])
+def test_iqms_precision(gtruth, tmp_path, sigma):
+    """IQMs are insensitive to loading the data in single precision"""
+    import nibabel as nb
+    from ..anatomical import efc, fber
+    from ...utils.nifti import load_data
+
+    data, wmdata, bgdata = gtruth.get_data(sigma)
+    img = nb.Nifti1Image(np.clip(data, 0, None).astype(np.float32), np.eye(4))
+    img.set_data_dtype(np.int16)
+    img.to_filename(str(tmp_path / "test.nii.gz"))
+
+    double = load_data(tmp_path / "test.nii.gz", "float64")
+    single = load_data(tmp_path / "test.nii.gz", "float32")
+    assert single.dtype == np.float32
+    assert np.isclose(efc(single), efc(double), rtol=1e-5)
+    assert np.isclose(fber(single, wmdata), fber(double, wmdata), rtol=1e-5)
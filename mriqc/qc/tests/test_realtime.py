@@ -0,0 +1,95 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Real-time QC tests"""
+import numpy as np
+import nibabel as nb
+import pytest
+from scipy import ndimage as nd
+
+from ..realtime import OnlineMoments, RigidTracker, RealTimeQC
+
+
+def _phantom(shape=(40, 40, 30)):
+    """A smooth ellipsoid with some texture."""
+    grid = np.indices(shape).astype(float)
+    center = (np.array(shape) - 1)[:, np.newaxis, np.newaxis, np.newaxis] * 0.5
+    radii = np.array(shape)[:, np.newaxis, np.newaxis, np.newaxis] * 0.35
+    inside = (((grid - center) / radii) ** 2).sum(0) < 1
+    texture = np.random.RandomState(0).uniform(0.5, 1.0, size=shape)
+    return nd.gaussian_filter(inside * texture * 1000, 1.5).astype(np.float32)
+
+
+def test_online_moments():
+    data = np.random.RandomState(1).normal(100, 5, size=(50, 10))
+    moments = OnlineMoments()
+    for row in data:
+        moments.update(row)
+    assert np.allclose(moments.mean, data.mean(0))
+    assert np.allclose(moments.std, data.std(0))
+
+
+@pytest.mark.parametrize("shift", [(1.0, 0.0, 0.0), (0.0, -0.5, 0.3)])
+def test_rigid_tracker(shift):
+    ref = _phantom()
+    moved = nd.shift(ref, shift, order=3)
+    tracker = RigidTracker(ref, (1.0, 1.0, 1.0), n_iter=5)
+    params = tracker.estimate(moved)
+    # Volumes are sampled at p + t, which must be p + s for content shifted by s
+    assert np.allclose(params[:3], shift, atol=0.1)
+    assert np.allclose(params[3:], 0, atol=0.01)
+
+
+def test_realtime_qc(tmp_path, monkeypatch):
+    ref = _phantom()
+    rng = np.random.RandomState(2)
+    volumes = [ref + rng.normal(0, 10, size=ref.shape) for _ in range(20)]
+    volumes[10] = nd.shift(volumes[10], (1.0, 0, 0), order=1)
+
+    rtqc = RealTimeQC()
+    records = [rtqc.update(vol) for vol in volumes]
+    assert records[0]["fd"] == 0.0
+    assert records[10]["fd"] > 0.5
+    assert records[11]["fd"] > 0.5
+
+    data = np.stack(volumes, axis=-1)[rtqc._mask]
+    assert np.isclose(
+        records[5]["dvars"],
+        np.sqrt(np.mean((data[:, 5] - data[:, 4]) ** 2)),
+        rtol=1e-4,
+    )
+
+    iqms = rtqc.summary()
+    assert iqms["fd_num"] == 2
+    dvars = np.sqrt(np.mean(np.diff(data, axis=1) ** 2, axis=0))
+    scale = 1000 / np.median(volumes[0][rtqc._mask])
+    assert np.isclose(iqms["dvars_nstd"], dvars.mean() * scale, rtol=1e-4)
+    assert iqms["size_t"] == 20
+
+    # The summary matches the IQMs of the offline workflow
+    from mriqc.interfaces.functional import FunctionalQC
+
+    def _save(data, name):
+        nb.Nifti1Image(np.asanyarray(data, dtype=np.float32), np.eye(4)).to_filename(
+            str(tmp_path / name)
+        )
+        return str(tmp_path / name)
+
+    series = np.stack(volumes, axis=-1)
+    np.savetxt(
+        str(tmp_path / "fd.txt"),
+        [rec["fd"] for rec in records[1:]],
+        header="FramewiseDisplacement",
+    )
+    np.savetxt(str(tmp_path / "dvars.tsv"), np.ones((19, 3)), header="std nstd vstd")
+    monkeypatch.chdir(tmp_path)
+    offline = FunctionalQC(
+        in_epi=_save(series.mean(-1), "mean.nii.gz"),
+        in_hmc=_save(series, "hmc.nii.gz"),
+        in_tsnr=_save(rtqc.tsnr, "tsnr.nii.gz"),
+        in_mask=_save(rtqc._mask, "mask.nii.gz"),
+        in_fd=str(tmp_path / "fd.txt"),
+        in_dvars=str(tmp_path / "dvars.tsv"),
+        in_fwhm=[2.5, 2.5, 2.5, 2.5],
+    ).run().outputs.out_qc
+    for key in ("fd_mean", "fd_num", "fd_perc", "tsnr"):
+        assert np.isclose(iqms[key], offline[key], rtol=1e-5), key
@@ -71,7 +71,7 @@ first {} volumes</span>. They were excluded before generating any QC measures an
     if in_plots is None:
         in_plots = []
     else:
-        if any(("melodic_reportlet" in k for k in in_plots)):
+        if any(("ica_components" in k for k in in_plots)):
             REPORT_TITLES["bold"].insert(3, ("ICA components", "ica-comps"))
         if any(("plot_spikes" in k for k in in_plots)):
             REPORT_TITLES["bold"].insert(3, ("Spikes", "spikes"))
@@ -37,6 +37,167 @@ def collect_bids_data(
     return imaging_data
 
 
+def group_bold_sessions(layout, files):
+    """
+    Group BOLD runs acquired within the same session with the same setup.
+
+    Runs are grouped by subject, session, acquisition and phase-encoding
+    direction, so that the runs of a group are expected to have nearly
+    identical reference images.
+
+    :param layout: a :py:class:`~bids.layout.BIDSLayout`
+    :param list files: BOLD runs
+    :return: a list of groups (lists of files), each group sorted
+
+    """
+    groups = {}
+    for fname in files:
+        entities = layout.parse_file_entities(fname)
+        key = (
+            entities.get("subject"),
+            entities.get("session"),
+            entities.get("acquisition"),
+            layout.get_metadata(fname).get("PhaseEncodingDirection"),
+        )
+        groups.setdefault(key, []).append(fname)
+    return [sorted(group) for group in groups.values()]
+
+
+def group_multiecho(layout, files):
+    """
+    Group the echoes of multi-echo BOLD runs.
+
+    Files that only differ in the ``echo`` entity are grouped together, and
+    sorted by echo time so that the first (shortest TE, highest SNR) echo
+    comes first.
+    Runs with a single echo, or with echoes missing the ``EchoTime``
+    metadata, are returned as groups of one file.
+
+    :param layout: a :py:class:`~bids.layout.BIDSLayout`
+    :param list files: BOLD runs
+    :return: a list of tuples ``(files, echo_times)``
+
+    """
+    groups = {}
+    for fname in files:
+        entities = layout.parse_file_entities(fname)
+        key = tuple(sorted(
+            (k, str(v)) for k, v in entities.items() if k != "echo"
+        ))
+        groups.setdefault(key, []).append(fname)
+
+    retval = []
+    for group in groups.values():
+        group = sorted(group)
+        echo_times = [layout.get_metadata(f).get("EchoTime") for f in group]
+        if len(group) < 2 or None in echo_times:
+            retval += [([f], [te]) for f, te in zip(group, echo_times)]
+            continue
+        echo_times, group = zip(*sorted(zip(echo_times, group)))
+        retval.append((list(group), [float(te) for te in echo_times]))
+    return retval
+
+
+def alias_iqms(orig_file, dup_file, bids_dir, output_dir):
+    """
+    Write the IQMs of ``orig_file`` as those of ``dup_file``, an input with identical data.
+
+    The entities in ``bids_meta`` are updated to those of ``dup_file``, and the
+    original is recorded in ``provenance``.
+
+    :return: the new IQMs file, or ``None`` if ``orig_file`` has no IQMs
+
+    """
+    import re
+    from .misc import BIDS_COMP, BIDS_EXPR
+
+    def _iqms_file(in_file):
+        rel = Path(in_file).relative_to(bids_dir)
+        return Path(output_dir) / str(rel).replace("".join(rel.suffixes), ".json")
+
+    orig_json = _iqms_file(orig_file)
+    if not orig_json.exists():
+        return None
+
+    iqms = json.loads(orig_json.read_text())
+    match = re.search(BIDS_EXPR, Path(dup_file).name)
+    entities = match.groupdict() if match else {}
+    bids_meta = iqms.setdefault("bids_meta", {})
+    for key in BIDS_COMP:
+        bids_meta.pop(key, None)
+        if entities.get(key) is not None:
+            bids_meta[key] = entities[key]
+    if str(bids_meta.get("run_id", "")).isdigit():
+        bids_meta["run_id"] = int(bids_meta["run_id"])
+    iqms.setdefault("provenance", {})["duplicate_of"] = str(
+        Path(orig_file).relative_to(bids_dir)
+    )
+
+    out_json = _iqms_file(dup_file)
+    out_json.parent.mkdir(parents=True, exist_ok=True)
+    out_json.write_text(json.dumps(iqms, sort_keys=True, indent=2, ensure_ascii=False))
+    return out_json
+
+
+def group_participants(inputs):
+    """
+    Split the inputs of a run by participant.
+
+    >>> group_participants({"T1w": ["/data/sub-01/anat/sub-01_T1w.nii.gz",
+    ...                            "/data/sub-02/anat/sub-02_T1w.nii.gz"],
+    ...                     "bold": ["/data/sub-01/func/sub-01_task-rest_bold.nii.gz"]})
+    {'01': {'T1w': ['/data/sub-01/anat/sub-01_T1w.nii.gz'], \
+'bold': ['/data/sub-01/func/sub-01_task-rest_bold.nii.gz']}, \
+'02': {'T1w': ['/data/sub-02/anat/sub-02_T1w.nii.gz']}}
+
+    :param dict inputs: files per modality, as :attr:`~mriqc.config.workflow.inputs`
+    :return: a dictionary mapping participant labels onto dictionaries like ``inputs``
+
+    """
+    import re
+    from .misc import BIDS_EXPR
+
+    participants = {}
+    for modality, files in inputs.items():
+        for fname in files:
+            match = re.search(BIDS_EXPR, Path(fname).name)
+            subject = match.group("subject_id") if match else None
+            participants.setdefault(subject, {}).setdefault(modality, []).append(fname)
+    return participants
+
+
+def shard_inputs(inputs, shard_size):
+    """
+    Split the inputs of a run into shards of whole participants.
+
+    Participants are kept together, so that the runs grouped by session or echo
+    never straddle two shards, and are added to a shard until it holds
+    ``shard_size`` files (participants with more files form a shard of their own).
+
+    >>> shard_inputs({"T1w": ["/data/sub-01/anat/sub-01_T1w.nii.gz",
+    ...                       "/data/sub-02/anat/sub-02_T1w.nii.gz"],
+    ...               "bold": ["/data/sub-01/func/sub-01_task-rest_bold.nii.gz"]}, 2)
+    [{'T1w': ['/data/sub-01/anat/sub-01_T1w.nii.gz'], \
+'bold': ['/data/sub-01/func/sub-01_task-rest_bold.nii.gz']}, \
+{'T1w': ['/data/sub-02/anat/sub-02_T1w.nii.gz']}]
+
+    :param dict inputs: files per modality, as :attr:`~mriqc.config.workflow.inputs`
+    :return: a list of dictionaries like ``inputs``
+
+    """
+    shards = []
+    size = 0
+    for files in group_participants(inputs).values():
+        nfiles = sum(len(f) for f in files.values())
+        if not shards or size + nfiles > shard_size:
+            shards.append({})
+            size = 0
+        for modality, fnames in files.items():
+            shards[-1].setdefault(modality, []).extend(fnames)
+        size += nfiles
+    return shards
+
+
 def write_bidsignore(deriv_dir):
     bids_ignore = (
         "*.html", "logs/",  # Reports
@@ -0,0 +1,200 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+Resource reservations calibrated on previous runs.
+
+With nipype's resource monitor enabled, the peak memory, CPU utilization and
+duration of every node are recorded in a SQLite store, along with the input
+size (uncompressed, in GB) its reservation depends on (see :func:`node_size_gb`).
+Observations are keyed on the hash of the node's inputs, so that results
+reused from the cache are not counted again.
+Nodes with enough records are then sized from a linear model of peak memory
+on input size, shifted to cover every observation and inflated by a safety
+margin; all other nodes keep the constants set by the workflows.
+
+"""
+import sqlite3
+from collections import namedtuple
+from math import ceil
+from pathlib import Path
+
+MIN_SAMPLES = 5
+"""Observations required before a node type is sized from the store."""
+
+MARGIN = 1.25
+"""Safety factor applied to the fitted memory estimates."""
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS observations (
+    node TEXT NOT NULL,
+    size_gb REAL NOT NULL,
+    mem_peak_gb REAL NOT NULL,
+    cpu_percent REAL,
+    duration REAL,
+    hash TEXT,
+    UNIQUE (node, hash)
+)"""
+
+Calibration = namedtuple(
+    "Calibration", ("intercept", "slope", "threads", "duration", "samples")
+)
+"""Fitted reservations of a node type (``intercept + slope * size_gb`` and CPUs), and its
+median duration (seconds)."""
+
+
+def node_key(node):
+    """Identify the type of a node (its interface and name) across workflows and runs."""
+    return "%s:%s" % (type(node.interface).__name__, node.name)
+
+
+def node_size_gb(node):
+    """
+    Get the input size (GB) the memory of ``node`` is modeled on.
+
+    That is the size of the input file of the branch for a
+    :class:`~mriqc.workflows.utils.SizedNode` once iterables are expanded, and
+    :attr:`~mriqc.config.workflow.biggest_file_gb` otherwise, as plain nodes
+    are given a single reservation when the workflow is built.
+
+    """
+    from .. import config
+    from ..workflows.utils import SizedNode, _branch_size_gb
+
+    size_gb = None
+    if isinstance(node, SizedNode):
+        size_gb = _branch_size_gb(node.parameterization)
+    return config.workflow.biggest_file_gb if size_gb is None else size_gb
+
+
+def fit(observations):
+    """
+    Fit a :class:`Calibration` to ``(size_gb, mem_peak_gb, cpu_percent, duration)`` records.
+
+    >>> fit([(1.0, 2.0, 100.0, 10.0), (2.0, 3.0, 180.0, 20.0), (3.0, 4.5, 150.0, 40.0)])
+    Calibration(intercept=0.9375, slope=1.5625, threads=2, duration=20.0, samples=3)
+    >>> fit([(1.0, 2.0, None, None), (1.0, 2.4, None, None)])
+    Calibration(intercept=3.0, slope=0.0, threads=1, duration=None, samples=2)
+
+    """
+    import numpy as np
+
+    sizes, mems, cpus, durations = (np.array(v, dtype=float) for v in zip(*observations))
+    slope = 0.0
+    if np.unique(sizes).size > 1:
+        slope = max(float(np.polyfit(sizes, mems, 1)[0]), 0.0)
+    # Shift the line to cover every observation
+    intercept = float(np.max(mems - slope * sizes))
+    cpus = cpus[~np.isnan(cpus)]
+    threads = max(int(ceil(cpus.max() / 100)), 1) if cpus.size else 1
+    durations = durations[~np.isnan(durations)]
+    duration = float(np.median(durations)) if durations.size else None
+    return Calibration(
+        round(intercept * MARGIN, 6), round(slope * MARGIN, 6), threads, duration, len(mems)
+    )
+
+
+class CalibrationStore:
+    """Observed resource usage of nodes, keyed on :func:`node_key`."""
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(str(self.db_path), timeout=60)
+
+    def record(
+        self, key, size_gb, mem_peak_gb, cpu_percent=None, duration=None, hashvalue=None
+    ):
+        """Add one observation, unless one was already recorded with the same ``hashvalue``."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO observations VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, size_gb, mem_peak_gb, cpu_percent, duration, hashvalue),
+                )
+        finally:
+            conn.close()
+
+    def models(self, min_samples=MIN_SAMPLES):
+        """Fit all node types with at least ``min_samples`` observations."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT node, size_gb, mem_peak_gb, cpu_percent, duration FROM observations"
+            ).fetchall()
+        finally:
+            conn.close()
+
+        observations = {}
+        for key, *values in rows:
+            observations.setdefault(key, []).append(values)
+        return {
+            key: fit(values)
+            for key, values in observations.items()
+            if len(values) >= min_samples
+        }
+
+
+class CalibrationRecorder:
+    """
+    A nipype ``status_callback`` recording finished nodes into a :class:`CalibrationStore`.
+
+    Nipype also reports nodes found in the cache as finished: their results are
+    recorded once, keyed on the hash of their inputs.
+    Nodes run without submitting (in the main process) are not recorded.
+
+    """
+
+    def __init__(self, db_path):
+        self.store = CalibrationStore(db_path)
+
+    def __call__(self, node, status):
+        from .. import config
+
+        if status != "end" or node.run_without_submitting:
+            return
+        try:
+            runtime = node.result.runtime
+            mem_peak_gb = getattr(runtime, "mem_peak_gb", None)
+            if mem_peak_gb is None:
+                return
+            self.store.record(
+                node_key(node),
+                node_size_gb(node),
+                mem_peak_gb,
+                getattr(runtime, "cpu_percent", None),
+                getattr(runtime, "duration", None),
+                node._get_hashval()[1],
+            )
+        except Exception as exc:  # Never break the execution for bookkeeping
+            config.loggers.utils.warning(
+                "Could not record resource usage of node %s: %s", node.fullname, exc
+            )
+
+
+def calibrate(workflow, models):
+    """
+    Size the nodes of ``workflow`` that have a fitted :class:`Calibration`.
+
+    :return: the number of calibrated nodes
+
+    """
+    from ..workflows.utils import SizedNode
+
+    calibrated = 0
+    for node in workflow._get_all_nodes():
+        model = models.get(node_key(node))
+        if model is None:
+            continue
+        if isinstance(node, SizedNode):
+            node.mem_model = model[:2]
+        else:
+            node._mem_gb = model.intercept + model.slope * node_size_gb(node)
+        # Do not use the setter, which would also change the interface's threads
+        node._n_procs = min(node.n_procs, model.threads)
+        calibrated += 1
+    return calibrated
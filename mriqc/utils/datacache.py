@@ -0,0 +1,125 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+A work-directory cache of uncompressed images.
+
+Large intermediates (e.g., BOLD timeseries) are read by many nodes, and
+inflating the same gzipped file over and over is a major CPU sink.
+The cache keeps one uncompressed copy of each file, with its data block
+aligned to memory pages, so that nibabel memory-maps it and repeated reads
+are served from the page cache.
+
+Every copy carries a set of references (one marker file per *tag*), and copies
+left without references are evicted.
+Concurrent processes coordinate through lock files, so that each copy is
+created only once.
+Copies take the modification time of their original, so that a copy created
+again after eviction hashes the same as before (nipype's timestamp hashing)
+and downstream nodes are not rerun.
+
+"""
+import os
+import fcntl
+from contextlib import contextmanager
+from hashlib import sha1
+from pathlib import Path
+from tempfile import mkstemp
+
+from .nifti import copy_nifti
+
+PAGE_SIZE = 4096
+"""Alignment of the data block within cached files."""
+
+
+def _stem(in_file):
+    name = Path(in_file).name
+    for ext in (".nii.gz", ".nii"):
+        if name.endswith(ext):
+            return name[: -len(ext)]
+    return name
+
+
+def _digest(value):
+    return sha1(str(value).encode()).hexdigest()[:16]
+
+
+class DataCache:
+    """
+    An uncompressed copy of images, shared by the nodes of a workflow.
+
+    Each branch of the workflow acquires the files it will read repeatedly
+    with its own ``tag`` (e.g., the path of the original input), and releases
+    all of them at once when it has finished.
+
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def key(self, in_file):
+        """Identify a particular version of a file."""
+        stat = os.stat(in_file)
+        return "%s_%s" % (
+            _stem(in_file),
+            _digest((os.path.abspath(in_file), stat.st_size, stat.st_mtime_ns)),
+        )
+
+    @contextmanager
+    def _lock(self, key):
+        with open(self.root / ("%s.lock" % key), "w") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def acquire(self, in_file, tag):
+        """
+        Get the path to the cached copy of ``in_file``, registering ``tag`` as a user.
+
+        The copy is created (atomically) if it does not exist yet.
+
+        """
+        key = self.key(in_file)
+        out_file = self.root / ("%s.nii" % key)
+        refs = self.root / ("%s.refs" % key)
+        with self._lock(key):
+            refs.mkdir(exist_ok=True)
+            (refs / _digest(tag)).touch()
+            if not out_file.exists():
+                fd, tmp_file = mkstemp(suffix=".nii", dir=str(self.root))
+                os.close(fd)
+                try:
+                    copy_nifti(in_file, tmp_file, offset=PAGE_SIZE)
+                    stat = os.stat(in_file)
+                    os.utime(tmp_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                    os.replace(tmp_file, str(out_file))
+                except BaseException:
+                    os.unlink(tmp_file)
+                    raise
+        return str(out_file)
+
+    def release(self, tag):
+        """
+        Drop the references held by ``tag``, evicting copies that are not used anymore.
+
+        :return: the number of evicted files
+
+        """
+        marker = _digest(tag)
+        evicted = 0
+        for refs in sorted(self.root.glob("*.refs")):
+            key = refs.name[: -len(".refs")]
+            if not (refs / marker).exists():
+                continue
+            with self._lock(key):
+                (refs / marker).unlink()
+                if any(refs.iterdir()):
+                    continue
+                refs.rmdir()
+                cached = self.root / ("%s.nii" % key)
+                if cached.exists():
+                    cached.unlink()
+                    evicted += 1
+        return evicted
@@ -0,0 +1,203 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+Content digests of input files, computed once and shared.
+
+Provenance, ``mriqc-nib-hash`` and other consumers all need fingerprints of
+the (often multi-GB) input images.
+Digests are computed with large read buffers and stored in a SQLite database
+(typically within the work directory), keyed on the path and validated
+against the inode, size and modification time of the file, so that any
+further request for the same digest of an unchanged file is a lookup.
+The database also works as an index from digests back to files, e.g., to
+find images with identical voxel data.
+
+"""
+import os
+import sqlite3
+from hashlib import new as new_hash, sha1
+from pathlib import Path
+
+BUFSIZE = 16 * 2 ** 20
+"""Size of the read buffer used when hashing (bytes)."""
+
+VOXEL_DIGEST = "image-sha1"
+"""Name under which :func:`voxel_digest` results are stored."""
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS digests (
+    path TEXT NOT NULL,
+    algorithm TEXT NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (path, algorithm)
+)"""
+_INDEX = "CREATE INDEX IF NOT EXISTS digests_value ON digests (algorithm, digest)"
+
+
+def stream_digest(in_file, algorithm="md5", bufsize=BUFSIZE):
+    """Hash the contents of a file, reading it in large blocks."""
+    hasher = new_hash(algorithm)
+    buf = bytearray(bufsize)
+    view = memoryview(buf)
+    with open(in_file, "rb") as fobj:
+        while True:
+            nread = fobj.readinto(buf)
+            if not nread:
+                break
+            hasher.update(view[:nread])
+    return hasher.hexdigest()
+
+
+def voxel_digest(in_file, bufsize=BUFSIZE):
+    """
+    Hash the geometry and (scaled) voxel values of an image, regardless of its container.
+
+    The shape, voxel sizes and affine (rounded to 1e-6) are hashed first, so
+    the same data placed differently in space do not share a digest.
+    Data are then streamed in one pass over the file, in slabs along the last
+    axis (see :py:func:`~mriqc.utils.nifti.stream_blocks`), and hashed in the
+    order NIfTI lays them out on disk (i.e., Fortran order), so that the image
+    is never fully loaded.
+
+    """
+    import numpy as np
+    import nibabel as nb
+    from .nifti import stream_blocks
+
+    img = nb.load(str(in_file))
+    shape = tuple(img.shape)
+    zooms = tuple(float(z) for z in img.header.get_zooms())
+    hasher = sha1(repr((shape, zooms)).encode())
+    # Adding 0.0 turns negative zeros into positive ones
+    hasher.update((np.round(np.asarray(img.affine, dtype=np.float64), 6) + 0.0).tobytes())
+    if not shape:
+        return hasher.hexdigest()
+
+    # Scaled data may be upcast to float64, size slabs for the worst case
+    slab = 8 * int(np.prod(shape[:-1]))
+    step = max(1, bufsize // max(slab, 1))
+    for block in stream_blocks(img, chunk_size=step):
+        hasher.update(np.asanyarray(block).tobytes(order="F"))
+    return hasher.hexdigest()
+
+
+class DigestCache:
+    """
+    A persistent store of file digests.
+
+    Entries are keyed on the absolute path of the file and the name of the
+    digest, and are only served while the inode, size and modification time
+    of the file match those recorded when the digest was computed.
+
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(_SCHEMA)
+            conn.execute(_INDEX)
+
+    def _connect(self):
+        # Other processes may be writing: wait for their locks rather than failing
+        return sqlite3.connect(str(self.db_path), timeout=60)
+
+    def get(self, in_file, algorithm="md5", digest=None):
+        """
+        Retrieve (computing it if necessary) the digest of ``in_file``.
+
+        :param str algorithm: a :mod:`hashlib` algorithm, or the name under which
+            the result of ``digest`` is stored.
+        :param digest: a callable mapping a path to a digest string; by default,
+            the contents of the file are hashed with ``algorithm``.
+
+        """
+        path = os.path.abspath(in_file)
+        stat = os.stat(path)
+        fingerprint = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT inode, size, mtime_ns, digest FROM digests "
+                "WHERE path = ? AND algorithm = ?",
+                (path, algorithm),
+            ).fetchone()
+            if row is not None and tuple(row[:3]) == fingerprint:
+                return row[3]
+
+            value = (digest or (lambda f: stream_digest(f, algorithm)))(path)
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, algorithm) + fingerprint + (value,),
+                )
+            return value
+        finally:
+            conn.close()
+
+    def find(self, value, algorithm="md5"):
+        """List the files recorded with digest ``value``."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT path FROM digests WHERE algorithm = ? AND digest = ? ORDER BY path",
+                (algorithm, value),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows]
+
+
+def file_digest(in_file, algorithm="md5", cache=None, digest=None):
+    """
+    Calculate the digest of a file, going through ``cache`` (a path to the database) if given.
+
+    >>> from tempfile import mkdtemp
+    >>> tmpdir = Path(mkdtemp())
+    >>> _ = (tmpdir / "file.txt").write_text("mriqc")
+    >>> file_digest(tmpdir / "file.txt")
+    '5d54c195454b783e26aee0d6db2ffea7'
+    >>> file_digest(tmpdir / "file.txt", cache=tmpdir / "digests.db")
+    '5d54c195454b783e26aee0d6db2ffea7'
+
+    """
+    if cache is None:
+        return (digest or (lambda f: stream_digest(f, algorithm)))(in_file)
+    return DigestCache(cache).get(in_file, algorithm=algorithm, digest=digest)
+
+
+def digest_files(files, algorithm="md5", cache=None, digest=None, nprocs=1):
+    """Calculate the digests of many files, over a pool of ``nprocs`` processes."""
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+
+    func = partial(file_digest, algorithm=algorithm, cache=cache, digest=digest)
+    if nprocs < 2 or len(files) < 2:
+        return [func(f) for f in files]
+    with ProcessPoolExecutor(max_workers=min(nprocs, len(files))) as pool:
+        return list(pool.map(func, files))
+
+
+def find_duplicates(files, cache=None, nprocs=1):
+    """
+    Find images whose voxel data are identical to those of a preceding image.
+
+    :return: a dictionary mapping each duplicate onto the first of ``files``
+        with the same data
+
+    """
+    digests = digest_files(
+        files, VOXEL_DIGEST, cache=cache, digest=voxel_digest, nprocs=nprocs
+    )
+    originals = {}
+    duplicates = {}
+    for fname, value in zip(files, digests):
+        if value in originals:
+            duplicates[fname] = originals[value]
+        else:
+            originals[value] = fname
+    return duplicates
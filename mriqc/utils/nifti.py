@@ -0,0 +1,352 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Utilities to read and write NIfTI images by blocks of volumes."""
+import os
+import gzip
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nibabel as nb
+from nibabel.openers import Opener
+
+ImageInfo = namedtuple("ImageInfo", ("shape", "zooms", "dtype", "affine", "tr", "nbytes"))
+"""Metadata of an image, see :py:func:`image_info`."""
+
+
+def image_info(img):
+    """
+    Read the metadata of an image from its header, without touching the data.
+
+    :param img: a nibabel image (or a path to one)
+    :return: an :py:class:`ImageInfo` with the ``shape``, ``zooms``, data type
+        (``dtype``, on disk), ``affine``, repetition time (``tr``, as stored in
+        the header, ``None`` for 3D images) and size in bytes of the
+        uncompressed data block (``nbytes``)
+
+    """
+    if not hasattr(img, "dataobj"):
+        img = nb.load(str(img))
+
+    shape = tuple(int(s) for s in img.shape)
+    zooms = tuple(float(z) for z in img.header.get_zooms())
+    dtype = np.dtype(img.get_data_dtype())
+    return ImageInfo(
+        shape=shape,
+        zooms=zooms,
+        dtype=dtype,
+        affine=img.affine,
+        tr=zooms[3] if len(zooms) > 3 else None,
+        nbytes=int(np.prod(shape, dtype=np.int64)) * dtype.itemsize,
+    )
+
+
+def load_data(img, dtype="float32"):
+    """
+    Load the data array of an image.
+
+    With a floating point ``dtype``, scaled (and integer) data are converted
+    directly into that precision, instead of being promoted to double precision
+    as ``get_data()`` does.
+    The array is not cached by the image object, so that it can be released
+    as soon as the caller drops it.
+
+    :param img: a nibabel image (or a path to one)
+    :param dtype: the floating point type of the output, or ``None`` to keep the
+        data type of the stored array (e.g., for masks and segmentations)
+    :return: a :py:class:`numpy.ndarray`
+
+    """
+    if not hasattr(img, "dataobj"):
+        img = nb.load(str(img))
+    if dtype is None:
+        return np.asanyarray(img.dataobj)
+    return img.get_fdata(dtype=np.dtype(dtype), caching="unchanged")
+
+
+INTERMEDIATE_FORMATS = {
+    # policy: (AFNI's ``outputtype``, extension of files written by MRIQC)
+    "compressed": ("NIFTI_GZ", ".nii.gz"),
+    "uncompressed": ("NIFTI", ".nii"),
+}
+"""Formats of intermediate files."""
+
+
+def intermediate_format(policy="compressed"):
+    """
+    Get the output type of AFNI interfaces and the extension of the images
+    written by MRIQC for a given intermediate-format policy.
+
+    >>> intermediate_format("uncompressed")
+    ('NIFTI', '.nii')
+
+    """
+    try:
+        return INTERMEDIATE_FORMATS[policy]
+    except KeyError:
+        raise ValueError(
+            "Unknown intermediate format <%s> (valid: %s)"
+            % (policy, ", ".join(INTERMEDIATE_FORMATS))
+        )
+
+
+def stream_blocks(img, chunk_size=32, start=0, stop=None):
+    """
+    Iterate over the data of an image in blocks along its last axis (e.g., volumes).
+
+    NIfTI data are stored in Fortran order, so these blocks are contiguous on
+    disk: they are read in order through a single open file, and a gzipped file
+    is decompressed only once.
+    Slicing the array proxy instead would reopen (and decompress) the file from
+    its beginning for every block.
+    Blocks are scaled as :py:class:`nibabel.arrayproxy.ArrayProxy` does.
+
+    >>> img = nb.Nifti1Image(np.arange(120, dtype="int16").reshape((2, 3, 4, 5)), np.eye(4))
+    >>> img.header.set_slope_inter(2.0, 1.0)
+    >>> from tempfile import mkdtemp
+    >>> fname = os.path.join(mkdtemp(), "img.nii.gz")
+    >>> img.to_filename(fname)
+    >>> img = nb.load(fname)
+    >>> blocks = list(stream_blocks(img, chunk_size=2, start=1))
+    >>> [block.shape for block in blocks]
+    [(2, 3, 4, 2), (2, 3, 4, 2)]
+    >>> np.array_equal(np.concatenate(blocks, axis=-1), img.get_fdata()[..., 1:])
+    True
+
+    :param img: a nibabel image (or a path to one)
+    :param int chunk_size: number of elements of the last axis per block
+    :param int start: first element (inclusive)
+    :param int stop: last element (exclusive), defaults to the end of the axis
+    :return: a generator of arrays
+
+    """
+    from nibabel.openers import ImageOpener
+    from nibabel.volumeutils import apply_read_scaling
+
+    if not hasattr(img, "dataobj"):
+        img = nb.load(str(img))
+
+    shape = img.shape
+    stop = shape[-1] if stop is None else min(stop, shape[-1])
+    chunk_size = max(chunk_size, 1)
+    proxy = img.dataobj
+    if not nb.is_proxy(proxy) or getattr(proxy, "order", "F") != "F":
+        data = np.asanyarray(proxy)
+        for t0 in range(start, stop, chunk_size):
+            yield data[..., t0:min(t0 + chunk_size, stop)]
+        return
+
+    slab_shape = tuple(shape[:-1])
+    slab_bytes = int(np.prod(slab_shape)) * proxy.dtype.itemsize
+    slope = np.asanyarray(proxy.slope)
+    inter = np.asanyarray(proxy.inter)
+    with ImageOpener(proxy.file_like, "rb") as fobj:
+        # Seeking forward in gzipped files decompresses the skipped data once
+        fobj.seek(proxy.offset + start * slab_bytes)
+        for t0 in range(start, stop, chunk_size):
+            nslabs = min(chunk_size, stop - t0)
+            raw = np.frombuffer(
+                bytearray(fobj.read(nslabs * slab_bytes)), dtype=proxy.dtype
+            ).reshape(slab_shape + (nslabs,), order="F")
+            yield apply_read_scaling(raw, slope, inter)
+
+
+class ParallelGzipFile:
+    """
+    A write-only file object that compresses with a pool of threads.
+
+    Data are split in blocks of ``blocksize`` bytes, and each block is
+    compressed as an independent member of a multi-member gzip file
+    (:rfc:`1952`), which any gzip/zlib-based reader (including nibabel and
+    AFNI) decompresses transparently.
+    zlib releases the GIL, so blocks are compressed concurrently, and at most
+    two blocks per thread are held in memory.
+
+    """
+
+    def __init__(self, filename, nthreads=2, compresslevel=1, blocksize=4 * 1024 ** 2):
+        self._fobj = open(str(filename), "wb")
+        self._pool = ThreadPoolExecutor(max_workers=nthreads)
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._maxpending = 2 * nthreads
+        self._pos = 0
+        self.compresslevel = compresslevel
+        self.blocksize = blocksize
+
+    def tell(self):
+        """Position in the uncompressed stream."""
+        return self._pos
+
+    def write(self, data):
+        self._buffer += data
+        self._pos += len(data)
+        while len(self._buffer) >= self.blocksize:
+            self._submit(bytes(self._buffer[: self.blocksize]))
+            del self._buffer[: self.blocksize]
+        return len(data)
+
+    def _submit(self, block):
+        self._pending.append(
+            self._pool.submit(gzip.compress, block, self.compresslevel, mtime=0)
+        )
+        while len(self._pending) > self._maxpending:
+            self._fobj.write(self._pending.popleft().result())
+
+    def close(self):
+        if self._fobj.closed:
+            return
+        try:
+            if self._buffer or not self._pos:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._fobj.write(self._pending.popleft().result())
+        finally:
+            self._pool.shutdown()
+            self._fobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_chunks(header, chunks, out_file, offset=None, nthreads=1):
+    """
+    Write a single-file NIfTI image from a header and blocks of volumes.
+
+    The header must already describe the final image (shape, data type and
+    scaling), and ``chunks`` must be an iterable of arrays that, concatenated
+    along the last axis, correspond to the full data array.
+    Arrays are cast to the on-disk data type and dumped in Fortran order, so
+    the blocks are written sequentially and never stacked in memory.
+    Header extensions are not written.
+    Output files ending in ``.gz`` are compressed, with a
+    :py:class:`ParallelGzipFile` if ``nthreads`` is larger than one.
+
+    :param header: a :py:class:`~nibabel.nifti1.Nifti1Header`
+    :param chunks: an iterable of arrays
+    :param str out_file: path of the output file
+    :param int offset: offset of the data block in the output file, the
+        minimum if not given
+    :param int nthreads: number of threads compressing the output
+    :return: the path of the output file
+
+    """
+    # Fresh copy without extensions, so that the data offset can be minimal
+    hdr = header.__class__(header.binaryblock, header.endianness, check=False)
+    hdr.set_data_offset(offset or hdr.single_vox_offset)
+    dtype = hdr.get_data_dtype()
+
+    if nthreads > 1 and str(out_file).endswith(".gz"):
+        opener = ParallelGzipFile(out_file, nthreads=nthreads)
+    else:
+        opener = Opener(str(out_file), "wb")
+
+    with opener as fobj:
+        hdr.write_to(fobj)
+        padding = int(hdr.get_data_offset()) - fobj.tell()
+        if padding > 0:
+            fobj.write(b"\x00" * padding)
+
+        for chunk in chunks:
+            fobj.write(np.asanyarray(chunk).astype(dtype, copy=False).tobytes(order="F"))
+
+    return str(out_file)
+
+
+def save_image(img, out_file, nthreads=1, min_size=16 * 1024 ** 2):
+    """
+    Write a NIfTI image, compressing it with several threads when worthwhile.
+
+    Falls back to nibabel's writer for uncompressed outputs, single-threaded
+    writes, images smaller than ``min_size`` bytes, and whenever nibabel must
+    compute the scaling (the data type of the array differs from the header's)
+    or write header extensions.
+
+    :param img: a :py:class:`~nibabel.nifti1.Nifti1Image`
+    :param str out_file: path of the output file
+    :param int nthreads: number of threads compressing the output
+    :return: the path of the output file
+
+    """
+    out_file = str(out_file)
+    data = np.asanyarray(img.dataobj)
+    if (
+        nthreads < 2
+        or not out_file.endswith(".gz")
+        or data.nbytes < min_size
+        or not isinstance(img, nb.Nifti1Image)
+        or data.dtype != img.get_data_dtype()
+        or img.header.extensions
+    ):
+        img.to_filename(out_file)
+        return out_file
+
+    img.update_header()
+    hdr = img.header.copy()
+    hdr.set_data_shape(data.shape)
+    hdr.set_slope_inter(np.nan, np.nan)
+    return write_chunks(
+        hdr, (data[..., i:i + 1] for i in range(data.shape[-1])), out_file,
+        nthreads=nthreads,
+    )
+
+
+def copy_nifti(in_file, out_file, header=None, offset=None, bufsize=64 * 1024 ** 2):
+    """
+    Copy a NIfTI image into a single file, streaming the raw data block.
+
+    The data block is copied byte-to-byte (decompressing and/or compressing as
+    indicated by the extensions of the input and output files), so data types
+    and scaling are preserved and no array is ever built.
+    The input may also be a NIfTI pair.
+    Header extensions are not copied.
+
+    :param str in_file: input NIfTI file
+    :param str out_file: output NIfTI file
+    :param header: a header replacing the input's (e.g., with revised xforms),
+        which must describe the same data block
+    :param int offset: offset of the data block in the output file (e.g., 4096
+        to align data with memory pages), the minimum if not given
+    :return: the path of the output file
+
+    """
+    img = nb.load(str(in_file))
+    in_hdr = img.header
+    hdr = nb.Nifti1Header.from_header(in_hdr if header is None else header)
+    hdr.set_data_offset(offset or hdr.single_vox_offset)
+    nbytes = int(np.prod(in_hdr.get_data_shape(), dtype=np.int64)) * \
+        in_hdr.get_data_dtype().itemsize
+
+    with Opener(img.dataobj.file_like, "rb") as fin:
+        # Skip to the data block (forward reads are cheap for gzipped files)
+        fin.read(int(img.dataobj.offset))
+        with Opener(str(out_file), "wb") as fout:
+            hdr.write_to(fout)
+            fout.write(b"\x00" * (int(hdr.get_data_offset()) - fout.tell()))
+            while nbytes > 0:
+                buf = fin.read(min(bufsize, nbytes))
+                if not buf:
+                    raise IOError("Truncated data block in %s" % in_file)
+                fout.write(buf)
+                nbytes -= len(buf)
+    return str(out_file)
+
+
+def symlink_image(in_file, out_file):
+    """
+    Make ``out_file`` a symbolic link to an image, for steps that leave it unchanged.
+
+    Both paths must have the same extension.
+
+    """
+    out_file = os.path.abspath(str(out_file))
+    if os.path.lexists(out_file):
+        os.unlink(out_file)
+    os.symlink(os.path.abspath(str(in_file)), out_file)
+    return out_file
+
+
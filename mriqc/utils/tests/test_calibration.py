@@ -0,0 +1,93 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Calibration tests"""
+from types import SimpleNamespace
+
+from nipype.interfaces import utility as niu
+from nipype.pipeline import engine as pe
+from nipype.pipeline.engine.utils import _get_valid_pathstr
+
+from ... import config
+from ...engine.costs import is_inline
+from ...workflows.utils import SizedNode
+from ..calibration import MARGIN, CalibrationRecorder, calibrate
+
+
+def _runtime(mem_peak_gb, duration=1.0):
+    return SimpleNamespace(
+        runtime=SimpleNamespace(mem_peak_gb=mem_peak_gb, cpu_percent=100.0, duration=duration)
+    )
+
+
+def _node(name, hashvalue, mem_peak_gb=2.0, run_without_submitting=False, in_file=None,
+          duration=1.0):
+    return SimpleNamespace(
+        name=name,
+        fullname=name,
+        interface=niu.IdentityInterface(fields=["in_file"]),
+        parameterization=["_in_file_%s" % _get_valid_pathstr(in_file)] if in_file else [],
+        run_without_submitting=run_without_submitting,
+        result=_runtime(mem_peak_gb, duration),
+        _get_hashval=lambda: ([], hashvalue),
+    )
+
+
+class _SizedNode(SizedNode):
+    result = None
+
+
+def test_recorder(tmp_path):
+    """Cached results and nodes run in the main process are not recorded."""
+    recorder = CalibrationRecorder(tmp_path / "calibration.db")
+    recorder(_node("a", "h1"), "start")
+    recorder(_node("a", "h1"), "end")
+    recorder(_node("a", "h1", mem_peak_gb=3.0), "end")  # Cached, same hash
+    recorder(_node("a", "h2", mem_peak_gb=3.0), "end")
+    recorder(_node("b", "h3", run_without_submitting=True), "end")
+
+    models = recorder.store.models(min_samples=1)
+    assert set(models) == {"IdentityInterface:a"}
+    assert models["IdentityInterface:a"].samples == 2
+
+
+def test_mixed_store(tmp_path, monkeypatch):
+    """Plain nodes are not sized on the input size of their own branch."""
+    t1w = ["/data/sub-%02d/anat/sub-%02d_T1w.nii.gz" % (i, i) for i in range(5)]
+    bold = ["/data/sub-%02d/func/sub-%02d_task-rest_bold.nii.gz" % (i, i) for i in range(5)]
+    file_size_gb = {fname: 0.02 + 0.005 * i for i, fname in enumerate(t1w)}
+    file_size_gb.update({fname: 0.5 + 0.25 * i for i, fname in enumerate(bold)})
+    monkeypatch.setattr(config.workflow, "file_size_gb", file_size_gb)
+    monkeypatch.setattr(config.workflow, "biggest_file_gb", max(file_size_gb.values()))
+
+    recorder = CalibrationRecorder(tmp_path / "calibration.db")
+    for i, fname in enumerate(t1w):
+        # Memory grows steeply with the (small) size of T1w images
+        recorder(_node(
+            "skullstrip", "t%d" % i, 0.2 + 5 * file_size_gb[fname], in_file=fname,
+            duration=0.1,
+        ), "end")
+    for i, fname in enumerate(bold):
+        node = _SizedNode(niu.IdentityInterface(fields=["in_file"]), name="hmc")
+        node.parameterization = ["_in_file_%s" % _get_valid_pathstr(fname)]
+        node.result = _runtime(0.5 + 2 * file_size_gb[fname])
+        node._get_hashval = lambda i=i: ([], "b%d" % i)
+        recorder(node, "end")
+
+    workflow = pe.Workflow(name="wf", base_dir=str(tmp_path))
+    skullstrip = pe.Node(niu.IdentityInterface(fields=["in_file"]), name="skullstrip")
+    hmc = SizedNode(niu.IdentityInterface(fields=["in_file"]), name="hmc")
+    workflow.connect(skullstrip, "in_file", hmc, "in_file")
+    models = recorder.store.models()
+    assert calibrate(workflow, models) == 2
+
+    # Not extrapolated to the size of the biggest BOLD run
+    peak_t1w = 0.2 + 5 * max(file_size_gb[fname] for fname in t1w)
+    assert skullstrip.mem_gb <= peak_t1w * MARGIN + 1e-6
+    assert is_inline(skullstrip, models)
+
+    # Sized nodes follow the size of their branch
+    for fname in bold:
+        hmc.parameterization = ["_in_file_%s" % _get_valid_pathstr(fname)]
+        hmc._branch_gb = None
+        peak_gb = 0.5 + 2 * file_size_gb[fname]
+        assert peak_gb - 1e-6 <= hmc.mem_gb <= peak_gb * MARGIN + 1e-6
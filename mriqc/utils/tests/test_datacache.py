@@ -0,0 +1,29 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Data cache tests"""
+import os
+
+import numpy as np
+import nibabel as nb
+
+from ..datacache import DataCache
+
+
+def test_reacquire(tmp_path):
+    data = np.random.RandomState(0).normal(size=(10, 11, 12, 5)).astype(np.float32)
+    in_file = str(tmp_path / "bold.nii.gz")
+    nb.Nifti1Image(data, np.eye(4)).to_filename(in_file)
+
+    cache = DataCache(tmp_path / "cache")
+    cached = cache.acquire(in_file, "sub-01")
+    assert np.array_equal(np.asanyarray(nb.load(cached).dataobj), data)
+    stat = os.stat(cached)
+    assert stat.st_mtime_ns == os.stat(in_file).st_mtime_ns
+
+    assert cache.release("sub-01") == 1
+    assert not os.path.exists(cached)
+
+    # Evicted copies come back with the same path, size and timestamp
+    assert cache.acquire(in_file, "sub-01") == cached
+    restat = os.stat(cached)
+    assert (restat.st_size, restat.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns)
@@ -0,0 +1,25 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Digest store tests"""
+import numpy as np
+import nibabel as nb
+
+from ..digest import VOXEL_DIGEST, DigestCache, find_duplicates, voxel_digest
+
+
+def test_find_duplicates(tmp_path):
+    data = np.random.RandomState(0).normal(size=(10, 11, 12, 20)).astype(np.float32)
+    files = [str(tmp_path / name) for name in ("a.nii", "b.nii.gz", "c.nii", "d.nii")]
+    nb.Nifti1Image(data, np.eye(4)).to_filename(files[0])
+    # Same voxel data and geometry, different container
+    nb.Nifti1Image(data, np.eye(4)).to_filename(files[1])
+    # Same voxel data, different affine
+    nb.Nifti1Image(data, np.diag([2.0, 2.0, 2.0, 1.0])).to_filename(files[2])
+    nb.Nifti1Image(data[..., :-1], np.eye(4)).to_filename(files[3])
+
+    # Hashing in small slabs must not change the digest
+    assert voxel_digest(files[0], bufsize=1) == voxel_digest(files[0])
+
+    cache = tmp_path / "digests.db"
+    assert find_duplicates(files, cache=cache) == {files[1]: files[0]}
+    assert DigestCache(cache).find(voxel_digest(files[0]), VOXEL_DIGEST) == files[:2]
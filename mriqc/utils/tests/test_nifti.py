@@ -0,0 +1,47 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""NIfTI writers tests"""
+import gzip
+
+import numpy as np
+import nibabel as nb
+import pytest
+
+from ..nifti import ParallelGzipFile, image_info, save_image
+
+
+@pytest.mark.parametrize("nthreads", [1, 4])
+def test_save_image(tmp_path, nthreads):
+    data = np.random.RandomState(0).normal(size=(20, 21, 22, 30)).astype(np.float32)
+    img = nb.Nifti1Image(data, np.diag([2.0, 2.0, 3.0, 1.0]))
+    img.header.set_xyzt_units("mm", "sec")
+    out_file = save_image(img, tmp_path / "out.nii.gz", nthreads=nthreads, min_size=0)
+
+    out = nb.load(out_file)
+    assert np.array_equal(np.asanyarray(out.dataobj), data)
+    assert np.allclose(out.affine, img.affine)
+    assert out.header.get_xyzt_units() == ("mm", "sec")
+
+
+def test_parallel_gzip_members(tmp_path):
+    payload = np.random.RandomState(1).bytes(1000) * 50
+    with ParallelGzipFile(tmp_path / "out.gz", nthreads=3, blocksize=4096) as fobj:
+        fobj.write(payload[:10000])
+        fobj.write(payload[10000:])
+        assert fobj.tell() == len(payload)
+
+    raw = (tmp_path / "out.gz").read_bytes()
+    assert raw.count(b"\x1f\x8b\x08") >= len(payload) // 4096
+    assert gzip.decompress(raw) == payload
+
+
+def test_image_info(tmp_path):
+    img = nb.Nifti1Image(np.zeros((10, 11, 12, 5), dtype=np.int16), np.eye(4))
+    img.header.set_zooms((2.0, 2.0, 3.0, 2.5))
+    img.to_filename(str(tmp_path / "bold.nii.gz"))
+
+    info = image_info(tmp_path / "bold.nii.gz")
+    assert info.shape == (10, 11, 12, 5)
+    assert info.zooms[:3] == (2.0, 2.0, 3.0)
+    assert info.tr == 2.5
+    assert info.nbytes == 10 * 11 * 12 * 5 * 2
@@ -12,6 +12,8 @@ from matplotlib.gridspec import GridSpec
 from matplotlib.backends.backend_pdf import FigureCanvasPdf as FigureCanvas
 import seaborn as sns
 
+from ..utils.nifti import load_data, stream_blocks
+
 DEFAULT_DPI = 300
 DINA4_LANDSCAPE = (11.69, 8.27)
 DINA4_PORTRAIT = (8.27, 11.69)
@@ -168,14 +170,15 @@ def plot_slice_tern(
 
 
 def plot_spikes(
-    in_file, in_fft, spikes_list, cols=3, labelfmt="t={0:.3f}s (z={1:d})", out_file=None
+    in_file, in_fft, spikes_list, cols=3, labelfmt="t={0:.3f}s (z={1:d})", out_file=None,
+    dtype="float32",
 ):
     from mpl_toolkits.axes_grid1 import make_axes_locatable
 
     nii = nb.as_closest_canonical(nb.load(in_file))
-    fft = nb.load(in_fft).get_data()
+    fft = load_data(in_fft, dtype)
 
-    data = nii.get_data()
+    data = load_data(nii, dtype)
     zooms = nii.header.get_zooms()[:2]
     tstep = nii.header.get_zooms()[-1]
     ntpoints = data.shape[-1]
@@ -253,11 +256,12 @@ def plot_mosaic(
     plot_sagittal=True,
     fig=None,
     zmax=128,
+    dtype="float32",
 ):
 
     if isinstance(img, (str, bytes)):
         nii = nb.as_closest_canonical(nb.load(img))
-        img_data = nii.get_data()
+        img_data = load_data(nii, dtype)
         zooms = nii.header.get_zooms()
     else:
         img_data = img
@@ -274,7 +278,7 @@ def plot_mosaic(
         img_data = _bbox(img_data, mask_file)
 
     if bbox_mask_file is not None:
-        bbox_data = nb.as_closest_canonical(nb.load(bbox_mask_file)).get_data()
+        bbox_data = load_data(nb.as_closest_canonical(nb.load(bbox_mask_file)), None)
         img_data = _bbox(img_data, bbox_data)
 
     z_vals = np.array(list(range(0, img_data.shape[2])))
@@ -301,7 +305,7 @@ def plot_mosaic(
         nrows += 1
 
     if overlay_mask:
-        overlay_data = nb.as_closest_canonical(nb.load(overlay_mask)).get_data()
+        overlay_data = load_data(nb.as_closest_canonical(nb.load(overlay_mask)), None)
 
     # create figures
     if fig is None:
@@ -424,6 +428,232 @@ def plot_fd(fd_file, fd_radius, mean_fd_dist=None, figsize=DINA4_LANDSCAPE):
     return fig
 
 
+# Collapse the labels of the "carpet" segmentation into four groups:
+# 1. cortical GM, 2. cerebellum, 3. deep GM and 4. WM and CSF
+CARPET_LUT = np.zeros((256,), dtype=int)
+CARPET_LUT[1:11] = 1
+CARPET_LUT[255] = 2
+CARPET_LUT[30:99] = 3
+CARPET_LUT[100:201] = 4
+
+
+class _SliceBackground:
+    """Accumulate the slice-wise averages within a background mask, block by block."""
+
+    def __init__(self, bg_mask, ntsteps):
+        # Same averaging as find_peaks: along x first, then along y
+        self.mask = np.asanyarray(bg_mask) > 0
+        self.row_count = self.mask.sum(axis=0)
+        self.row_valid = self.row_count > 0
+        self.slice_count = self.row_valid.sum(axis=0)
+        self.timeseries = np.zeros((self.mask.shape[2], ntsteps))
+
+    def update(self, t0, volumes):
+        rows = np.einsum("ijkt,ijk->jkt", volumes, self.mask, dtype=float)
+        rows[self.row_valid] /= self.row_count[self.row_valid, np.newaxis]
+        self.timeseries[:, t0:t0 + volumes.shape[3]] = rows.sum(axis=0)
+
+    def result(self):
+        valid = self.slice_count > 0
+        return self.timeseries[valid] / self.slice_count[valid, np.newaxis]
+
+
+def slice_background(img, bg_mask, chunk_size=32):
+    """
+    Extract the slice-wise averages of a BOLD series within a background mask.
+
+    The series is read by blocks of ``chunk_size`` volumes (see
+    :py:func:`~mriqc.utils.nifti.stream_blocks`), and averaged like
+    :py:class:`~mriqc.interfaces.functional.Spikes` does.
+
+    :return: the slice-wise background timeseries (slices x timepoints)
+
+    """
+    if not hasattr(img, "dataobj"):
+        img = nb.load(img)
+    background = _SliceBackground(bg_mask, img.shape[3])
+    for t0, volumes in zip(range(0, img.shape[3], chunk_size), stream_blocks(img, chunk_size)):
+        background.update(t0, volumes)
+    return background.result()
+
+
+def carpet_data(img, segmentation, max_rows=800, max_cols=800, chunk_size=32,
+                bg_mask=None):
+    """
+    Extract a bounded sample of voxel timeseries for a carpet plot.
+
+    Rows are sampled systematically within each group of labels of the
+    segmentation, in proportion to the size of the group, and timepoints are
+    averaged within at most ``max_cols`` bins.
+    The timeseries are read by blocks of ``chunk_size`` volumes, in a single
+    pass over the file (see :py:func:`~mriqc.utils.nifti.stream_blocks`), so
+    memory does not depend on the run length nor on the number of voxels.
+
+    If a background mask is given, the slice-wise averages within the mask
+    (see :py:class:`~mriqc.interfaces.functional.Spikes`) are extracted in the
+    same pass.
+
+    :return: the binned timeseries (rows x bins, linearly detrended and
+        z-scored), the group of each row, the bin edges (in volumes), and
+        the slice-wise background timeseries (slices x timepoints, ``None``
+        without ``bg_mask``)
+
+    """
+    if not hasattr(img, "dataobj"):
+        img = nb.load(img)
+    segmentation = CARPET_LUT[np.asanyarray(segmentation).astype(int)]
+    ntsteps = img.shape[3]
+
+    # Stratified sampling of rows, sorted by group
+    groups = [g for g in range(4, 0, -1) if (segmentation == g).any()]
+    counts = np.array([(segmentation == g).sum() for g in groups])
+    nrows = np.maximum(1, np.round(
+        min(max_rows, counts.sum()) * counts / counts.sum())).astype(int)
+    indices, labels = [], []
+    for group, count, n in zip(groups, counts, nrows):
+        ijk = np.argwhere(segmentation == group)
+        indices.append(ijk[np.linspace(0, count - 1, n).astype(int)])
+        labels += [group] * n
+    indices = tuple(np.vstack(indices).T)
+    labels = np.array(labels)
+
+    # Bin timepoints while streaming through the data
+    edges = np.linspace(0, ntsteps, min(max_cols, ntsteps) + 1).astype(int)
+    bins = np.searchsorted(edges, np.arange(ntsteps), side="right") - 1
+    data = np.zeros((len(labels), len(edges) - 1))
+
+    background = None
+    if bg_mask is not None:
+        background = _SliceBackground(bg_mask, ntsteps)
+
+    for t0, volumes in zip(range(0, ntsteps, chunk_size), stream_blocks(img, chunk_size)):
+        t1 = t0 + volumes.shape[3]
+        block = volumes[indices]
+        for b in np.unique(bins[t0:t1]):
+            data[:, b] += block[:, bins[t0:t1] == b].sum(axis=1)
+        if background is not None:
+            background.update(t0, volumes)
+    data /= np.diff(edges)
+
+    # Remove linear trends and standardize
+    time = np.arange(data.shape[1]) - (data.shape[1] - 1) / 2
+    data -= data.mean(axis=1, keepdims=True)
+    if data.shape[1] > 1:
+        slope = data @ time / (time ** 2).sum()
+        data -= slope[:, np.newaxis] * time
+    std = data.std(axis=1, keepdims=True)
+    std[std == 0] = 1.0
+    return data / std, labels, edges, None if background is None else background.result()
+
+
+def plot_carpet(data, labels, edges, tr=None, confounds=None, spikes=None,
+                out_file=None, figsize=(9.5, 8.0)):
+    """
+    Plot a carpet plot (see Power, NeuroImage 154:150-158, 2017).
+
+    The carpet is rasterized, so the size of the output does not depend on the
+    number of rows, while the confound traces above the carpet are drawn as
+    vectors.
+    Traces are reduced to the maximum within each of the time bins of the
+    carpet, so that peaks remain visible when the run is decimated.
+
+    :param data: the carpet, as returned by :py:func:`carpet_data`
+    :param float tr: repetition time, frame numbers are used if not given
+    :param confounds: a list of ``(name, values, units, cutoff)`` tuples
+    :param spikes: slice-wise average of background timeseries (slices x time)
+    :param str out_file: path of the output figure
+
+    """
+    from matplotlib.colors import ListedColormap
+    from matplotlib import gridspec as mgs
+
+    sns.set_style("whitegrid")
+    sns.set_context("paper", font_scale=0.8)
+
+    confounds = confounds or []
+    ntraces = len(confounds) + int(spikes is not None)
+    ntsteps = edges[-1]
+    time_scale = 1.0 if tr is None else tr
+
+    fig = plt.figure(figsize=figsize)
+    grid = mgs.GridSpec(ntraces + 1, 2, wspace=0.0, hspace=0.05,
+                        width_ratios=[1, 100],
+                        height_ratios=[1] * ntraces + [5])
+
+    traces = []
+    if spikes is not None:
+        traces.append(("slice-wise noise average on background", spikes, None, None))
+    traces += list(confounds)
+    palette = sns.color_palette("husl", len(confounds))
+    centers = 0.5 * (edges[:-1] + edges[1:] - 1)
+    for i, (name, values, units, cutoff) in enumerate(traces):
+        ax = fig.add_subplot(grid[i, 1])
+        values = _bin_max(np.asanyarray(values, dtype=float), edges)
+        if values.ndim == 2:
+            colors = plt.get_cmap("viridis")(np.linspace(0, 1, values.shape[0]))
+            for row, color in zip(values, colors):
+                ax.plot(centers, row, color=color, lw=0.5)
+        else:
+            color = palette[i - int(spikes is not None)]
+            ax.plot(centers, values, color=color, lw=0.8)
+            if cutoff is not None:
+                ax.axhline(cutoff, color=color, ls=":", lw=0.8)
+        ax.set_xlim(0, ntsteps - 1)
+        label = name if units is None else "%s [%s]" % (name, units)
+        finite = values[np.isfinite(values)]
+        if finite.size and values.ndim == 1:
+            label += "  (mean: %.2f, max: %.2f)" % (finite.mean(), finite.max())
+        ax.annotate(label, xy=(0.0, 0.7), xycoords="axes fraction", va="center",
+                    ha="left", color=color if values.ndim == 1 else "gray", size=5,
+                    bbox={"boxstyle": "round", "fc": "w", "ec": "none", "alpha": 0.8})
+        ax.grid(False)
+        ax.set_xticks([])
+        ax.set_yticks([])
+        sns.despine(ax=ax, left=True, bottom=True)
+
+    # Group colorbar and carpet
+    ax0 = fig.add_subplot(grid[-1, 0])
+    ax0.imshow(labels[:, np.newaxis], interpolation="none", aspect="auto",
+               cmap=ListedColormap(plt.get_cmap("tab10").colors[:4][::-1]),
+               vmin=1, vmax=4, rasterized=True)
+    ax0.set_xticks([])
+    ax0.set_yticks([])
+    ax0.grid(False)
+
+    ax1 = fig.add_subplot(grid[-1, 1])
+    ax1.imshow(data, interpolation="nearest", aspect="auto", cmap="gray",
+               vmin=-2, vmax=2, rasterized=True,
+               extent=(-0.5, ntsteps - 0.5, data.shape[0] - 0.5, -0.5))
+    ax1.grid(False)
+    ax1.set_yticks([])
+    xticks = np.linspace(0, ntsteps - 1, 6).astype(int)
+    ax1.set_xticks(xticks)
+    ax1.set_xticklabels(["%.02f" % t for t in xticks * time_scale], fontsize=5)
+    ax1.set_xlabel("time (frame #)" if tr is None else "time (s)")
+    sns.despine(ax=ax0, left=True, bottom=True)
+    sns.despine(ax=ax1, left=True, bottom=True)
+
+    if out_file is not None:
+        # The carpet has at most max_rows x max_cols values, no need for more pixels
+        fig.savefig(out_file, bbox_inches="tight", dpi=100)
+        plt.close(fig)
+        return out_file
+    return fig
+
+
+def _bin_max(values, edges):
+    """Maximum of a timeseries (along the last axis) within bins, ignoring NaNs."""
+    if values.shape[-1] == len(edges) - 1:
+        return values
+    with np.errstate(invalid="ignore"):
+        return np.stack([
+            np.nanmax(values[..., t0:t1], axis=-1)
+            if np.isfinite(values[..., t0:t1]).any() else
+            np.full(values.shape[:-1], np.nan)
+            for t0, t1 in zip(edges[:-1], edges[1:])
+        ], axis=-1)
+
+
 def plot_dist(
     main_file,
     mask_file,
@@ -431,8 +661,9 @@ def plot_dist(
     distribution=None,
     xlabel2=None,
     figsize=DINA4_LANDSCAPE,
+    dtype="float32",
 ):
-    data = _get_values_inside_a_mask(main_file, mask_file)
+    data = _get_values_inside_a_mask(main_file, mask_file, dtype)
 
     fig = plt.Figure(figsize=figsize)
     FigureCanvas(fig)
@@ -512,11 +743,11 @@ def _get_mean_fd_distribution(fd_files, fd_radius):
     return mean_fds, max_fds
 
 
-def _get_values_inside_a_mask(main_file, mask_file):
+def _get_values_inside_a_mask(main_file, mask_file, dtype="float32"):
     main_nii = nb.load(main_file)
-    main_data = main_nii.get_data()
+    main_data = load_data(main_nii, dtype)
     nan_mask = np.logical_not(np.isnan(main_data))
-    mask = nb.load(mask_file).get_data() > 0
+    mask = load_data(mask_file, None) > 0
 
     data = main_data[np.logical_and(nan_mask, mask)]
     return data
@@ -527,14 +758,13 @@ def plot_segmentation(anat_file, segmentation, out_file, **kwargs):
 
     vmax = kwargs.get("vmax")
     vmin = kwargs.get("vmin")
+    dtype = kwargs.get("dtype", "float32")
 
     if kwargs.get("saturate", False):
-        vmax = np.percentile(nb.load(anat_file).get_data().reshape(-1), 70)
+        vmax = np.percentile(load_data(anat_file, dtype).reshape(-1), 70)
 
     if vmax is None and vmin is None:
-
-        vmin = np.percentile(nb.load(anat_file).get_data().reshape(-1), 10)
-        vmax = np.percentile(nb.load(anat_file).get_data().reshape(-1), 99)
+        vmin, vmax = np.percentile(load_data(anat_file, dtype).reshape(-1), [10, 99])
 
     disp = plot_anat(
         anat_file,
@@ -553,10 +783,72 @@ def plot_segmentation(anat_file, segmentation, out_file, **kwargs):
     return out_file
 
 
-def _get_limits(nifti_file, only_plot_noise=False):
+def plot_ica_components(maps_img, timecourses, bg_img, tr, out_file,
+                        threshold=2.5, cut_coords=6):
+    """
+    Plot the maps, timecourses and power spectra of independent components.
+
+    :param maps_img: 4D image with one z-scored map per component
+    :param timecourses: array of timecourses (timepoints x components)
+    :param bg_img: background image for the maps (e.g., the mean EPI)
+    :param float tr: repetition time (s)
+    :param str out_file: output svg file
+
+    """
+    from nilearn.image import index_img
+    from nilearn.plotting import plot_stat_map
+
+    ncomps = timecourses.shape[1]
+    ntsteps = timecourses.shape[0]
+    time = np.arange(ntsteps) * tr
+    freqs = np.fft.rfftfreq(ntsteps, d=tr)
+    power = np.abs(np.fft.rfft(timecourses - timecourses.mean(0), axis=0)) ** 2
+    explained = 100 * timecourses.var(axis=0) / timecourses.var(axis=0).sum()
+
+    fig = plt.figure(figsize=(16, 2.2 * ncomps))
+    grid = GridSpec(ncomps, 4, figure=fig, hspace=0.5, wspace=0.25)
+    for i in range(ncomps):
+        ax_map = fig.add_subplot(grid[i, :2])
+        plot_stat_map(
+            index_img(maps_img, i),
+            bg_img=bg_img,
+            display_mode="z",
+            cut_coords=cut_coords,
+            threshold=threshold,
+            colorbar=False,
+            annotate=False,
+            draw_cross=False,
+            black_bg=True,
+            axes=ax_map,
+        )
+        ax_map.set_title(
+            "Component %d (%.1f%% of variance)" % (i + 1, explained[i]),
+            loc="left", fontsize=10,
+        )
+
+        ax_tc = fig.add_subplot(grid[i, 2])
+        ax_tc.plot(time, timecourses[:, i], linewidth=0.8)
+        ax_tc.set_xlim(time[0], time[-1])
+        ax_tc.set_yticks([])
+        ax_tc.set_xlabel("time (s)" if i == ncomps - 1 else "")
+
+        ax_ps = fig.add_subplot(grid[i, 3])
+        ax_ps.plot(freqs, power[:, i], linewidth=0.8)
+        ax_ps.set_xlim(freqs[0], freqs[-1])
+        ax_ps.set_yticks([])
+        ax_ps.set_xlabel("frequency (Hz)" if i == ncomps - 1 else "")
+        sns.despine(ax=ax_tc, left=True)
+        sns.despine(ax=ax_ps, left=True)
+
+    fig.savefig(out_file, format="svg", dpi=DEFAULT_DPI, bbox_inches="tight")
+    plt.close(fig)
+    return out_file
+
+
+def _get_limits(nifti_file, only_plot_noise=False, dtype="float32"):
     if isinstance(nifti_file, str):
         nii = nb.as_closest_canonical(nb.load(nifti_file))
-        data = nii.get_data()
+        data = load_data(nii, dtype)
     else:
         data = nifti_file
 
@@ -42,7 +42,8 @@ from templateflow.api import get as get_template
 from ..interfaces import (StructuralQC, ArtifactMask, ConformImage,
                           ComputeQI2, IQMFileSink, RotationMask)
 from ..interfaces.reports import AddProvenance
-from .utils import get_fwhmx
+from ..utils.nifti import intermediate_format
+from .utils import dynamic_threads, get_fwhmx
 
 
 def anat_qc_workflow(name='anatMRIQC'):
@@ -78,9 +79,11 @@ Building anatomical MRIQC workflow for files: {', '.join(dataset)}.""")
     outputnode = pe.Node(niu.IdentityInterface(fields=['out_json']), name='outputnode')
 
     # 1. Reorient anatomical image
-    to_ras = pe.Node(ConformImage(check_dtype=False), name='conform')
+    _, ext = intermediate_format(config.execution.intermediate_format)
+    to_ras = pe.Node(ConformImage(check_dtype=False, out_ext=ext), name='conform')
     # 2. Skull-stripping (afni)
     asw = skullstrip_wf(n4_nthreads=config.nipype.omp_nthreads, unifize=False)
+    dynamic_threads(asw.get_node('inu_n4'))
     # 3. Head mask
     hmsk = headmsk_wf()
     # 4. Spatial Normalization, using ANTs
@@ -140,6 +143,18 @@ Building anatomical MRIQC workflow for files: {', '.join(dataset)}.""")
         (iqmswf, outputnode, [('outputnode.out_file', 'out_json')])
     ])
 
+    if config.execution.clean_workdir:
+        from ..interfaces import CleanWorkDir
+
+        # Remove large intermediates once IQMs and reports are written
+        clean = pe.Node(CleanWorkDir(), name='clean_workdir')
+        wait_clean = pe.Node(niu.Merge(2), name='wait_clean', run_without_submitting=True)
+        workflow.connect([
+            (iqmswf, wait_clean, [('outputnode.out_file', 'in1')]),
+            (repwf, wait_clean, [('GenerateReport.out_file', 'in2')]),
+            (wait_clean, clean, [('out', 'wait')]),
+        ])
+
     # Upload metrics
     if not config.execution.no_sub:
         from ..interfaces.webapi import UploadIQMs
@@ -185,6 +200,7 @@ def spatial_normalization(name='SpatialNormalization', resolution=2):
         # Request all MultiProc processes when ants_nthreads > n_procs
         num_threads=config.nipype.omp_nthreads,
         mem_gb=3)
+    dynamic_threads(norm)
     norm.inputs.reference_mask = str(
         get_template(tpl_id, resolution=resolution, desc='brain', suffix='mask'))
 
@@ -236,13 +252,13 @@ def compute_iqms(name='ComputeIQMs'):
     fwhm = pe.Node(fwhm_interface, name='smoothness')
 
     # Harmonize
-    homog = pe.Node(Harmonize(), name='harmonize')
+    homog = pe.Node(Harmonize(dtype=config.execution.dtype), name='harmonize')
 
     # Mortamet's QI2
-    getqi2 = pe.Node(ComputeQI2(), name='ComputeQI2')
+    getqi2 = pe.Node(ComputeQI2(dtype=config.execution.dtype), name='ComputeQI2')
 
     # Compute python-coded measures
-    measures = pe.Node(StructuralQC(), 'measures')
+    measures = pe.Node(StructuralQC(dtype=config.execution.dtype), 'measures')
 
     # Project MNI segmentation to T1 space
     invt = pe.MapNode(ants.ApplyTransforms(
@@ -332,12 +348,12 @@ def individual_reports(name='ReportsWorkflow'):
 
     mosaic_zoom = pe.Node(PlotMosaic(
         out_file='plot_anat_mosaic1_zoomed.svg',
-        cmap='Greys_r'), name='PlotMosaicZoomed')
+        cmap='Greys_r', dtype=config.execution.dtype), name='PlotMosaicZoomed')
 
     mosaic_noise = pe.Node(PlotMosaic(
         out_file='plot_anat_mosaic2_noise.svg',
         only_noise=True,
-        cmap='viridis_r'), name='PlotMosaicNoise')
+        cmap='viridis_r', dtype=config.execution.dtype), name='PlotMosaicNoise')
 
     mplots = pe.Node(niu.Merge(pages + extra_pages), name='MergePlots')
     rnode = pe.Node(IndividualReport(), name='GenerateReport')
@@ -365,20 +381,20 @@ def individual_reports(name='ReportsWorkflow'):
 
     plot_segm = pe.Node(PlotContours(
         display_mode='z', levels=[.5, 1.5, 2.5], cut_coords=10,
-        colors=['r', 'g', 'b']), name='PlotSegmentation')
+        colors=['r', 'g', 'b'], dtype=config.execution.dtype), name='PlotSegmentation')
 
     plot_bmask = pe.Node(PlotContours(
         display_mode='z', levels=[.5], colors=['r'], cut_coords=10,
-        out_file='bmask'), name='PlotBrainmask')
+        out_file='bmask', dtype=config.execution.dtype), name='PlotBrainmask')
     plot_airmask = pe.Node(PlotContours(
         display_mode='x', levels=[.5], colors=['r'],
-        cut_coords=6, out_file='airmask'), name='PlotAirmask')
+        cut_coords=6, out_file='airmask', dtype=config.execution.dtype), name='PlotAirmask')
     plot_headmask = pe.Node(PlotContours(
         display_mode='x', levels=[.5], colors=['r'],
-        cut_coords=6, out_file='headmask'), name='PlotHeadmask')
+        cut_coords=6, out_file='headmask', dtype=config.execution.dtype), name='PlotHeadmask')
     plot_artmask = pe.Node(PlotContours(
         display_mode='z', levels=[.5], colors=['r'], cut_coords=10,
-        out_file='artmask', saturate=True), name='PlotArtmask')
+        out_file='artmask', saturate=True, dtype=config.execution.dtype), name='PlotArtmask')
 
     workflow.connect([
         (inputnode, plot_segm, [('in_ras', 'in_file'),
@@ -444,17 +460,20 @@ def headmsk_wf(name='HeadMaskWorkflow'):
     else:
         from nipype.interfaces.dipy import Denoise
         enhance = pe.Node(niu.Function(
-            input_names=['in_file'], output_names=['out_file'], function=_enhance), name='Enhance')
+            input_names=['in_file', 'dtype'], output_names=['out_file'], function=_enhance),
+            name='Enhance')
         estsnr = pe.Node(niu.Function(
-            input_names=['in_file', 'seg_file'], output_names=['out_snr'],
+            input_names=['in_file', 'seg_file', 'dtype'], output_names=['out_snr'],
             function=_estimate_snr), name='EstimateSNR')
         denoise = pe.Node(Denoise(), name='Denoise')
         gradient = pe.Node(niu.Function(
-            input_names=['in_file', 'snr'], output_names=['out_file'],
+            input_names=['in_file', 'snr', 'dtype'], output_names=['out_file'],
             function=image_gradient), name='Grad')
         thresh = pe.Node(niu.Function(
-            input_names=['in_file', 'in_segm'], output_names=['out_file'],
+            input_names=['in_file', 'in_segm', 'dtype'], output_names=['out_file'],
             function=gradient_threshold), name='GradientThreshold')
+        for node in (enhance, estsnr, gradient, thresh):
+            node.inputs.dtype = config.execution.dtype
 
         workflow.connect([
             (inputnode, estsnr, [('in_file', 'in_file'),
@@ -500,7 +519,7 @@ def airmsk_wf(name='AirMaskWorkflow'):
     invt.inputs.input_image = str(get_template(
         'MNI152NLin2009cAsym', resolution=1, desc='head', suffix='mask'))
 
-    qi1 = pe.Node(ArtifactMask(), name='ArtifactMask')
+    qi1 = pe.Node(ArtifactMask(dtype=config.execution.dtype), name='ArtifactMask')
 
     workflow.connect([
         (inputnode, rotmsk, [('in_file', 'in_file')]),
@@ -518,10 +537,11 @@ def airmsk_wf(name='AirMaskWorkflow'):
     return workflow
 
 
-def _binarize(in_file, threshold=0.5, out_file=None):
+def _binarize(in_file, threshold=0.5, out_file=None, dtype='float32'):
     import os.path as op
     import numpy as np
     import nibabel as nb
+    from mriqc.utils.nifti import load_data
 
     if out_file is None:
         fname, ext = op.splitext(op.basename(in_file))
@@ -531,7 +551,7 @@ def _binarize(in_file, threshold=0.5, out_file=None):
         out_file = op.abspath('{}_bin{}'.format(fname, ext))
 
     nii = nb.load(in_file)
-    data = nii.get_data()
+    data = load_data(nii, dtype)
 
     data[data <= threshold] = 0
     data[data > 0] = 1
@@ -543,20 +563,21 @@ def _binarize(in_file, threshold=0.5, out_file=None):
     return out_file
 
 
-def _estimate_snr(in_file, seg_file):
+def _estimate_snr(in_file, seg_file, dtype='float32'):
     import numpy as np
-    import nibabel as nb
     from mriqc.qc.anatomical import snr
-    data = nb.load(in_file).get_data()
-    mask = nb.load(seg_file).get_data() == 2  # WM label
+    from mriqc.utils.nifti import load_data
+    data = load_data(in_file, dtype)
+    mask = load_data(seg_file, None) == 2  # WM label
     out_snr = snr(np.mean(data[mask]), data[mask].std(), mask.sum())
     return out_snr
 
 
-def _enhance(in_file, out_file=None):
+def _enhance(in_file, out_file=None, dtype='float32'):
     import os.path as op
     import numpy as np
     import nibabel as nb
+    from mriqc.utils.nifti import load_data
 
     if out_file is None:
         fname, ext = op.splitext(op.basename(in_file))
@@ -566,7 +587,7 @@ def _enhance(in_file, out_file=None):
         out_file = op.abspath(f'{fname}_enhanced{ext}')
 
     imnii = nb.load(in_file)
-    data = imnii.get_data().astype(np.float32)  # pylint: disable=no-member
+    data = load_data(imnii, dtype)
     range_max = np.percentile(data[data > 0], 99.98)
     range_min = np.median(data[data > 0])
 
@@ -581,11 +602,12 @@ def _enhance(in_file, out_file=None):
     return out_file
 
 
-def image_gradient(in_file, snr, out_file=None):
+def image_gradient(in_file, snr, out_file=None, dtype='float32'):
     """Computes the magnitude gradient of an image using numpy"""
     import os.path as op
     import numpy as np
     import nibabel as nb
+    from mriqc.utils.nifti import load_data
     from scipy.ndimage import gaussian_gradient_magnitude as gradient
 
     if out_file is None:
@@ -596,7 +618,7 @@ def image_gradient(in_file, snr, out_file=None):
         out_file = op.abspath(f'{fname}_grad{ext}')
 
     imnii = nb.load(in_file)
-    data = imnii.get_data().astype(np.float32)  # pylint: disable=no-member
+    data = load_data(imnii, dtype)
     datamax = np.percentile(data.reshape(-1), 99.5)
     data *= 100 / datamax
     grad = gradient(data, 3.0)
@@ -608,11 +630,12 @@ def image_gradient(in_file, snr, out_file=None):
     return out_file
 
 
-def gradient_threshold(in_file, in_segm, thresh=1.0, out_file=None):
+def gradient_threshold(in_file, in_segm, thresh=1.0, out_file=None, dtype='float32'):
     """ Compute a threshold from the histogram of the magnitude gradient image """
     import os.path as op
     import numpy as np
     import nibabel as nb
+    from mriqc.utils.nifti import load_data
     from scipy import ndimage as sim
 
     struc = sim.iterate_structure(sim.generate_binary_structure(3, 2), 2)
@@ -629,12 +652,12 @@ def gradient_threshold(in_file, in_segm, thresh=1.0, out_file=None):
     hdr = imnii.header.copy()
     hdr.set_data_dtype(np.uint8)  # pylint: disable=no-member
 
-    data = imnii.get_data().astype(np.float32)
+    data = load_data(imnii, dtype)
 
     mask = np.zeros_like(data, dtype=np.uint8)  # pylint: disable=no-member
     mask[data > 15.] = 1
 
-    segdata = nb.load(in_segm).get_data().astype(np.uint8)
+    segdata = load_data(in_segm, None).astype(np.uint8)
     segdata[segdata > 0] = 1
     segdata = sim.binary_dilation(
         segdata, struc, iterations=2, border_value=1).astype(np.uint8)
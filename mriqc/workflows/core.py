@@ -2,6 +2,7 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 """The core module combines the existing workflows."""
 from nipype.pipeline.engine import Workflow
+from ..engine.costs import set_inline
 from .anatomical import anat_qc_workflow
 from .functional import fmri_qc_workflow
 
@@ -13,7 +14,22 @@ def init_mriqc_wf():
     workflow = Workflow(name="mriqc_wf")
     workflow.base_dir = config.execution.work_dir
 
-    if "bold" in config.workflow.inputs:
+    if "bold" in config.workflow.inputs and config.workflow.multi_echo:
+        from ..utils.bids import group_multiecho
+
+        runs = group_multiecho(
+            config.execution.layout, config.workflow.inputs["bold"])
+        single = [files[0] for files, _ in runs if len(files) == 1]
+        multi = [(files, echo_times) for files, echo_times in runs if len(files) > 1]
+        if single:
+            workflow.add_nodes([fmri_qc_workflow(dataset=single)])
+        if multi:
+            workflow.add_nodes([fmri_qc_workflow(
+                dataset=[files[0] for files, _ in multi],
+                echoes=[(files[1:], echo_times) for files, echo_times in multi],
+                name="funcMRIQC_ME",
+            )])
+    elif "bold" in config.workflow.inputs:
         workflow.add_nodes([fmri_qc_workflow()])
 
     if set(("T1w", "T2w")).intersection(
@@ -24,4 +40,17 @@ def init_mriqc_wf():
     if not workflow._get_all_nodes():
         return None
 
+    models = None
+    if config.nipype.calibration:
+        from ..utils.calibration import CalibrationStore, calibrate
+
+        models = CalibrationStore(config.nipype.calibration).models()
+        calibrated = calibrate(workflow, models)
+        config.loggers.workflow.info(
+            f"Resource reservations of {calibrated} nodes calibrated from previous runs.")
+
+    # Run cheap nodes within the scheduler instead of submitting them to workers
+    inline = set_inline(workflow, models)
+    config.loggers.workflow.debug(f"{inline} nodes will run within the scheduler.")
+
     return workflow
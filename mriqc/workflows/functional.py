@@ -10,7 +10,9 @@ The functional workflow
 The functional workflow follows the following steps:
 
 #. Sanitize (revise data types and xforms) input data, read
-   associated metadata and discard non-steady state frames.
+   associated metadata and discard non-steady state frames, streaming
+   the time-series by blocks of volumes --
+   :py:class:`~mriqc.interfaces.functional.PrepareBOLD`.
 #. :abbr:`HMC (head-motion correction)` based on ``3dvolreg`` from
    AFNI -- :py:func:`hmc`.
 #. Skull-stripping of the time-series (AFNI) --
@@ -24,15 +26,23 @@ This workflow is orchestrated by :py:func:`fmri_qc_workflow`.
 
 """
 from .. import config
+from ..utils.nifti import intermediate_format
 from nipype.pipeline import engine as pe
 from nipype.interfaces import io as nio
 from nipype.interfaces import utility as niu
+from .utils import SizedNode, dynamic_threads
 
 
-def fmri_qc_workflow(name='funcMRIQC'):
+def fmri_qc_workflow(dataset=None, echoes=None, name='funcMRIQC'):
     """
     Initialize the (f)MRIQC workflow.
 
+    :param list dataset: BOLD runs to process (defaults to all the BOLD inputs).
+    :param list echoes: for multi-echo runs, a list of tuples (one per run in
+        ``dataset``) with the remaining echoes and all the echo times. Motion and
+        the brain mask are then estimated on the first echo of each run (given in
+        ``dataset``), and the remaining echoes are only resampled.
+
     .. workflow::
 
         import os.path as op
@@ -43,32 +53,46 @@ def fmri_qc_workflow(name='funcMRIQC'):
 
     """
     from nipype.interfaces.afni import TStat
-    from nipype.algorithms.confounds import TSNR, NonSteadyStateDetector
-    from niworkflows.interfaces.utils import SanitizeImage
+    from nipype.algorithms.confounds import TSNR
+    from ..interfaces import PrepareBOLD
 
     workflow = pe.Workflow(name=name)
 
+    # Map nodes (echoes) are sized for the largest input
     mem_gb = config.workflow.biggest_file_gb
+    outputtype, ext = intermediate_format(config.execution.intermediate_format)
 
-    dataset = config.workflow.inputs.get("bold", [])
+    if dataset is None:
+        dataset = config.workflow.inputs.get("bold", [])
     config.loggers.workflow.info(f"""\
 Building functional MRIQC workflow for files: {', '.join(dataset)}.""")
 
     # Define workflow, inputs and outputs
     # 0. Get data, put it in RAS orientation
-    inputnode = pe.Node(niu.IdentityInterface(fields=['in_file']), name='inputnode')
+    inputnode = pe.Node(niu.IdentityInterface(
+        fields=['in_file', 'in_echoes', 'echo_times']), name='inputnode')
     inputnode.iterables = [('in_file', dataset)]
+    if echoes is not None:
+        inputnode.iterables += [
+            ('in_echoes', [files for files, _ in echoes]),
+            ('echo_times', [echo_times for _, echo_times in echoes]),
+        ]
+        inputnode.synchronize = True
 
     outputnode = pe.Node(niu.IdentityInterface(
         fields=['qc', 'mosaic', 'out_group', 'out_dvars',
                 'out_fd']), name='outputnode')
 
-    non_steady_state_detector = pe.Node(NonSteadyStateDetector(),
-                                        name="non_steady_state_detector")
-
-    sanitize = pe.Node(SanitizeImage(), name="sanitize",
-                       mem_gb=mem_gb * 4.0)
-    sanitize.inputs.max_32bit = config.execution.float32
+    # Detect non-steady states, fix xforms and drop volumes in one streamed pass
+    sanitize = SizedNode(PrepareBOLD(max_32bit=config.execution.float32, out_ext=ext),
+                         name="sanitize", mem_scale=0.5)
+    if ext.endswith('.gz'):
+        # Compress the output with several threads
+        sanitize.n_procs = config.nipype.omp_nthreads
+    if config.workflow.start_idx is not None:
+        sanitize.inputs.start_idx = config.workflow.start_idx
+    if config.workflow.stop_idx is not None:
+        sanitize.inputs.stop_idx = config.workflow.stop_idx
 
     # Workflow --------------------------------------------------------
 
@@ -79,54 +103,187 @@ Building functional MRIQC workflow for files: {', '.join(dataset)}.""")
     hmcwf.inputs.inputnode.fd_radius = config.workflow.fd_radius
 
     # 2. Compute mean fmri
-    mean = pe.Node(TStat(
-        options='-mean', outputtype='NIFTI_GZ'), name='mean',
-        mem_gb=mem_gb * 1.5)
+    mean = SizedNode(TStat(
+        options='-mean', outputtype=outputtype), name='mean', mem_scale=1.5)
     skullstrip_epi = fmri_bmsk_workflow()
 
     # EPI to MNI registration
-    ema = epi_mni_align()
+    if config.workflow.session_registration:
+        from ..utils.bids import group_bold_sessions
+        ema = epi_mni_align_session(
+            group_bold_sessions(config.execution.layout, dataset))
+        workflow.connect([
+            (inputnode, ema, [('in_file', 'inputnode.in_file')]),
+        ])
+    else:
+        ema = epi_mni_align()
 
     # Compute TSNR using nipype implementation
-    tsnr = pe.Node(TSNR(), name='compute_tsnr', mem_gb=mem_gb * 2.5)
+    tsnr = SizedNode(TSNR(), name='compute_tsnr', mem_scale=2.5)
 
     # 7. Compute IQMs
-    iqmswf = compute_iqms()
+    iqmswf = compute_iqms(multiecho=echoes is not None)
     # Reports
     repwf = individual_reports()
 
+    # Nodes reading the BOLD timeseries, before and after HMC
+    ras, ras_field = sanitize, 'out_file'
+    hmc_epi, hmc_field = hmcwf, 'outputnode.out_file'
+    if config.execution.data_cache:
+        from ..interfaces import CacheData, ReleaseData
+
+        # Read uncompressed copies, deleted once reports and IQMs are written
+        cache_dir = str(config.execution.work_dir / 'datacache')
+        ras = pe.Node(CacheData(cache_dir=cache_dir), name='cache_ras')
+        hmc_epi = pe.Node(CacheData(cache_dir=cache_dir), name='cache_hmc')
+        ras_field = hmc_field = 'out_file'
+        release = pe.Node(ReleaseData(cache_dir=cache_dir), name='release_cache')
+        wait = pe.Node(niu.Merge(2), name='wait_release', run_without_submitting=True)
+
+        workflow.connect([
+            (inputnode, ras, [('in_file', 'tag')]),
+            (inputnode, hmc_epi, [('in_file', 'tag')]),
+            (inputnode, release, [('in_file', 'tag')]),
+            (sanitize, ras, [('out_file', 'in_file')]),
+            (hmcwf, hmc_epi, [('outputnode.out_file', 'in_file')]),
+            (iqmswf, wait, [('outputnode.out_file', 'in1')]),
+            (repwf, wait, [('GenerateReport.out_file', 'in2')]),
+            (wait, release, [('out', 'wait')]),
+        ])
+
+    if config.execution.clean_workdir:
+        from ..interfaces import CleanWorkDir
+
+        # Remove large intermediates once IQMs and reports are written
+        clean = pe.Node(CleanWorkDir(), name='clean_workdir')
+        wait_clean = pe.Node(niu.Merge(2), name='wait_clean', run_without_submitting=True)
+        workflow.connect([
+            (iqmswf, wait_clean, [('outputnode.out_file', 'in1')]),
+            (repwf, wait_clean, [('GenerateReport.out_file', 'in2')]),
+            (wait_clean, clean, [('out', 'wait')]),
+        ])
+
     workflow.connect([
         (inputnode, iqmswf, [('in_file', 'inputnode.in_file')]),
         (inputnode, sanitize, [('in_file', 'in_file')]),
-        (inputnode, non_steady_state_detector, [('in_file', 'in_file')]),
-        (non_steady_state_detector, sanitize, [('n_volumes_to_discard', 'n_volumes_to_discard')]),
-        (sanitize, hmcwf, [('out_file', 'inputnode.in_file')]),
+        (ras, hmcwf, [(ras_field, 'inputnode.in_file')]),
         (mean, skullstrip_epi, [('out_file', 'inputnode.in_file')]),
-        (hmcwf, mean, [('outputnode.out_file', 'in_file')]),
-        (hmcwf, tsnr, [('outputnode.out_file', 'in_file')]),
+        (hmc_epi, mean, [(hmc_field, 'in_file')]),
+        (hmc_epi, tsnr, [(hmc_field, 'in_file')]),
         (mean, ema, [('out_file', 'inputnode.epi_mean')]),
         (skullstrip_epi, ema, [('outputnode.out_file', 'inputnode.epi_mask')]),
-        (sanitize, iqmswf, [('out_file', 'inputnode.in_ras')]),
+        (ras, iqmswf, [(ras_field, 'inputnode.in_ras')]),
         (mean, iqmswf, [('out_file', 'inputnode.epi_mean')]),
-        (hmcwf, iqmswf, [('outputnode.out_file', 'inputnode.hmc_epi'),
-                         ('outputnode.out_fd', 'inputnode.hmc_fd')]),
+        (hmc_epi, iqmswf, [(hmc_field, 'inputnode.hmc_epi')]),
+        (hmcwf, iqmswf, [('outputnode.out_fd', 'inputnode.hmc_fd')]),
         (skullstrip_epi, iqmswf, [('outputnode.out_file', 'inputnode.brainmask')]),
         (tsnr, iqmswf, [('tsnr_file', 'inputnode.in_tsnr')]),
-        (sanitize, repwf, [('out_file', 'inputnode.in_ras')]),
+        (ras, repwf, [(ras_field, 'inputnode.in_ras')]),
         (mean, repwf, [('out_file', 'inputnode.epi_mean')]),
         (tsnr, repwf, [('stddev_file', 'inputnode.in_stddev')]),
         (skullstrip_epi, repwf, [('outputnode.out_file', 'inputnode.brainmask')]),
-        (hmcwf, repwf, [('outputnode.out_fd', 'inputnode.hmc_fd'),
-                        ('outputnode.out_file', 'inputnode.hmc_epi')]),
+        (hmcwf, repwf, [('outputnode.out_fd', 'inputnode.hmc_fd')]),
+        (hmc_epi, repwf, [(hmc_field, 'inputnode.hmc_epi')]),
         (ema, repwf, [('outputnode.epi_parc', 'inputnode.epi_parc'),
                       ('outputnode.report', 'inputnode.mni_report')]),
-        (non_steady_state_detector, iqmswf, [('n_volumes_to_discard', 'inputnode.exclude_index')]),
+        (sanitize, iqmswf, [('n_volumes_to_discard', 'inputnode.exclude_index')]),
         (iqmswf, repwf, [('outputnode.out_file', 'inputnode.in_iqms'),
                          ('outputnode.out_dvars', 'inputnode.in_dvars'),
                          ('outputnode.outliers', 'inputnode.outliers')]),
         (hmcwf, outputnode, [('outputnode.out_fd', 'out_fd')]),
     ])
 
+    if echoes is not None:
+        from nipype.algorithms.confounds import ComputeDVARS
+        from nipype.interfaces.afni import Allineate, TShift, Despike
+        from ..interfaces import Deoblique, FunctionalQC, MultiEchoQC
+        from .utils import get_fwhmx
+
+        # Remaining echoes go through the same volume selection and preprocessing,
+        # and are resampled with the head-motion parameters of the first echo
+        sanitize_echoes = pe.MapNode(
+            PrepareBOLD(max_32bit=config.execution.float32, out_ext=ext),
+            iterfield=['in_file'], name='sanitize_echoes', mem_gb=mem_gb * 0.5)
+        if ext.endswith('.gz'):
+            sanitize_echoes.n_procs = config.nipype.omp_nthreads
+        if config.workflow.start_idx is not None:
+            sanitize_echoes.inputs.start_idx = config.workflow.start_idx
+        if config.workflow.stop_idx is not None:
+            sanitize_echoes.inputs.stop_idx = config.workflow.stop_idx
+
+        # Same order as in the HMC workflow of the first echo
+        prep_echoes = [sanitize_echoes]
+        if config.workflow.correct_slice_timing:
+            prep_echoes.append(pe.MapNode(
+                TShift(outputtype=outputtype), iterfield=['in_file'],
+                name='tshift_echoes'))
+        if config.workflow.despike:
+            prep_echoes.append(pe.MapNode(
+                Despike(outputtype=outputtype), iterfield=['in_file'],
+                name='despike_echoes'))
+        if config.workflow.deoblique:
+            prep_echoes.append(pe.MapNode(
+                Deoblique(), iterfield=['in_file'], name='deoblique_echoes'))
+        for prev, node in zip(prep_echoes[:-1], prep_echoes[1:]):
+            workflow.connect([(prev, node, [('out_file', 'in_file')])])
+
+        hmc_echoes = pe.MapNode(
+            Allineate(final_interpolation='wsinc5', outputtype=outputtype),
+            iterfield=['in_file'], name='hmc_echoes', mem_gb=mem_gb * 2.5)
+
+        merge_echoes = pe.Node(niu.Merge(2, ravel_inputs=True), name='merge_echoes',
+                               run_without_submitting=True)
+
+        meqc = SizedNode(MultiEchoQC(), name='MultiEchoQC', mem_scale=2)
+
+        # FunctionalQC measures of the remaining echoes
+        mean_echoes = pe.MapNode(TStat(options='-mean', outputtype=outputtype),
+                                 iterfield=['in_file'], name='mean_echoes',
+                                 mem_gb=mem_gb * 1.5)
+        tsnr_echoes = pe.MapNode(TSNR(), iterfield=['in_file'], name='tsnr_echoes',
+                                 mem_gb=mem_gb * 2.5)
+        dvars_echoes = pe.MapNode(ComputeDVARS(save_plot=False, save_all=True),
+                                  iterfield=['in_file'], name='dvars_echoes',
+                                  mem_gb=mem_gb * 3)
+        fwhm_echoes = pe.MapNode(get_fwhmx(), iterfield=['in_file'], name='fwhm_echoes')
+        fqc_echoes = pe.MapNode(
+            FunctionalQC(dtype=config.execution.dtype, fd_thres=config.workflow.fd_thres),
+            iterfield=['in_epi', 'in_hmc', 'in_tsnr', 'in_dvars', 'in_fwhm'],
+            name='measures_echoes', mem_gb=mem_gb * 3)
+        echo_iqms = pe.Node(niu.Function(
+            input_names=['multiecho', 'echo_qcs'], output_names=['out_qc'],
+            function=_echo_iqms), name='echo_iqms', run_without_submitting=True)
+
+        workflow.connect([
+            (inputnode, sanitize_echoes, [('in_echoes', 'in_file')]),
+            (sanitize, sanitize_echoes, [
+                ('n_volumes_to_discard', 'n_volumes_to_discard')]),
+            (prep_echoes[-1], hmc_echoes, [('out_file', 'in_file')]),
+            (hmcwf, hmc_echoes, [('outputnode.out_xfm', 'in_matrix'),
+                                 ('outputnode.out_file', 'master')]),
+            (hmc_epi, merge_echoes, [(hmc_field, 'in1')]),
+            (hmc_echoes, merge_echoes, [('out_file', 'in2')]),
+            (merge_echoes, meqc, [('out', 'in_files')]),
+            (inputnode, meqc, [('echo_times', 'echo_times')]),
+            (skullstrip_epi, meqc, [('outputnode.out_file', 'in_mask')]),
+            (hmc_echoes, mean_echoes, [('out_file', 'in_file')]),
+            (hmc_echoes, tsnr_echoes, [('out_file', 'in_file')]),
+            (hmc_echoes, dvars_echoes, [('out_file', 'in_file')]),
+            (skullstrip_epi, dvars_echoes, [('outputnode.out_file', 'in_mask')]),
+            (mean_echoes, fwhm_echoes, [('out_file', 'in_file')]),
+            (skullstrip_epi, fwhm_echoes, [('outputnode.out_file', 'mask')]),
+            (mean_echoes, fqc_echoes, [('out_file', 'in_epi')]),
+            (hmc_echoes, fqc_echoes, [('out_file', 'in_hmc')]),
+            (tsnr_echoes, fqc_echoes, [('tsnr_file', 'in_tsnr')]),
+            (dvars_echoes, fqc_echoes, [('out_all', 'in_dvars')]),
+            (fwhm_echoes, fqc_echoes, [(('fwhm', _tofloat_echoes), 'in_fwhm')]),
+            (skullstrip_epi, fqc_echoes, [('outputnode.out_file', 'in_mask')]),
+            (hmcwf, fqc_echoes, [('outputnode.out_fd', 'in_fd')]),
+            (meqc, echo_iqms, [('out_qc', 'multiecho')]),
+            (fqc_echoes, echo_iqms, [('out_qc', 'echo_qcs')]),
+            (echo_iqms, iqmswf, [('out_qc', 'inputnode.multiecho')]),
+        ])
+
     if config.workflow.fft_spikes_detector:
         workflow.connect([
             (iqmswf, repwf, [('outputnode.out_spikes', 'inputnode.in_spikes'),
@@ -134,17 +291,13 @@ Building functional MRIQC workflow for files: {', '.join(dataset)}.""")
         ])
 
     if config.workflow.ica:
-        from niworkflows.interfaces import segmentation as nws
-        melodic = pe.Node(nws.MELODICRPT(no_bet=True,
-                                         no_mask=True,
-                                         no_mm=True,
-                                         compress_report=False,
-                                         generate_report=True),
-                          name="ICA", mem_gb=max(mem_gb * 5, 8))
+        from ..interfaces import PlotICA
+        ica = SizedNode(PlotICA(n_components=config.workflow.ica_components),
+                        name='ICA', mem_scale=0.5)
         workflow.connect([
-            (sanitize, melodic, [('out_file', 'in_files')]),
-            (skullstrip_epi, melodic, [('outputnode.out_file', 'report_mask')]),
-            (melodic, repwf, [('out_report', 'inputnode.ica_report')])
+            (ras, ica, [(ras_field, 'in_file')]),
+            (skullstrip_epi, ica, [('outputnode.out_file', 'in_mask')]),
+            (ica, repwf, [('out_file', 'inputnode.ica_report')])
         ])
 
     # Upload metrics
@@ -163,10 +316,14 @@ Building functional MRIQC workflow for files: {', '.join(dataset)}.""")
     return workflow
 
 
-def compute_iqms(name='ComputeIQMs'):
+def compute_iqms(name='ComputeIQMs', multiecho=False):
     """
     Initialize the workflow that actually computes the IQMs.
 
+    With ``multiecho``, the measures of
+    :py:class:`~mriqc.interfaces.functional.MultiEchoQC` given through the
+    ``multiecho`` input are also written out.
+
     .. workflow::
 
         from mriqc.workflows.functional import compute_iqms
@@ -184,13 +341,11 @@ def compute_iqms(name='ComputeIQMs'):
     from ..interfaces import FunctionalQC, IQMFileSink
     from ..interfaces.reports import AddProvenance
 
-    mem_gb = config.workflow.biggest_file_gb
-
     workflow = pe.Workflow(name=name)
     inputnode = pe.Node(niu.IdentityInterface(fields=[
         'in_file', 'in_ras',
         'epi_mean', 'brainmask', 'hmc_epi', 'hmc_fd', 'fd_thres', 'in_tsnr', 'metadata',
-        'exclude_index']), name='inputnode')
+        'exclude_index', 'multiecho']), name='inputnode')
     outputnode = pe.Node(niu.IdentityInterface(
         fields=['out_file', 'out_dvars', 'outliers', 'out_spikes', 'out_fft']),
         name='outputnode')
@@ -199,22 +354,23 @@ def compute_iqms(name='ComputeIQMs'):
     inputnode.inputs.fd_thres = config.workflow.fd_thres
 
     # Compute DVARS
-    dvnode = pe.Node(ComputeDVARS(save_plot=False, save_all=True), name='ComputeDVARS',
-                     mem_gb=mem_gb * 3)
+    dvnode = SizedNode(ComputeDVARS(save_plot=False, save_all=True), name='ComputeDVARS',
+                       mem_scale=3)
 
     # AFNI quality measures
     fwhm_interface = get_fwhmx()
     fwhm = pe.Node(fwhm_interface, name='smoothness')
     # fwhm.inputs.acf = True  # add when AFNI >= 16
-    outliers = pe.Node(OutlierCount(fraction=True, out_file='outliers.out'),
-                       name='outliers', mem_gb=mem_gb * 2.5)
+    outliers = SizedNode(OutlierCount(fraction=True, out_file='outliers.out'),
+                         name='outliers', mem_scale=2.5)
 
-    quality = pe.Node(QualityIndex(automask=True), out_file='quality.out',
-                      name='quality', mem_gb=mem_gb * 3)
+    quality = SizedNode(QualityIndex(automask=True), out_file='quality.out',
+                        name='quality', mem_scale=3)
 
-    gcor = pe.Node(GCOR(), name='gcor', mem_gb=mem_gb * 2)
+    gcor = SizedNode(GCOR(), name='gcor', mem_scale=2)
 
-    measures = pe.Node(FunctionalQC(), name='measures', mem_gb=mem_gb * 3)
+    measures = SizedNode(FunctionalQC(dtype=config.execution.dtype), name='measures',
+                         mem_scale=3)
 
     workflow.connect([
         (inputnode, dvnode, [('hmc_epi', 'in_file'),
@@ -271,13 +427,21 @@ def compute_iqms(name='ComputeIQMs'):
         (datasink, outputnode, [('out_file', 'out_file')])
     ])
 
+    if multiecho:
+        workflow.connect([
+            (inputnode, datasink, [('multiecho', 'root2')]),
+        ])
+
     # FFT spikes finder
     if config.workflow.fft_spikes_detector:
         from .utils import slice_wise_fft
         spikes_fft = pe.Node(niu.Function(
-            input_names=['in_file'],
+            input_names=['in_file', 'nthreads', 'dtype'],
             output_names=['n_spikes', 'out_spikes', 'out_fft'],
-            function=slice_wise_fft), name='SpikesFinderFFT')
+            function=slice_wise_fft), name='SpikesFinderFFT',
+            n_procs=config.nipype.omp_nthreads)
+        spikes_fft.inputs.nthreads = config.nipype.omp_nthreads
+        spikes_fft.inputs.dtype = config.execution.dtype
 
         workflow.connect([
             (inputnode, spikes_fft, [('in_ras', 'in_file')]),
@@ -300,12 +464,10 @@ def individual_reports(name='ReportsWorkflow'):
             wf = individual_reports()
 
     """
-    from niworkflows.interfaces.plotting import FMRISummary
-    from ..interfaces import PlotMosaic, Spikes, PlotSpikes
+    from ..interfaces import PlotCarpet, PlotMosaic, PlotSpikes
     from ..interfaces.reports import IndividualReport
 
     verbose = config.execution.verbose_reports
-    mem_gb = config.workflow.biggest_file_gb
 
     pages = 5
     extra_pages = int(verbose) * 4
@@ -322,34 +484,32 @@ def individual_reports(name='ReportsWorkflow'):
 
     spmask = pe.Node(niu.Function(
         input_names=['in_file', 'in_mask'], output_names=['out_file', 'out_plot'],
-        function=spikes_mask), name='SpikesMask', mem_gb=mem_gb * 3.5)
+        function=spikes_mask), name='SpikesMask')
 
-    spikes_bg = pe.Node(Spikes(no_zscore=True, detrend=False), name='SpikesFinderBgMask',
-                        mem_gb=mem_gb * 2.5)
-
-    bigplot = pe.Node(FMRISummary(), name='BigPlot', mem_gb=mem_gb * 3.5)
+    # Spikes are found on the series before head-motion correction, which would
+    # spread them across slices
+    bigplot = SizedNode(PlotCarpet(), name='BigPlot', mem_scale=0.5)
     workflow.connect([
-        (inputnode, spikes_bg, [('in_ras', 'in_file')]),
-        (inputnode, spmask, [('in_ras', 'in_file')]),
+        (inputnode, spmask, [('epi_mean', 'in_file'),
+                             ('brainmask', 'in_mask')]),
         (inputnode, bigplot, [('hmc_epi', 'in_func'),
-                              ('brainmask', 'in_mask'),
+                              ('in_ras', 'in_bg_func'),
                               ('hmc_fd', 'fd'),
                               ('fd_thres', 'fd_thres'),
                               ('in_dvars', 'dvars'),
                               ('epi_parc', 'in_segm'),
                               ('outliers', 'outliers')]),
-        (spikes_bg, bigplot, [('out_tsz', 'in_spikes_bg')]),
-        (spmask, spikes_bg, [('out_file', 'in_mask')]),
+        (spmask, bigplot, [('out_file', 'in_bg_mask')]),
     ])
 
     mosaic_mean = pe.Node(PlotMosaic(
         out_file='plot_func_mean_mosaic1.svg',
-        cmap='Greys_r'),
+        cmap='Greys_r', dtype=config.execution.dtype),
         name='PlotMosaicMean')
 
     mosaic_stddev = pe.Node(PlotMosaic(
         out_file='plot_func_stddev_mosaic2_stddev.svg',
-        cmap='viridis'), name='PlotMosaicSD')
+        cmap='viridis', dtype=config.execution.dtype), name='PlotMosaicSD')
 
     mplots = pe.Node(niu.Merge(pages + extra_pages + int(
         config.workflow.fft_spikes_detector) + int(
@@ -376,7 +536,7 @@ def individual_reports(name='ReportsWorkflow'):
     if config.workflow.fft_spikes_detector:
         mosaic_spikes = pe.Node(PlotSpikes(
             out_file='plot_spikes.svg', cmap='viridis',
-            title='High-Frequency spikes'),
+            title='High-Frequency spikes', dtype=config.execution.dtype),
             name='PlotSpikes')
 
         workflow.connect([
@@ -397,18 +557,18 @@ def individual_reports(name='ReportsWorkflow'):
 
     mosaic_zoom = pe.Node(PlotMosaic(
         out_file='plot_anat_mosaic1_zoomed.svg',
-        cmap='Greys_r'), name='PlotMosaicZoomed')
+        cmap='Greys_r', dtype=config.execution.dtype), name='PlotMosaicZoomed')
 
     mosaic_noise = pe.Node(PlotMosaic(
         out_file='plot_anat_mosaic2_noise.svg',
-        only_noise=True, cmap='viridis_r'), name='PlotMosaicNoise')
+        only_noise=True, cmap='viridis_r', dtype=config.execution.dtype), name='PlotMosaicNoise')
 
     # Verbose-reporting goes here
     from ..interfaces.viz import PlotContours
 
     plot_bmask = pe.Node(PlotContours(
         display_mode='z', levels=[.5], colors=['r'], cut_coords=10,
-        out_file='bmask'), name='PlotBrainmask')
+        out_file='bmask', dtype=config.execution.dtype), name='PlotBrainmask')
 
     workflow.connect([
         (inputnode, plot_bmask, [('epi_mean', 'in_file'),
@@ -438,13 +598,14 @@ def fmri_bmsk_workflow(name='fMRIBrainMask'):
 
     """
     from nipype.interfaces.afni import Automask
+    outputtype, _ = intermediate_format(config.execution.intermediate_format)
     workflow = pe.Workflow(name=name)
     inputnode = pe.Node(niu.IdentityInterface(fields=['in_file']),
                         name='inputnode')
     outputnode = pe.Node(niu.IdentityInterface(fields=['out_file']),
                          name='outputnode')
     afni_msk = pe.Node(Automask(
-        outputtype='NIFTI_GZ'), name='afni_msk')
+        outputtype=outputtype), name='afni_msk')
 
     # Connect brain mask extraction
     workflow.connect([
@@ -467,43 +628,32 @@ def hmc(name='fMRI_HMC'):
 
     """
     from nipype.algorithms.confounds import FramewiseDisplacement
-    from nipype.interfaces.afni import Calc, TShift, Refit, Despike, Volreg
+    from nipype.interfaces.afni import TShift, Despike, Volreg
     from niworkflows.interfaces.registration import EstimateReferenceImage
+    from ..interfaces import Deoblique
 
-    mem_gb = config.workflow.biggest_file_gb
+    outputtype, _ = intermediate_format(config.execution.intermediate_format)
 
     workflow = pe.Workflow(name=name)
 
     inputnode = pe.Node(niu.IdentityInterface(
-        fields=['in_file', 'fd_radius', 'start_idx', 'stop_idx']), name='inputnode')
+        fields=['in_file', 'fd_radius']), name='inputnode')
 
     outputnode = pe.Node(niu.IdentityInterface(
-        fields=['out_file', 'out_fd']), name='outputnode')
+        fields=['out_file', 'out_fd', 'out_xfm']), name='outputnode')
 
-    if any((
-        config.workflow.start_idx is not None,
-        config.workflow.stop_idx is not None
-    )):
-        drop_trs = pe.Node(Calc(expr='a', outputtype='NIFTI_GZ'),
-                           name='drop_trs')
-        workflow.connect([
-            (inputnode, drop_trs, [('in_file', 'in_file_a'),
-                                   ('start_idx', 'start_idx'),
-                                   ('stop_idx', 'stop_idx')]),
-        ])
-    else:
-        drop_trs = pe.Node(niu.IdentityInterface(fields=['out_file']),
-                           name='drop_trs')
-        workflow.connect([
-            (inputnode, drop_trs, [('in_file', 'out_file')]),
-        ])
+    drop_trs = pe.Node(niu.IdentityInterface(fields=['out_file']),
+                       name='drop_trs')
+    workflow.connect([
+        (inputnode, drop_trs, [('in_file', 'out_file')]),
+    ])
 
     gen_ref = pe.Node(EstimateReferenceImage(mc_method="AFNI"), name="gen_ref")
 
     # calculate hmc parameters
-    hmc = pe.Node(
-        Volreg(args='-Fourier -twopass', zpad=4, outputtype='NIFTI_GZ'),
-        name='motion_correct', mem_gb=mem_gb * 2.5)
+    hmc = SizedNode(
+        Volreg(args='-Fourier -twopass', zpad=4, outputtype=outputtype),
+        name='motion_correct', mem_scale=2.5)
 
     # Compute the frame-wise displacement
     fdnode = pe.Node(FramewiseDisplacement(
@@ -512,18 +662,20 @@ def hmc(name='fMRI_HMC'):
     workflow.connect([
         (inputnode, fdnode, [('fd_radius', 'radius')]),
         (gen_ref, hmc, [('ref_image', 'basefile')]),
-        (hmc, outputnode, [('out_file', 'out_file')]),
+        (hmc, outputnode, [('out_file', 'out_file'),
+                           ('oned_matrix_save', 'out_xfm')]),
         (hmc, fdnode, [('oned_file', 'in_file')]),
         (fdnode, outputnode, [('out_file', 'out_fd')]),
     ])
 
     # Slice timing correction, despiking, and deoblique
 
-    st_corr = pe.Node(TShift(outputtype='NIFTI_GZ'), name='TimeShifts')
+    st_corr = pe.Node(TShift(outputtype=outputtype), name='TimeShifts')
 
-    deoblique_node = pe.Node(Refit(deoblique=True), name='deoblique')
+    # Header-only (3drefit would copy the whole timeseries)
+    deoblique_node = pe.Node(Deoblique(), name='deoblique')
 
-    despike_node = pe.Node(Despike(outputtype='NIFTI_GZ'), name='despike')
+    despike_node = pe.Node(Despike(outputtype=outputtype), name='despike')
 
     if all((
         config.workflow.correct_slice_timing,
@@ -650,6 +802,7 @@ def epi_mni_align(name='SpatialNormalization'):
         template='MNI152NLin2009cAsym',
         template_resolution=2, ),
         name='EPI2MNI', num_threads=n_procs, mem_gb=3)
+    dynamic_threads(norm)
 
     # Warp segmentation into EPI space
     invt = pe.Node(ApplyTransforms(
@@ -674,36 +827,191 @@ def epi_mni_align(name='SpatialNormalization'):
     return workflow
 
 
+def epi_mni_align_session(groups, name='SpatialNormalization'):
+    """
+    Estimate the transform into MNI152NLin2009cAsym reusing session references.
+
+    Drop-in replacement for :py:func:`epi_mni_align` for datasets with several
+    runs per session.
+    Only one reference per group of runs (see
+    :py:func:`~mriqc.utils.bids.group_bold_sessions`) is registered to MNI.
+    These registrations are not expanded by the iterables over BOLD runs.
+    Then, each run's mean EPI is aligned to its session reference with a rigid
+    transform, which is composed with the session's transform to resample the
+    "lobe" parcellation into the EPI space.
+
+    .. workflow::
+
+        from mriqc.workflows.functional import epi_mni_align_session
+        from mriqc.testing import mock_config
+        with mock_config():
+            wf = epi_mni_align_session([
+                ['sub-01_ses-1_task-rest_run-1_bold.nii.gz',
+                 'sub-01_ses-1_task-rest_run-2_bold.nii.gz'],
+            ])
+
+    """
+    from nipype.interfaces.afni import Automask
+    from nipype.interfaces.ants import (
+        ApplyTransforms, N4BiasFieldCorrection, Registration
+    )
+    from templateflow.api import get as get_template
+    from niworkflows.interfaces.registration import (
+        EstimateReferenceImage,
+        RobustMNINormalizationRPT as RobustMNINormalization
+    )
+
+    # Get settings
+    testing = config.execution.debug
+    n_procs = config.nipype.nprocs
+    ants_nthreads = config.nipype.omp_nthreads
+    outputtype, _ = intermediate_format(config.execution.intermediate_format)
+
+    workflow = pe.Workflow(name=name)
+    inputnode = pe.Node(niu.IdentityInterface(
+        fields=['in_file', 'epi_mean', 'epi_mask']), name='inputnode')
+    outputnode = pe.Node(niu.IdentityInterface(
+        fields=['epi_mni', 'epi_parc', 'report']), name='outputnode')
+
+    # One reference per session, registered to MNI once
+    sessionnode = pe.Node(niu.IdentityInterface(fields=['ref_file']),
+                          name='sessionnode')
+    sessionnode.inputs.ref_file = [group[0] for group in groups]
+
+    gen_ref = pe.MapNode(EstimateReferenceImage(mc_method='AFNI'),
+                         iterfield=['in_file'], name='SessionReference')
+    ref_mask = pe.MapNode(Automask(outputtype=outputtype),
+                          iterfield=['in_file'], name='SessionMask')
+    ref_n4 = pe.MapNode(N4BiasFieldCorrection(dimension=3, copy_header=True),
+                        iterfield=['input_image'], name='SharpenSessionReference')
+
+    norm = pe.MapNode(RobustMNINormalization(
+        explicit_masking=False,
+        flavor='testing' if testing else 'precise',
+        float=config.execution.ants_float,
+        generate_report=True,
+        moving='boldref',
+        num_threads=ants_nthreads,
+        reference='boldref',
+        reference_image=str(get_template(
+            'MNI152NLin2009cAsym', resolution=2, suffix='boldref')),
+        reference_mask=str(get_template(
+            'MNI152NLin2009cAsym', resolution=2, desc='brain', suffix='mask')),
+        template='MNI152NLin2009cAsym',
+        template_resolution=2, ),
+        iterfield=['moving_image', 'moving_mask'],
+        name='EPI2MNI', num_threads=n_procs, mem_gb=3)
+    dynamic_threads(norm)
+
+    # Pick the session of each run
+    select = pe.Node(niu.Function(
+        function=_select_session,
+        output_names=['ref_image', 'transform', 'epi_mni', 'report']),
+        name='SelectSession', run_without_submitting=True)
+    select.inputs.groups = groups
+
+    n4itk = pe.Node(N4BiasFieldCorrection(dimension=3, copy_header=True),
+                    name='SharpenEPI')
+
+    # Runs of one session share the scanner space, rigid alignment suffices
+    rigid = pe.Node(Registration(
+        dimension=3,
+        float=config.execution.ants_float,
+        transforms=['Rigid'],
+        transform_parameters=[(0.1, )],
+        metric=['Mattes'],
+        metric_weight=[1],
+        radius_or_number_of_bins=[32],
+        sampling_strategy=['Regular'],
+        sampling_percentage=[0.25],
+        number_of_iterations=[[100, 50] if testing else [200, 100, 50]],
+        convergence_threshold=[1e-6],
+        convergence_window_size=[10],
+        shrink_factors=[[2, 1] if testing else [4, 2, 1]],
+        smoothing_sigmas=[[1, 0] if testing else [2, 1, 0]],
+        sigma_units=['vox'],
+        winsorize_lower_quantile=0.005,
+        winsorize_upper_quantile=0.995,
+        num_threads=ants_nthreads),
+        name='EPI2Session', num_threads=ants_nthreads, mem_gb=1)
+    dynamic_threads(rigid)
+
+    # ANTs applies the last transform first: run -> session -> MNI
+    compose = pe.Node(niu.Merge(2, ravel_inputs=True), name='ComposeTransforms',
+                      run_without_submitting=True)
+
+    # Warp segmentation into EPI space
+    invt = pe.Node(ApplyTransforms(
+        float=True,
+        input_image=str(get_template('MNI152NLin2009cAsym', resolution=1,
+                                     desc='carpet', suffix='dseg')),
+        dimension=3, default_value=0, interpolation='MultiLabel'),
+        name='ResampleSegmentation')
+
+    workflow.connect([
+        (sessionnode, gen_ref, [('ref_file', 'in_file')]),
+        (gen_ref, ref_mask, [('ref_image', 'in_file')]),
+        (gen_ref, ref_n4, [('ref_image', 'input_image')]),
+        (ref_mask, norm, [('out_file', 'moving_mask')]),
+        (ref_n4, norm, [('output_image', 'moving_image')]),
+        (inputnode, select, [('in_file', 'in_file')]),
+        (ref_n4, select, [('output_image', 'ref_images')]),
+        (norm, select, [('inverse_composite_transform', 'transforms'),
+                        ('warped_image', 'warped_images'),
+                        ('out_report', 'reports')]),
+        (inputnode, n4itk, [('epi_mean', 'input_image')]),
+        (inputnode, rigid, [('epi_mask', 'fixed_image_masks')]),
+        (n4itk, rigid, [('output_image', 'fixed_image')]),
+        (select, rigid, [('ref_image', 'moving_image')]),
+        (select, compose, [('transform', 'in1')]),
+        (rigid, compose, [('forward_transforms', 'in2')]),
+        (inputnode, invt, [('epi_mean', 'reference_image')]),
+        (compose, invt, [('out', 'transforms')]),
+        (invt, outputnode, [('output_image', 'epi_parc')]),
+        (select, outputnode, [('epi_mni', 'epi_mni'),
+                              ('report', 'report')]),
+    ])
+    return workflow
+
+
 def spikes_mask(in_file, in_mask=None, out_file=None):
-    """Calculate a mask in which check for :abbr:`EM (electromagnetic)` spikes."""
+    """
+    Calculate a mask in which check for :abbr:`EM (electromagnetic)` spikes.
+
+    The mask covers the background of the EPI (given as the mean EPI,
+    ``in_file``), outside of the projection of the dilated brain mask along
+    the longest axis of the brain, plus two slabs at the edges of the
+    field-of-view.
+
+    """
     import os.path as op
     import nibabel as nb
     import numpy as np
-    from nilearn.image import mean_img
     from nilearn.plotting import plot_roi
     from scipy import ndimage as nd
 
+    fname, ext = op.splitext(op.basename(in_file))
+    if ext == '.gz':
+        fname, ext2 = op.splitext(fname)
+        ext = ext2 + ext
     if out_file is None:
-        fname, ext = op.splitext(op.basename(in_file))
-        if ext == '.gz':
-            fname, ext2 = op.splitext(fname)
-            ext = ext2 + ext
         out_file = op.abspath('{}_spmask{}'.format(fname, ext))
-        out_plot = op.abspath('{}_spmask.pdf'.format(fname))
+    out_plot = op.abspath('{}_spmask.pdf'.format(fname))
 
-    in_4d_nii = nb.load(in_file)
-    orientation = nb.aff2axcodes(in_4d_nii.affine)
+    in_nii = nb.load(in_file)
+    orientation = nb.aff2axcodes(in_nii.affine)
 
     if in_mask:
-        mask_data = nb.load(in_mask).get_data()
-        a = np.where(mask_data != 0)
+        mask_data = np.asanyarray(nb.load(in_mask).dataobj) > 0
+        a = np.where(mask_data)
         bbox = np.max(a[0]) - np.min(a[0]), np.max(a[1]) - \
             np.min(a[1]), np.max(a[2]) - np.min(a[2])
         longest_axis = np.argmax(bbox)
 
-        # Input here is a binarized and intersected mask data from previous section
-        dil_mask = nd.binary_dilation(
-            mask_data, iterations=int(mask_data.shape[longest_axis] / 9))
+        # Dilating n times with the 6-connected structuring element is
+        # equivalent to thresholding the taxicab distance to the mask at n
+        dil_mask = nd.distance_transform_cdt(
+            ~mask_data, metric='taxicab') <= int(mask_data.shape[longest_axis] / 9)
 
         rep = list(mask_data.shape)
         rep[longest_axis] = -1
@@ -713,7 +1021,7 @@ def spikes_mask(in_file, in_mask=None, out_file=None):
         rep[longest_axis] = mask_data.shape[longest_axis]
         new_mask_3d = np.logical_not(np.tile(new_mask_2d, rep))
     else:
-        new_mask_3d = np.zeros(in_4d_nii.shape[:3]) == 1
+        new_mask_3d = np.zeros(in_nii.shape[:3]) == 1
 
     if orientation[0] in ['L', 'R']:
         new_mask_3d[0:2, :, :] = True
@@ -722,19 +1030,44 @@ def spikes_mask(in_file, in_mask=None, out_file=None):
         new_mask_3d[:, 0:2, :] = True
         new_mask_3d[:, -3:-1, :] = True
 
-    mask_nii = nb.Nifti1Image(new_mask_3d.astype(np.uint8), in_4d_nii.affine,
-                              in_4d_nii.header)
+    mask_nii = nb.Nifti1Image(new_mask_3d.astype(np.uint8), in_nii.affine,
+                              in_nii.header)
+    mask_nii.set_data_dtype(np.uint8)
     mask_nii.to_filename(out_file)
 
-    plot_roi(mask_nii, mean_img(in_4d_nii), output_file=out_plot)
+    plot_roi(mask_nii, in_nii, output_file=out_plot)
     return out_file, out_plot
 
 
+def _select_session(in_file, groups, ref_images, transforms, warped_images, reports):
+    """Pick the session-level outputs corresponding to one BOLD run."""
+    index = [i for i, group in enumerate(groups) if in_file in group][0]
+    return (ref_images[index], transforms[index], warped_images[index],
+            reports[index])
+
+
 def _mean(inlist):
     import numpy as np
     return np.mean(inlist)
 
 
+def _tofloat_echoes(inlist):
+    from mriqc.workflows.utils import _tofloat
+    return [_tofloat(el) for el in inlist]
+
+
+def _echo_iqms(multiecho, echo_qcs):
+    """Add the FunctionalQC measures of the second and later echoes to ``multiecho``."""
+    out_qc = dict(multiecho)
+    for i, echo_qc in enumerate(echo_qcs, 2):
+        out_qc.update({
+            "me_echo%d_%s" % (i, key): val for key, val in echo_qc.items()
+            # Head-motion and image specs are those of the first echo
+            if not key.startswith(("fd_", "size_", "spacing_"))
+        })
+    return out_qc
+
+
 def _parse_tqual(in_file):
     import numpy as np
     with open(in_file, 'r') as fin:
@@ -4,6 +4,82 @@
 from distutils.version import StrictVersion
 from builtins import range
 
+from nipype.pipeline import engine as pe
+
+from .. import config
+
+
+class SizedNode(pe.Node):
+    """
+    A node whose memory estimate follows the size of the input file of its branch.
+
+    ``mem_scale`` is the memory (GB) required per GB of uncompressed input data.
+    Once the ``in_file`` iterables of the workflow are expanded, each copy of the
+    node finds its input file from its parameterization, and looks its size up
+    in :attr:`~mriqc.config.workflow.file_size_gb`.
+    Nodes outside of any branch, or processing unknown files, are sized with
+    :attr:`~mriqc.config.workflow.biggest_file_gb`.
+    A ``mem_model`` (intercept and slope, see :mod:`mriqc.utils.calibration`)
+    replaces ``mem_scale`` when set.
+
+    """
+
+    def __init__(self, interface, name, mem_scale=1.0, **kwargs):
+        super().__init__(interface, name, **kwargs)
+        self.mem_scale = mem_scale
+        self.mem_model = None
+        self._branch_gb = None
+
+    @property
+    def mem_gb(self):
+        """Get estimated memory (GB)"""
+        size_gb = self._branch_gb
+        if size_gb is None:
+            size_gb = _branch_size_gb(self.parameterization)
+            if size_gb is None:
+                size_gb = config.workflow.biggest_file_gb
+            else:
+                # Parameterization is final once iterables are expanded
+                self._branch_gb = size_gb
+
+        if self.mem_model is not None:
+            intercept, slope = self.mem_model
+            return intercept + slope * size_gb
+        return self.mem_scale * size_gb
+
+
+def dynamic_threads(node):
+    """
+    Let the scheduler pick the threads of a multithreaded ``node`` when it is dispatched.
+
+    With :attr:`~mriqc.config.nipype.min_omp_nthreads` set, ``node`` is given a
+    ``thread_range`` between that value and :attr:`~mriqc.config.nipype.omp_nthreads`,
+    which :class:`~mriqc.engine.plugin.MultiProcPlugin` narrows down to the free cores.
+    Otherwise, the node keeps its fixed number of threads.
+
+    """
+    low = config.nipype.min_omp_nthreads
+    if node is not None and low:
+        high = config.nipype.omp_nthreads
+        node.thread_range = (min(low, high), high)
+    return node
+
+
+def _branch_size_gb(parameterization):
+    from nipype.pipeline.engine.utils import _get_valid_pathstr
+
+    params = "".join(parameterization or [])
+    if not params:
+        return None
+
+    # The longest match wins (e.g., ``.nii.gz`` over ``.nii``)
+    matched, size_gb = 0, None
+    for fname, fsize in (config.workflow.file_size_gb or {}).items():
+        key = "_in_file_%s" % _get_valid_pathstr(fname)
+        if len(key) > matched and key in params:
+            matched, size_gb = len(key), fsize
+    return size_gb
+
 
 def _tofloat(inlist):
     if isinstance(inlist, (list, tuple)):
@@ -14,9 +90,9 @@ def _tofloat(inlist):
 
 def fmri_getidx(in_file, start_idx, stop_idx):
     """Heuristics to set the start and stop indices of fMRI series"""
-    from nibabel import load
     from nipype.interfaces.base import isdefined
-    nvols = load(in_file).shape[3]
+    from mriqc.utils.nifti import image_info
+    nvols = image_info(in_file).shape[3]
     max_idx = nvols - 1
 
     if start_idx is None or not isdefined(start_idx) or start_idx < 0 or start_idx > max_idx:
@@ -38,10 +114,11 @@ def fwhm_dict(fwhm):
             'fwhm_z': fwhm[2], 'fwhm_avg': fwhm[3]}
 
 
-def thresh_image(in_file, thres=0.5, out_file=None):
+def thresh_image(in_file, thres=0.5, out_file=None, dtype='float32'):
     """Thresholds an image"""
     import os.path as op
     import nibabel as nb
+    from mriqc.utils.nifti import load_data
 
     if out_file is None:
         fname, ext = op.splitext(op.basename(in_file))
@@ -51,7 +128,7 @@ def thresh_image(in_file, thres=0.5, out_file=None):
         out_file = op.abspath('{}_thresh{}'.format(fname, ext))
 
     im = nb.load(in_file)
-    data = im.get_data()
+    data = load_data(im, dtype)
     data[data < thres] = 0
     data[data > 0] = 1
     nb.Nifti1Image(
@@ -86,23 +163,26 @@ def spectrum_mask(size):
     return ftmask
 
 
-def slice_wise_fft(in_file, ftmask=None, spike_thres=3., out_prefix=None):
+def slice_wise_fft(in_file, ftmask=None, spike_thres=3., out_prefix=None, nthreads=1,
+                   dtype='float32'):
     """Search for spikes in slices using the 2D FFT"""
     import os.path as op
     import numpy as np
     import nibabel as nb
+    from mriqc.utils.nifti import load_data, save_image
     from mriqc.workflows.utils import spectrum_mask
     from scipy.ndimage.filters import median_filter
     from scipy.ndimage import generate_binary_structure, binary_erosion
     from statsmodels.robust.scale import mad
 
+    fname, ext = op.splitext(op.basename(in_file))
+    if ext == '.gz':
+        fname, ext2 = op.splitext(fname)
+        ext = ext2 + ext
     if out_prefix is None:
-        fname, ext = op.splitext(op.basename(in_file))
-        if ext == '.gz':
-            fname, _ = op.splitext(fname)
         out_prefix = op.abspath(fname)
 
-    func_data = nb.load(in_file).get_data()
+    func_data = load_data(in_file, dtype)
 
     if ftmask is None:
         ftmask = spectrum_mask(tuple(func_data.shape[:2]))
@@ -129,9 +209,9 @@ def slice_wise_fft(in_file, ftmask=None, spike_thres=3., out_prefix=None):
     fft_zscored[idxs] /= sigma[idxs]
 
     # save fft z-scored
-    out_fft = op.abspath(out_prefix + '_zsfft.nii.gz')
+    out_fft = op.abspath(out_prefix + '_zsfft' + ext)
     nii = nb.Nifti1Image(fft_zscored.astype(np.float32), np.eye(4), None)
-    nii.to_filename(out_fft)
+    save_image(nii, out_fft, nthreads=nthreads)
 
     # Find peaks
     spikes_list = []